@@ -0,0 +1,289 @@
+"""
+Control de admisión de la API.
+
+Un pico de kioscos no debe agotar las RU de Cosmos DB ni la cuota de tokens por
+minuto de Azure OpenAI, porque los 429 resultantes hacen fallar el triage de todos.
+Con ADMISSION_ENABLED=true, el middleware de este módulo aplica antes de cada
+petición (por defecto está desactivado):
+
+- Tasa por cliente y por sesión: una cubeta de tokens (rate_limit.py) por dirección
+  del cliente y otra por X-Session-ID. Si la cubeta está vacía, la petición espera su
+  turno hasta ADMISSION_MAX_WAIT segundos; si tendría que esperar más, se rechaza con
+  429 y Retry-After. Las cubetas se consultan todas antes de reservar, así que una
+  petición rechazada no gasta la tasa de las demás.
+- Concurrencia de las rutas que llaman al LLM (LLM_PATHS): como máximo
+  ADMISSION_LLM_CONCURRENCY peticiones en curso. Las demás esperan en una cola de hasta
+  ADMISSION_LLM_QUEUE peticiones durante ADMISSION_LLM_MAX_WAIT segundos; si la cola
+  está llena o la espera se agota, se rechazan con 503 y un Retry-After estimado con
+  la duración reciente de esas peticiones.
+
+Por defecto el cliente es la dirección de la conexión, porque sin un proxy delante
+cualquier cliente podría elegir su clave con una cabecera X-Forwarded-For falsa. Si la
+API se despliega detrás de un balanceador de carga, la dirección de la conexión es la
+del balanceador: con ADMISSION_TRUST_FORWARDED=true el cliente es la última dirección
+de X-Forwarded-For, la que agregó el balanceador. Cada worker tiene sus propias
+cubetas, así que los límites son por worker.
+
+Así, con carga excesiva una parte de las peticiones recibe un rechazo rápido con el
+momento en que conviene reintentar y las admitidas se atienden con la latencia de
+siempre. Los workers del modo trabajo (triage_jobs.py) no pasan por aquí: su
+concurrencia ya la acota TRIAGE_WORKERS.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse
+
+import metrics
+from rate_limit import TokenBucket
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() in ("1", "true", "yes")
+# Peticiones por segundo y ráfaga permitidas a cada cliente y a cada sesión
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "5"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "30"))
+ADMISSION_SESSION_RATE = float(os.getenv("ADMISSION_SESSION_RATE", "2"))
+ADMISSION_SESSION_BURST = float(os.getenv("ADMISSION_SESSION_BURST", "10"))
+# Espera máxima en la cubeta antes de rechazar con 429
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2"))
+# Solo detrás de un balanceador que agrega X-Forwarded-For
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+# Clientes y sesiones con cubeta propia; al superarlo se descarta la menos usada
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+ADMISSION_LLM_CONCURRENCY = int(os.getenv("ADMISSION_LLM_CONCURRENCY", "16"))
+ADMISSION_LLM_QUEUE = int(os.getenv("ADMISSION_LLM_QUEUE", "64"))
+ADMISSION_LLM_MAX_WAIT = float(os.getenv("ADMISSION_LLM_MAX_WAIT", "10"))
+
+# Rutas que llaman al LLM mientras se atiende la petición
+LLM_PATHS = ("/triage/", "/triage/stream")
+# Rutas sin control de admisión
+EXEMPT_PATHS = ("/metrics",)
+
+RATE_LIMITED_MESSAGE = "Demasiadas solicitudes. Espera unos segundos antes de intentarlo de nuevo."
+OVERLOADED_MESSAGE = "El servicio de triage está atendiendo a muchos pacientes. Intenta de nuevo en unos segundos."
+
+
+class Rejected(Exception):
+    """La petición no se admite; `retry_after` son los segundos sugeridos para reintentar."""
+
+    def __init__(self, status_code, detail, retry_after, reason):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class KeyedRateLimiter:
+    """
+    Una cubeta de tokens por clave (cliente o sesión).
+
+    Las cubetas se crean al primer uso y se descartan las menos usadas al superar
+    `max_keys`; una cubeta descartada vuelve llena, así que solo se pierde la deuda
+    de un cliente inactivo.
+
+    Args:
+        rate (float): Peticiones por segundo de cada clave.
+        capacity (float): Ráfaga permitida de cada clave.
+        max_keys (int): Cubetas que se conservan como máximo.
+    """
+
+    def __init__(self, rate, capacity, max_keys=ADMISSION_MAX_KEYS, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, capacity=self.capacity, clock=self.clock)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def reserve(self, key, max_wait=None):
+        """Reserva una petición de `key`; devuelve la espera o None si superaría `max_wait`."""
+        return self.bucket(key).reserve(1.0, max_wait=max_wait)
+
+    def retry_after(self, key):
+        return self.bucket(key).retry_after(1.0)
+
+    def refund(self, key):
+        self.bucket(key).refund(1.0)
+
+
+class ConcurrencyLimiter:
+    """
+    Limita las peticiones en curso y encola brevemente las que exceden el límite.
+
+    Args:
+        limit (int): Peticiones en curso como máximo.
+        max_queue (int): Peticiones en espera como máximo; las siguientes se rechazan.
+        max_wait (float): Segundos que una petición espera en la cola antes de rechazarse.
+    """
+
+    def __init__(self, limit, max_queue=ADMISSION_LLM_QUEUE, max_wait=ADMISSION_LLM_MAX_WAIT):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        # Media móvil de la duración de las peticiones, para estimar Retry-After
+        self.average_duration = None
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def retry_after(self):
+        """Segundos estimados hasta que se atienda la cola actual."""
+        return (self.average_duration or 1.0) * (self.waiting + 1) / self.limit
+
+    def _rejected(self, reason):
+        return Rejected(503, OVERLOADED_MESSAGE, self.retry_after(), reason)
+
+    async def acquire(self):
+        """
+        Espera un lugar libre; lanza Rejected si la cola está llena o no lo obtiene a
+        tiempo. Devuelve la función que lo libera.
+        """
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise self._rejected("llm_queue_full")
+            self.waiting += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                raise self._rejected("llm_wait_timeout") from None
+            finally:
+                self.waiting -= 1
+            metrics.ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, limiter="llm")
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        start = time.perf_counter()
+
+        def release():
+            self.in_flight -= 1
+            self._semaphore.release()
+            duration = time.perf_counter() - start
+            self.average_duration = (duration if self.average_duration is None
+                                     else 0.9 * self.average_duration + 0.1 * duration)
+        return release
+
+
+class AdmissionControl:
+    """
+    Reglas de admisión de la API: tasa por cliente, tasa por sesión y concurrencia del LLM.
+
+    Cualquiera de los limitadores puede ser None para no aplicarlo; con enabled=False
+    se admite todo.
+    """
+
+    def __init__(self, clients=None, sessions=None, llm=None, max_wait=ADMISSION_MAX_WAIT,
+                 trust_forwarded=ADMISSION_TRUST_FORWARDED, llm_paths=LLM_PATHS, exempt_paths=EXEMPT_PATHS,
+                 enabled=ADMISSION_ENABLED):
+        self.clients = clients
+        self.sessions = sessions
+        self.llm = llm
+        self.max_wait = max_wait
+        self.trust_forwarded = trust_forwarded
+        self.llm_paths = llm_paths
+        self.exempt_paths = exempt_paths
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls):
+        return cls(clients=KeyedRateLimiter(ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST),
+                   sessions=KeyedRateLimiter(ADMISSION_SESSION_RATE, ADMISSION_SESSION_BURST),
+                   llm=ConcurrencyLimiter(ADMISSION_LLM_CONCURRENCY))
+
+    def client_key(self, scope):
+        headers = dict(scope.get("headers") or ())
+        if self.trust_forwarded and b"x-forwarded-for" in headers:
+            return headers[b"x-forwarded-for"].decode("latin-1").split(",")[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else "desconocido"
+
+    @staticmethod
+    def session_key(scope):
+        session_id = dict(scope.get("headers") or ()).get(b"x-session-id")
+        return session_id.decode("latin-1") if session_id else None
+
+    def _reserve_rate(self, scope):
+        """
+        Reserva un turno en cada cubeta de la petición, o en ninguna si alguna la haría
+        esperar más de max_wait. Devuelve la espera y las cubetas reservadas.
+        """
+        limits = [(reason, limiter, key) for reason, limiter, key in (
+            ("client_rate", self.clients, self.client_key(scope)),
+            ("session_rate", self.sessions, self.session_key(scope))) if limiter is not None and key is not None]
+        # Sin await entre la consulta y la reserva: ninguna otra petición se intercala
+        for reason, limiter, key in limits:
+            retry_after = limiter.retry_after(key)
+            if retry_after > self.max_wait:
+                raise Rejected(429, RATE_LIMITED_MESSAGE, retry_after, reason)
+        wait = max((limiter.reserve(key) for _, limiter, key in limits), default=0.0)
+        return wait, [(limiter, key) for _, limiter, key in limits]
+
+    async def admit(self, scope):
+        """
+        Espera el turno de la petición; lanza Rejected si no se admite. Devuelve la
+        función que hay que llamar cuando la petición termina.
+        """
+        if not self.enabled or scope["path"] in self.exempt_paths:
+            return _admitted
+        reserved = []
+        try:
+            wait, reserved = self._reserve_rate(scope)
+            if wait:
+                metrics.ADMISSION_WAIT_SECONDS.observe(wait, limiter="rate")
+                await asyncio.sleep(wait)
+            if self.llm is not None and scope["path"] in self.llm_paths:
+                return await self.llm.acquire()
+        except Rejected as e:
+            # La petición no se atiende: se devuelven los turnos que ya había reservado
+            for limiter, key in reserved:
+                limiter.refund(key)
+            metrics.ADMISSION_REJECTIONS.inc(reason=e.reason)
+            raise
+        return _admitted
+
+
+def _admitted():
+    pass
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que aplica AdmissionControl. Al envolver la aplicación completa,
+    el lugar de una petición que llama al LLM se libera cuando termina el cuerpo de la
+    respuesta en streaming y las tareas en segundo plano de la petición.
+    """
+
+    def __init__(self, app, control):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            release = await self.control.admit(scope)
+        except Rejected as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code,
+                                    headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            release()
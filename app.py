@@ -1,21 +1,50 @@
 import streamlit as st
-import functions as fu
-from azure.cosmos import CosmosClient, exceptions
+import metrics
+import red_flags
+from azure.cosmos import exceptions
 from dotenv import load_dotenv
+from functions import TRIAGE_SYSTEM_PROMPT, build_triage_request
+from repository import VISIT_SUMMARY_FIELDS, create_repository
+from triage_jobs import (DONE, FAILED, STREAMLIT_JOBS, TRIAGE_JOB_POLL_INTERVAL, TRIAGE_JOBS_DB_PATH, TRIAGE_WORKERS,
+                         JobQueue, start_worker_thread, triage_payload)
+from visit_writes import save_fields, start_visit
 import os
+import time
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Cosmos DB Configuración
-COSMOS_URI = os.getenv("COSMOS_URI")
-COSMOS_KEY = os.getenv("COSMOS_KEY")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+# En modo borrador la visita se guarda con una sola escritura al obtener el triage
+VISIT_DRAFT_MODE = os.getenv("VISIT_DRAFT_MODE", "false").lower() in ("1", "true", "yes")
 
-client = CosmosClient(COSMOS_URI, COSMOS_KEY)
-database = client.get_database_client(DATABASE_NAME)
-container = database.get_container_client(CONTAINER_NAME)
+# Visitas por página en el historial de la barra lateral
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+# Modo clínico: el historial de la barra lateral admite cualquier identificación. Sin él,
+# en los kioscos, solo muestra el del paciente que se identificó en la sesión
+CLINICIAN_MODE = os.getenv("CLINICIAN_MODE", "false").lower() in ("1", "true", "yes")
+
+# Panel de métricas en la barra lateral; también se activa con ?debug=1 en la URL
+METRICS_PANEL = os.getenv("METRICS_PANEL", "false").lower() in ("1", "true", "yes")
+
+# Repositorio de pacientes (Cosmos DB, memoria o SQLite según REPOSITORY_BACKEND).
+# Se crea una sola vez por proceso y se reutiliza en cada rerun y en todas las sesiones.
+@st.cache_resource
+def get_repository():
+    return create_repository()
+
+repository = get_repository()
+
+# Cola del triage en modo trabajo. Los workers corren en un hilo de este proceso (con
+# TRIAGE_WORKERS=0, en un proceso aparte: python triage_jobs.py) y escriben el resultado
+# en la visita; el paso 5 solo encola y consulta el trabajo.
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue(TRIAGE_JOBS_DB_PATH, kind=STREAMLIT_JOBS)
+    if TRIAGE_WORKERS > 0:
+        start_worker_thread(queue, repository)
+    return queue
+
+job_queue = get_job_queue()
 
 # Inicialización de session_state
 if 'new_id' not in st.session_state:
@@ -27,33 +56,32 @@ if 'step' not in st.session_state:
 # Inicializar 'id' en session_state para evitar errores
 if 'id' not in st.session_state:
     st.session_state['id'] = None
+# Última versión conocida del registro de la visita
+if 'visit' not in st.session_state:
+    st.session_state['visit'] = None
+# Historial abierto en la barra lateral: paciente, página actual y tokens de las páginas anteriores
+if 'history' not in st.session_state:
+    st.session_state['history'] = None
+# Trabajo de triage en curso y alerta de la señal de alarma que se muestra mientras tanto
+if 'triage_job' not in st.session_state:
+    st.session_state['triage_job'] = None
+    st.session_state['triage_alert'] = None
+
+# Las métricas de Cosmos DB y del LLM de este rerun se atribuyen al paso actual
+metrics.set_endpoint(f"streamlit/paso-{st.session_state.step}")
 
 # Función para avanzar al siguiente paso
 def next_step():
     st.session_state.step += 1
 
+# Reinicia el kiosco para el siguiente paciente: no queda nada del anterior, ni su historial
+def restart():
+    st.session_state.update(step=0, identification=None, id=None, visit=None, history=None, triage_job=None,
+                            triage_alert=None)
+
 # Función para generar un ID progresivo
 def get_next_id():
-    try:
-        # Query para obtener todos los valores de ID
-        query = "SELECT VALUE c.id FROM c"
-        id_results = list(container.query_items(query=query, enable_cross_partition_query=True))
-        
-        # Convertir todos los IDs a enteros, ignorando aquellos que no puedan convertirse
-        numeric_ids = [int(id) for id in id_results if id.isdigit()]
-
-        if numeric_ids:
-            # Incrementa el ID más alto en 1
-            return str(max(numeric_ids) + 1)
-        else:
-            return "1"  # Si no hay documentos o ningún ID es numérico, empieza en "1"
-    except exceptions.CosmosResourceNotFoundError:
-        # En caso de que no haya registros o ocurra un error con la consulta
-        st.error("No se encontraron documentos en la base de datos.")
-        return "1"  # Empieza desde el ID "1" si no existen documentos
-
-
-
+    return repository.next_visit_id()
 
 
 # CSS to style buttons
@@ -110,12 +138,11 @@ if st.session_state.step == 1:
         if identification:
             try:
                 # Verificar si el paciente ya existe en la base de datos
-                query = f"SELECT * FROM c WHERE c.identification = '{identification}'"
-                items = list(container.query_items(query=query, enable_cross_partition_query=True))
+                user_item = repository.find_patient(identification)
 
-                if items:
-                    user_item = items[0]
+                if user_item:
                     st.success(f"Paciente {user_item['name']} encontrado.")
+                    st.session_state['identification'] = user_item['identification']
                     
                     # Asignar un nuevo ID para crear un registro nuevo aunque el paciente ya exista
                     st.session_state['new_id'] = get_next_id()
@@ -130,7 +157,7 @@ if st.session_state.step == 1:
                     }
 
                     # Insertar el nuevo registro en la base de datos
-                    container.create_item(new_user_data)
+                    st.session_state['visit'] = start_visit(repository, new_user_data, draft=VISIT_DRAFT_MODE)
                     st.success(f"🎉 Nuevo registro creado para {user_item['name']} con ID: {st.session_state['new_id']}.")
 
                     # Pasar al paso 3 para ingresar datos de salud
@@ -171,7 +198,8 @@ if st.session_state.step == 2:
                 }
                 try:
                     # Crear un nuevo registro en Cosmos DB con el nuevo ID
-                    container.create_item(user_data)
+                    st.session_state['visit'] = start_visit(repository, user_data, draft=VISIT_DRAFT_MODE)
+                    repository.register_patient(st.session_state['identification'], name, age, sex)
                     st.success(f"🎉 Datos básicos guardados correctamente con ID: {st.session_state['new_id']}.")
                     st.session_state.step = 3  # Avanzar al paso de salud después de guardar los datos
                 except exceptions.CosmosResourceExistsError:
@@ -205,15 +233,15 @@ if st.session_state.step == 3:
             }
 
             try:
-                # Retrieve user data and update it with health information
-                id = str(st.session_state['new_id'])
-                user_item = container.read_item(item=id, partition_key=id)
-                user_item.update(health_data)
-                container.upsert_item(user_item)
+                # Enviar solo los datos de salud como actualización parcial del registro
+                st.session_state['visit'] = save_fields(repository, st.session_state['visit'], health_data,
+                                                        draft=VISIT_DRAFT_MODE)
                 st.success("🎉 Datos de salud guardados correctamente.")
                 st.session_state.step = 4  # Move to the symptoms form step
             except exceptions.CosmosResourceNotFoundError:
                 st.error("⚠️ No se encontró el registro para esta identificación.")
+            except exceptions.CosmosAccessConditionFailedError:
+                st.error("⚠️ El registro fue modificado desde otra sesión.")
 
 
 
@@ -229,15 +257,9 @@ if st.session_state.step == 4:
         if submit_symptoms:
             if symptoms:
                 try:
-                    # Recuperar el identificador y los datos del usuario
-                    id = st.session_state['new_id']
-                    user_item = container.read_item(item=id, partition_key=id)
-                    
-                    # Agregar los síntomas a los datos del usuario
-                    user_item['symptoms'] = symptoms
-                    
-                    # Actualizar o insertar los datos en la base de datos
-                    container.upsert_item(user_item)
+                    # Agregar los síntomas a los datos del usuario con una actualización parcial
+                    st.session_state['visit'] = save_fields(repository, st.session_state['visit'],
+                                                            {"symptoms": symptoms}, draft=VISIT_DRAFT_MODE)
                     st.success("🎉 Síntomas guardados correctamente.")
                     
                     # Avanzar al siguiente paso
@@ -254,40 +276,65 @@ if st.session_state.step == 4:
 if st.session_state.step == 5:
     st.markdown("<h2 style='color: #ff6347;'>📊 Paso 5: Resultado del Triage generado por IA</h2>", unsafe_allow_html=True)
     
+    # Permite a los clínicos pedir una respuesta nueva en lugar de la guardada en caché
+    fresh = st.checkbox("🔄 Generar una respuesta nueva (sin caché)")
+
     if st.button("🔍 Obtener resultado del Triage"):
         try:
-            # Usar 'new_id' como el identificador único
-            identification = str(st.session_state['new_id'])
-            user_item = container.read_item(item=identification, partition_key=identification)
+            # La sesión ya tiene la última versión del registro; no hace falta volver a leerlo
+            user_item = st.session_state['visit']
             
             # Verificar que los datos necesarios están presentes
             if all(key in user_item for key in ['name', 'age', 'symptoms', 'injury', 'smoking', 'allergies', 'obesity', 'hypertension']):
-                system_prompt = "Eres un sistema experto en triage médico. Proporciona el nivel de urgencia basado en los siguientes datos del paciente."
-                pregunta = (f"Paciente {user_item['name']}, edad {user_item['age']}, "
-                            f"Síntomas: {user_item['symptoms']}, Lesión: {user_item['injury']}, "
-                            f"Fuma: {user_item['smoking']}, Alergias: {user_item['allergies']}, "
-                            f"Obesidad: {user_item['obesity']}, Hipertensión: {user_item['hypertension']}.")
-
-                # Generar la respuesta de la IA
-                response = fu.generate_prompt_without_retrieval_new(system_prompt, pregunta)
-
-                # Mostrar el resultado del triage
-                st.markdown("<h3 style='color: green;'>✅ Resultado del Triage:</h3>", unsafe_allow_html=True)
-                st.write(response)
-
-                # Guardar la respuesta de la IA en la base de datos
-                user_item['triage_result'] = response
-                container.upsert_item(user_item)
-                
-                st.session_state.step = 6
+                # El mismo prompt que la API, así ambas interfaces comparten la caché del triage
+                pregunta, _ = build_triage_request(user_item)
+
+                # Señal de alarma: se muestra y se guarda su nivel antes de esperar al modelo
+                flag = red_flags.check(user_item)
+                if flag is not None:
+                    user_item = save_fields(repository, user_item, {
+                        "urgency_level": flag.urgency_level, "urgency_rationale": flag.urgency_rationale,
+                    }, draft=VISIT_DRAFT_MODE)
+                    st.session_state['visit'] = user_item
+
+                # El triage se genera en un worker; esta página consulta el trabajo hasta que termina
+                st.session_state['triage_job'] = job_queue.enqueue(triage_payload(
+                    TRIAGE_SYSTEM_PROMPT, pregunta, user_item, use_cache=not fresh, flag=flag, draft=VISIT_DRAFT_MODE))
+                st.session_state['triage_alert'] = red_flags.alert_message(flag) if flag else None
             else:
                 st.error("⚠️ Los datos del paciente están incompletos.")
         
         except exceptions.CosmosResourceNotFoundError:
             st.error("⚠️ No se encontraron los datos del usuario.")
+        except exceptions.CosmosAccessConditionFailedError:
+            st.error("⚠️ El registro fue modificado desde otra sesión.")
         except Exception as e:
             st.error(f"⚠️ Error al generar el triage: {e}")
 
+    if st.session_state['triage_job']:
+        if st.session_state['triage_alert']:
+            st.error(st.session_state['triage_alert'])
+        job = job_queue.get(st.session_state['triage_job'])
+        if job is None or job['status'] == FAILED:
+            st.error(f"⚠️ {job['error'] if job else 'No se encontró el trabajo de triage.'}")
+            st.session_state['triage_job'] = None
+        elif job['status'] == DONE:
+            result = job['result']
+            st.markdown("<h3 style='color: green;'>✅ Resultado del Triage:</h3>", unsafe_allow_html=True)
+            st.write(result['triage_result'])
+            if result['urgency_level'] is not None:
+                st.info(f"🚦 Nivel de urgencia: {result['urgency_level']} (1 = inmediato, 5 = no urgente)")
+
+            # El worker ya guardó la respuesta de la IA y el nivel de urgencia en la base de datos
+            st.session_state['visit'] = result['visit']
+            st.session_state['triage_job'] = None
+            st.session_state.step = 6
+        else:
+            # Sin bloquear la sesión: se vuelve a consultar el trabajo en el siguiente rerun
+            st.info("⏳ Generando el resultado del triage...")
+            time.sleep(TRIAGE_JOB_POLL_INTERVAL)
+            st.rerun()
+
 # Paso 5: Agendar Cita
 if st.session_state.step == 6:
     st.markdown("<h2 style='color: #ff6347;'>📅 Paso 5: Generar una Cita con un Especialista</h2>", unsafe_allow_html=True)
@@ -296,4 +343,63 @@ if st.session_state.step == 6:
         bookings_url = "https://outlook.office365.com/owa/calendar/SaraHelp@procalidad.com/bookings/"
         st.markdown(f"[Haz clic aquí para agendar una cita]({bookings_url})")
 
-    st.button("🔄 Reiniciar", on_click=lambda: st.session_state.update(step=0))
\ No newline at end of file
+    st.button("🔄 Reiniciar", on_click=restart)
+
+
+# Historial de visitas: se lee una página a la vez, solo con los campos de resumen
+def load_history(identification, token=None, previous=()):
+    page = repository.list_visits(identification, page_size=HISTORY_PAGE_SIZE, continuation_token=token,
+                                  fields=VISIT_SUMMARY_FIELDS)
+    st.session_state['history'] = {
+        "identification": identification, "token": token, "previous": list(previous), "page": page,
+    }
+
+def older_visits():
+    history = st.session_state['history']
+    load_history(history['identification'], history['page'].continuation_token,
+                 history['previous'] + [history['token']])
+
+def newer_visits():
+    history = st.session_state['history']
+    load_history(history['identification'], history['previous'][-1], history['previous'][:-1])
+
+with st.sidebar:
+    st.markdown("### 📋 Historial de visitas")
+    if CLINICIAN_MODE:
+        history_identification = st.text_input("🔑 Identificación del paciente", key="history_identification")
+    else:
+        history_identification = st.session_state['identification']
+        # Un historial cargado antes de que otro paciente se identificara en este kiosco no se muestra
+        if st.session_state['history'] and st.session_state['history']['identification'] != history_identification:
+            st.session_state['history'] = None
+        if not history_identification:
+            st.write("Identifícate en el paso 1 para ver tus visitas anteriores.")
+    if st.button("Ver historial", disabled=not history_identification) and history_identification:
+        load_history(history_identification)
+
+    history = st.session_state['history']
+    if history:
+        if not history['page'].items:
+            st.write("No hay visitas registradas para este paciente.")
+        for visit in history['page'].items:
+            with st.expander(f"🗓️ {visit.get('created_at', '')[:16].replace('T', ' ')} · ID {visit['id']}"):
+                st.markdown(f"**Síntomas:** {visit.get('symptoms', 'No registrados')}")
+                if visit.get('urgency_level') is not None:
+                    st.markdown(f"**Nivel de urgencia:** {visit['urgency_level']}")
+                st.markdown(f"**Triage:** {visit.get('triage_result', 'Sin resultado')}")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("⬅️ Más recientes", on_click=newer_visits, disabled=not history['previous'])
+        with col2:
+            st.button("Más antiguas ➡️", on_click=older_visits, disabled=not history['page'].continuation_token)
+
+# Panel de depuración: tiempos, RU y tokens acumulados en este proceso
+if METRICS_PANEL or st.query_params.get("debug") == "1":
+    with st.sidebar.expander("📈 Métricas", expanded=True):
+        rows = metrics.REGISTRY.snapshot()
+        if rows:
+            st.dataframe(rows)
+        else:
+            st.write("Aún no hay métricas registradas.")
+        if st.button("Reiniciar métricas"):
+            metrics.REGISTRY.clear()
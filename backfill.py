@@ -0,0 +1,347 @@
+"""
+Re-triage masivo de las visitas guardadas (backfill).
+
+Sirve para comparar resultados al cambiar el prompt del sistema o el deployment del
+modelo: vuelve a ejecutar el triage de cada visita y guarda el resultado en el campo
+`retriage` de la visita, junto con el nombre de la ejecución (--run), el deployment y
+un resumen del prompt. `triage_result` y `urgency_level` no se modifican; una
+ejecución nueva reemplaza el `retriage` de la anterior.
+
+Las visitas se leen por páginas con tokens de continuación, así que en memoria solo
+están las páginas en curso. Las llamadas al LLM se hacen con concurrencia acotada
+(--concurrency) y con un limitador de tokens por minuto (--tpm) que reserva el costo
+estimado de cada llamada antes de hacerla. Pasan por resilience.py (plazo, reintentos
+y circuit breaker) y no usan la caché de respuestas. Para que todos los resultados
+vengan del mismo deployment, ejecútalo sin AZURE_OPENAI_HEDGE_DEPLOYMENT_ID.
+
+Los resultados de cada página se escriben juntos: los de una misma partición en lotes
+transaccionales (execute_item_batch) y los demás como patches. Las escrituras con
+throttling (429) o un error transitorio (408, 5xx) se reintentan con la espera que
+indica Cosmos DB, como en bulk_transfer.py; si un lote falla por una visita, las de
+esa partición se escriben una por una y solo las que Cosmos DB rechaza (borradas o
+inválidas) cuentan como fallidas. Cualquier otro error detiene la ejecución. Una página se da por
+terminada cuando todas las anteriores lo están; entonces se guarda su token de
+continuación en --checkpoint y una ejecución interrumpida se retoma desde ahí. Las
+visitas que ya tienen un resultado de la misma ejecución se omiten, así que repetirla
+sin checkpoint solo vuelve a intentar las que fallaron.
+
+Uso:
+    python backfill.py --run prompt-v2 --system-prompt-file prompt_v2.txt --checkpoint backfill.json
+    AZURE_OPENAI_DEPLOYMENT_ID=gpt-4o python backfill.py --run gpt-4o --tpm 150000 --concurrency 16
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from azure.cosmos import exceptions
+from dotenv import load_dotenv
+
+import metrics
+from functions import TRIAGE_SYSTEM_PROMPT, agenerate_triage, build_triage_request, triage_system_prompt
+from bulk_transfer import DOCUMENT_ERROR_STATUS, call_with_retries
+from migrate_partitions import MAX_BATCH_SIZE
+from rate_limit import TokenBucket
+from repository import COSMOS_PARTITION_KEY, SYSTEM_PARTITION
+from resilience import DeadlineExceeded, LLMUnavailableError
+
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "8"))
+BACKFILL_TPM = int(os.getenv("BACKFILL_TPM", "60000"))
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "100"))
+# Tokens de respuesta que se reservan por llamada, porque la respuesta aún no se conoce
+BACKFILL_COMPLETION_TOKENS = int(os.getenv("BACKFILL_COMPLETION_TOKENS", "400"))
+BACKFILL_MAX_ATTEMPTS = int(os.getenv("BACKFILL_MAX_ATTEMPTS", "3"))
+# Reintentos de una escritura con throttling o error transitorio, y espera base entre ellos
+BACKFILL_WRITE_RETRIES = int(os.getenv("BACKFILL_WRITE_RETRIES", "5"))
+BACKFILL_RETRY_DELAY = float(os.getenv("BACKFILL_RETRY_DELAY", "1"))
+
+# Una visita borrada durante la ejecución (404) o rechazada por Cosmos DB cuenta como fallida
+REJECTED_STATUS = DOCUMENT_ERROR_STATUS | {404}
+
+# Solo los campos que necesita el prompt y la comparación; el resto del documento no se lee
+VISIT_FIELDS = ("id", "identification", "type", "name", "age", "sex", "injury", "smoking", "allergies", "obesity",
+                "hypertension", "symptoms", "urgency_level", "retriage")
+
+
+def visits_query(since=None):
+    """Consulta de las visitas a re-triar (con `since`, solo las creadas desde esa fecha ISO)."""
+    query = f"SELECT {', '.join(f'c.{field}' for field in VISIT_FIELDS)} FROM c"
+    if since:
+        return query + " WHERE c.created_at >= @since", [{"name": "@since", "value": since}]
+    return query, []
+
+
+def needs_retriage(document, run):
+    if document.get("type") == "patient_profile" or document.get("identification") in (None, SYSTEM_PARTITION):
+        return False
+    if not document.get("symptoms"):
+        return False
+    return (document.get("retriage") or {}).get("run") != run
+
+
+def _comparison(original, new):
+    if original is None or new is None:
+        return "no_level"
+    if new == original:
+        return "same"
+    return "more_urgent" if new < original else "less_urgent"
+
+
+class _Page:
+    """Página leída: sus visitas pendientes, los resultados obtenidos y su token de continuación."""
+
+    def __init__(self, continuation_token, pending):
+        self.continuation_token = continuation_token
+        self.pending = pending
+        self.results = []
+
+
+class Backfill:
+    """
+    Vuelve a ejecutar el triage de las visitas de un contenedor.
+
+    Args:
+        container: ContainerProxy síncrono de Cosmos DB.
+        run (str): Nombre de la ejecución; identifica sus resultados en `retriage`.
+        system_prompt (str): Prompt del sistema a evaluar.
+        concurrency (int): Llamadas al LLM simultáneas.
+        limiter (TokenBucket): Limitador de tokens del LLM (por defecto, BACKFILL_TPM por minuto).
+        page_size (int): Visitas por página leída.
+        partition_key (str): Campo de la clave de partición del contenedor.
+        deployment (str): Deployment del modelo, que se guarda con cada resultado.
+        write_retries (int): Reintentos de una escritura con throttling o error transitorio.
+        retry_delay (float): Espera base entre reintentos si Cosmos DB no indica otra.
+    """
+
+    def __init__(self, container, run, system_prompt=TRIAGE_SYSTEM_PROMPT, concurrency=BACKFILL_CONCURRENCY,
+                 limiter=None, page_size=BACKFILL_PAGE_SIZE, partition_key=COSMOS_PARTITION_KEY, deployment=None,
+                 completion_tokens=BACKFILL_COMPLETION_TOKENS, max_attempts=BACKFILL_MAX_ATTEMPTS,
+                 write_retries=BACKFILL_WRITE_RETRIES, retry_delay=BACKFILL_RETRY_DELAY):
+        self.container = container
+        self.run_name = run
+        self.system_prompt = system_prompt
+        self.concurrency = concurrency
+        self.limiter = limiter or TokenBucket.per_minute(BACKFILL_TPM, burst_seconds=10)
+        self.page_size = page_size
+        self.partition_key = partition_key
+        self.deployment = deployment
+        self.completion_tokens = completion_tokens
+        self.max_attempts = max_attempts
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay
+        self.prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+        self.stats = defaultdict(int)
+
+    def estimated_tokens(self, pregunta):
+        prompt = metrics.estimate_tokens(len(triage_system_prompt(self.system_prompt)) + len(pregunta))
+        return prompt + self.completion_tokens
+
+    async def retriage(self, document):
+        """Triage de una visita; reintenta si el LLM no está disponible, hasta max_attempts."""
+        pregunta, _ = build_triage_request(document)
+        tokens = self.estimated_tokens(pregunta)
+        await self.limiter.acquire(tokens)
+        self.stats["tokens_reserved"] += tokens
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await agenerate_triage(self.system_prompt, pregunta, use_cache=False)
+            except LLMUnavailableError as e:
+                if attempt == self.max_attempts:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except DeadlineExceeded:
+                if attempt == self.max_attempts:
+                    raise
+
+    def _retriage_field(self, result):
+        return {
+            "run": self.run_name,
+            "triage_result": result.text,
+            "urgency_level": result.urgency_level,
+            "urgency_rationale": result.urgency_rationale,
+            "deployment": self.deployment,
+            "prompt": self.prompt_hash,
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def _with_retries(self, operation, *args, **kwargs):
+        def retried():
+            self.stats["write_retries"] += 1
+
+        return call_with_retries(operation, *args, max_retries=self.write_retries, retry_delay=self.retry_delay,
+                                 on_retry=retried, **kwargs)
+
+    def _write_partition(self, partition, results):
+        """Escribe los resultados de una partición; devuelve cuántos se guardaron."""
+        operations = [(document["id"], [{"op": "set", "path": "/retriage", "value": self._retriage_field(result)}])
+                      for document, result in results]
+        if len(operations) > 1:
+            try:
+                for start in range(0, len(operations), MAX_BATCH_SIZE):
+                    self._with_retries(
+                        self.container.execute_item_batch,
+                        [("patch", operation) for operation in operations[start:start + MAX_BATCH_SIZE]],
+                        partition_key=partition)
+                    self.stats["batches"] += 1
+                return len(operations)
+            except exceptions.CosmosBatchOperationError:
+                # Una visita del lote ya no existe o se rechazó: se escriben una por una para guardar las demás
+                pass
+        written = 0
+        for item, patch_operations in operations:
+            try:
+                self._with_retries(self.container.patch_item, item=item, partition_key=partition,
+                                   patch_operations=patch_operations)
+                written += 1
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code not in REJECTED_STATUS:
+                    raise
+                self.stats["failed"] += 1
+        return written
+
+    async def write(self, results):
+        by_partition = defaultdict(list)
+        for document, result in results:
+            by_partition[document[self.partition_key]].append((document, result))
+        # Se esperan todas las particiones antes de propagar un error, para contar lo que sí se escribió
+        written = await asyncio.gather(*(asyncio.to_thread(self._write_partition, partition, items)
+                                         for partition, items in by_partition.items()), return_exceptions=True)
+        self.stats["written"] += sum(count for count in written if not isinstance(count, BaseException))
+        errors = [error for error in written if isinstance(error, BaseException)]
+        if errors:
+            raise errors[0]
+        for document, result in results:
+            self.stats[_comparison(document.get("urgency_level"), result.urgency_level)] += 1
+
+    async def _process(self, document, page, semaphore):
+        try:
+            result = await self.retriage(document)
+            page.results.append((document, result))
+        except Exception:
+            # Una visita que falla (p. ej. por el filtro de contenido) no detiene la ejecución
+            self.stats["failed"] += 1
+        finally:
+            page.pending -= 1
+            semaphore.release()
+
+    async def _flush(self, window, on_checkpoint):
+        # Las páginas se cierran en orden: el checkpoint nunca salta visitas sin procesar
+        while window and window[0].pending == 0:
+            page = window.popleft()
+            await self.write(page.results)
+            self.stats["pages"] += 1
+            if on_checkpoint is not None:
+                on_checkpoint(page.continuation_token, dict(self.stats))
+
+    async def run(self, continuation_token=None, since=None, max_pages=None, on_checkpoint=None):
+        """
+        Procesa las visitas desde `continuation_token`.
+
+        Args:
+            continuation_token (str): Posición desde la que se retoma, o None para empezar.
+            since (str): Fecha ISO; solo se procesan las visitas creadas desde entonces.
+            max_pages (int): Detenerse tras leer esta cantidad de páginas.
+            on_checkpoint: Función on_checkpoint(continuation_token, stats) que se llama
+                tras escribir cada página.
+
+        Returns:
+            dict: Estadísticas de la ejecución y si se recorrió todo el contenedor.
+        """
+        query, parameters = visits_query(since)
+        pages = self.container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True,
+                                           max_item_count=self.page_size).by_page(continuation_token)
+
+        def next_page():
+            page = next(pages, None)
+            return None if page is None else (list(page), pages.continuation_token)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        window, tasks = deque(), set()
+        finished, read = False, 0
+        while max_pages is None or read < max_pages:
+            fetched = await asyncio.to_thread(next_page)
+            if fetched is None:
+                finished = True
+                break
+            documents, token = fetched
+            read += 1
+            self.stats["read"] += len(documents)
+            pending = [document for document in documents if needs_retriage(document, self.run_name)]
+            self.stats["skipped"] += len(documents) - len(pending)
+            page = _Page(token, len(pending))
+            window.append(page)
+            for document in pending:
+                # El semáforo acota las llamadas en curso y también cuánto se lee por adelantado
+                await semaphore.acquire()
+                task = asyncio.create_task(self._process(document, page, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await self._flush(window, on_checkpoint)
+            await self._flush(window, on_checkpoint)
+            if token is None:
+                finished = True
+                break
+
+        await asyncio.gather(*tasks)
+        await self._flush(window, on_checkpoint)
+        return {**self.stats, "finished": finished}
+
+
+def load_checkpoint(path, run):
+    if not path or not os.path.exists(path):
+        return None, {}
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint["run"] != run:
+        raise ValueError(f"El checkpoint {path} es de la ejecución {checkpoint['run']!r}, no de {run!r}.")
+    return checkpoint["continuation_token"], checkpoint["stats"]
+
+
+def save_checkpoint(path, run, continuation_token, stats):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"run": run, "continuation_token": continuation_token, "stats": stats}, f)
+    os.replace(temporary, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--run", required=True, help="Nombre de la ejecución (p. ej. prompt-v2)")
+    parser.add_argument("--system-prompt-file", help="Archivo con el prompt del sistema a evaluar")
+    parser.add_argument("--since", help="Solo visitas creadas desde esta fecha ISO (p. ej. 2024-01-01)")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument("--tpm", type=int, default=BACKFILL_TPM, help="Tokens por minuto permitidos")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument("--checkpoint", help="Archivo JSON para retomar la ejecución")
+    args = parser.parse_args()
+
+    load_dotenv()
+    import clients
+
+    system_prompt = TRIAGE_SYSTEM_PROMPT
+    if args.system_prompt_file:
+        with open(args.system_prompt_file, encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+
+    continuation_token, stats = load_checkpoint(args.checkpoint, args.run)
+    backfill = Backfill(clients.get_container(), args.run, system_prompt=system_prompt, concurrency=args.concurrency,
+                        limiter=TokenBucket.per_minute(args.tpm, burst_seconds=10), page_size=args.page_size,
+                        deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_ID"))
+    backfill.stats.update(stats)
+
+    def checkpoint(token, stats):
+        if args.checkpoint:
+            save_checkpoint(args.checkpoint, args.run, token, stats)
+
+    with metrics.endpoint("backfill"):
+        stats = asyncio.run(backfill.run(continuation_token, since=args.since, on_checkpoint=checkpoint))
+    if stats["finished"] and args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
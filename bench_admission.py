@@ -0,0 +1,200 @@
+"""
+Verificación y benchmark del control de admisión (admission.py) sobre main.py.
+
+Cosmos DB y Azure OpenAI se sustituyen por los dobles de fakes.py; el deployment
+admite --llm-capacity llamadas simultáneas y rechaza las demás con 429, como al
+superar la cuota.
+
+1. Pico de kioscos: --kiosks pacientes piden el triage a la vez y cada uno reintenta
+   cuando le indica Retry-After. Sin control de admisión el exceso llega al
+   deployment, los 429 abren el circuit breaker y fallan los triages de todos; con
+   él, las peticiones que exceden la concurrencia esperan en cola o se rechazan antes
+   de llegar al LLM. Se comparan triages completados, 429 del deployment, reintentos
+   y tiempo total.
+2. Cliente ruidoso: un cliente envía una ráfaga de registros de pacientes mientras
+   otros kioscos hacen su visita; el ruidoso recibe 429 con Retry-After y los demás no
+   sufren ningún rechazo. Una sesión que consulta sin pausa se limita igual.
+
+Uso:
+    python bench_admission.py --kiosks 200 --llm-capacity 16 --llm-latency-ms 300
+"""
+import argparse
+import asyncio
+import math
+import sys
+import time
+
+import httpx
+
+import clients
+import functions
+import main
+from admission import AdmissionControl, ConcurrencyLimiter, KeyedRateLimiter
+from bench_load import HEALTH, SYMPTOMS, percentile
+from fakes import AsyncInMemoryContainer, fake_chat_model
+from repository import AsyncCosmosPatientRepository
+from resilience import ResilientLLM
+
+
+def kiosk(n):
+    return {"X-Forwarded-For": f"10.1.{n // 256 % 256}.{n % 256}"}
+
+
+async def open_session(client, n):
+    response = await client.post("/chatbot/", headers=kiosk(n), json={
+        "name": f"Paciente {n}", "identification": f"kiosko-{n}", "age": 20 + n % 60, "sex": "Otro"})
+    headers = {**kiosk(n), "X-Session-Id": response.json()["session_id"]}
+    await client.post("/health_form/", headers=headers, json=HEALTH)
+    await client.post("/symptoms/", headers=headers, json={"symptoms": SYMPTOMS})
+    return headers
+
+
+async def triage_with_retries(client, headers, max_attempts):
+    """Pide el triage y, ante un rechazo con Retry-After, espera lo indicado y reintenta."""
+    start = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+        response = await client.get("/triage/", params={"fresh": "true"}, headers=headers)
+        retry_after = response.headers.get("Retry-After")
+        if response.status_code == 200 or retry_after is None or attempt == max_attempts:
+            return response.status_code, attempt, time.perf_counter() - start
+        await asyncio.sleep(float(retry_after))
+
+
+def use_admission(control):
+    """Aplica al middleware de main.py los limitadores de `control`."""
+    for name in ("clients", "sessions", "llm", "trust_forwarded", "enabled"):
+        setattr(main.admission, name, getattr(control, name))
+
+
+def admission_control(args):
+    return AdmissionControl(clients=KeyedRateLimiter(5, 30), sessions=KeyedRateLimiter(2, 10),
+                            llm=ConcurrencyLimiter(args.llm_capacity, max_queue=args.llm_capacity * 4, max_wait=5),
+                            trust_forwarded=True, enabled=True)
+
+
+async def kiosk_burst(client, model, args, admission, first):
+    use_admission(admission)
+    sessions = [await open_session(client, n) for n in range(first, first + args.kiosks)]
+    functions.llm = ResilientLLM(breaker_reset=args.breaker_reset)
+    before = (model.calls, model.throttled)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(triage_with_retries(client, headers, args.max_attempts) for headers in sessions))
+    elapsed = time.perf_counter() - start
+    completed = [seconds for status, _, seconds in results if status == 200]
+    return {
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "retries": sum(attempts - 1 for _, attempts, _ in results),
+        "throttled": model.throttled - before[1],
+        "llm_calls": model.calls - before[0],
+        "p50": percentile(sorted(completed), 50),
+        "p95": percentile(sorted(completed), 95),
+        "elapsed": elapsed,
+    }
+
+
+async def noisy_client(client, args):
+    use_admission(admission_control(args))
+    first = 2 * args.kiosks
+
+    async def normal_visit(n):
+        response = await client.post("/chatbot/", headers=kiosk(n), json={
+            "name": f"Paciente {n}", "identification": f"kiosko-{n}", "age": 40, "sex": "Otro"})
+        if response.status_code != 200:
+            return [response.status_code]
+        headers = {**kiosk(n), "X-Session-Id": response.json()["session_id"]}
+        health = await client.post("/health_form/", headers=headers, json=HEALTH)
+        symptoms = await client.post("/symptoms/", headers=headers, json={"symptoms": SYMPTOMS})
+        return [response.status_code, health.status_code, symptoms.status_code]
+
+    # El cliente ruidoso registra pacientes sin pausa, cada registro es una escritura en Cosmos DB
+    noisy = {"X-Forwarded-For": "10.9.9.9"}
+    start = time.perf_counter()
+    noisy_responses, normal_statuses = await asyncio.gather(
+        asyncio.gather(*(client.post("/chatbot/", headers=noisy, json={
+            "name": "Ruidoso", "identification": f"ruidoso-{n}", "age": 40, "sex": "Otro"})
+            for n in range(args.noisy_requests))),
+        asyncio.gather(*(normal_visit(first + n) for n in range(20))))
+    elapsed = time.perf_counter() - start
+    accepted = sum(response.status_code == 200 for response in noisy_responses)
+    rejected = [response for response in noisy_responses if response.status_code == 429]
+    session = {**kiosk(first), "X-Session-Id": (await client.post("/chatbot/", headers=kiosk(first), json={
+        "name": "Sesión", "identification": "sesion-sin-pausa", "age": 40, "sex": "Otro"})).json()["session_id"]}
+
+    session_responses = await asyncio.gather(*(client.get("/waiting-room/", headers={
+        **kiosk(5000 + n), "X-Session-Id": session["X-Session-Id"]}) for n in range(40)))
+    return {
+        "noisy_accepted": accepted, "noisy_rejected": len(rejected),
+        "noisy_retry_after": all("Retry-After" in response.headers for response in rejected),
+        "normal_rejected": sum(status != 200 for statuses in normal_statuses for status in statuses),
+        "session_rejected": sum(response.status_code == 429 for response in session_responses),
+        "elapsed": elapsed,
+    }
+
+
+def report(label, stats):
+    print(f"{label:<22} {stats['completed']:>10} {stats['failed']:>8} {stats['retries']:>10} "
+          f"{stats['throttled']:>13} {stats['p50']:>8.2f} s {stats['p95']:>8.2f} s {stats['elapsed']:>8.2f} s")
+
+
+async def run(args):
+    container = AsyncInMemoryContainer(latency=args.cosmos_latency_ms / 1000)
+    repository = AsyncCosmosPatientRepository(container)
+    model = fake_chat_model(latency=args.llm_latency_ms / 1000, capacity=args.llm_capacity)
+    clients.use_chat_model(model)
+    main.app.dependency_overrides[main.get_repository] = lambda: repository
+    failures = []
+    try:
+        # Un error no controlado de la aplicación llega al kiosco como 500, igual que en producción
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://kiosco", timeout=None) as client:
+            print(f"{'pico de kioscos':<22} {'completados':>10} {'fallidos':>8} {'reintentos':>10} "
+                  f"{'429 del LLM':>13} {'p50':>10} {'p95':>10} {'total':>10}")
+            without = await kiosk_burst(client, model, args, AdmissionControl(enabled=False), 0)
+            report("sin control", without)
+            admitted = await kiosk_burst(client, model, args, admission_control(args), args.kiosks)
+            report("con control", admitted)
+            if admitted["failed"]:
+                failures.append(f"{admitted['failed']} triages fallaron con control de admisión")
+            if admitted["throttled"]:
+                failures.append(f"el deployment recibió {admitted['throttled']} llamadas por encima de su cuota")
+
+            noisy = await noisy_client(client, args)
+            limit = math.ceil(30 + 5 * (noisy["elapsed"] + 2))
+            print(f"cliente ruidoso: {noisy['noisy_accepted']} admitidas y {noisy['noisy_rejected']} rechazadas con 429 "
+                  f"de {args.noisy_requests}; kioscos normales rechazados: {noisy['normal_rejected']}; "
+                  f"sesión sin pausa: {noisy['session_rejected']} de 40 rechazadas")
+            if noisy["noisy_accepted"] > limit:
+                failures.append(f"el cliente ruidoso superó su tasa: {noisy['noisy_accepted']} > {limit}")
+            if not noisy["noisy_rejected"] or not noisy["noisy_retry_after"]:
+                failures.append("el cliente ruidoso no recibió 429 con Retry-After")
+            if noisy["normal_rejected"]:
+                failures.append(f"{noisy['normal_rejected']} kioscos normales fueron rechazados")
+            if not noisy["session_rejected"]:
+                failures.append("el límite por sesión no rechazó ninguna consulta")
+    finally:
+        main.app.dependency_overrides.clear()
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kiosks", type=int, default=200)
+    parser.add_argument("--llm-capacity", type=int, default=16, help="Llamadas simultáneas que admite el deployment")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=2.0)
+    parser.add_argument("--breaker-reset", type=float, default=5.0, help="Segundos con el circuit breaker abierto")
+    parser.add_argument("--max-attempts", type=int, default=10, help="Intentos de cada kiosco")
+    parser.add_argument("--noisy-requests", type=int, default=200)
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args))
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    if not failures:
+        print("OK: sin 429 del deployment, todos los triages completados y el cliente ruidoso limitado")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
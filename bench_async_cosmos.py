@@ -0,0 +1,71 @@
+"""
+Benchmark de rendimiento de los endpoints de main.py con clientes concurrentes.
+
+Compara el acceso bloqueante a Cosmos DB (el cliente síncrono dentro de endpoints
+async, que detiene el bucle de eventos) contra el cliente asíncrono. Ambos casos usan
+un contenedor local con la misma latencia simulada.
+
+Uso:
+    python bench_async_cosmos.py --clients 50 --visits 200 --latency-ms 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import main
+from fakes import AsyncInMemoryContainer
+from repository import AsyncCosmosPatientRepository
+
+
+async def visit(client, n):
+    identification = f"bench-{n}"
+    response = await client.post("/chatbot/", json={
+        "name": f"Paciente {n}", "identification": identification, "age": 40, "sex": "Otro",
+    })
+    headers = {"X-Session-Id": response.json()["session_id"]}
+    await client.post("/health_form/", headers=headers, json={
+        "injury": "No", "smoking": "No", "allergies": "No", "obesity": "No", "hypertension": "No",
+    })
+    await client.post("/symptoms/", headers=headers, json={"symptoms": "Dolor de cabeza"})
+
+
+async def run(name, container, clients, visits):
+    repository = AsyncCosmosPatientRepository(container)
+    main.app.dependency_overrides[main.get_repository] = lambda: repository
+    # Se mide el acceso a Cosmos DB; el control de admisión se evalúa en bench_admission.py
+    main.admission.enabled = False
+    semaphore = asyncio.Semaphore(clients)
+
+    async def limited(client, n):
+        async with semaphore:
+            await visit(client, n)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(client, n) for n in range(visits)))
+        elapsed = time.perf_counter() - start
+
+    main.app.dependency_overrides.clear()
+    requests = visits * 3
+    print(f"{name:<10} {requests / elapsed:>10.1f} req/s {elapsed:>8.2f} s")
+
+
+async def bench(args):
+    latency = args.latency_ms / 1000
+    await run("sync", AsyncInMemoryContainer(latency=latency, blocking=True), args.clients, args.visits)
+    await run("async", AsyncInMemoryContainer(latency=latency), args.clients, args.visits)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="Clientes concurrentes")
+    parser.add_argument("--visits", type=int, default=200, help="Visitas simuladas en total")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,173 @@
+"""
+Verificación y benchmark del re-triage masivo (backfill.py).
+
+Escribe visitas completas en un contenedor local particionado por paciente y, con el
+modelo local de fakes.py:
+
+1. Mide el enfoque actual, llamar al triage de una visita y guardarlo en un bucle,
+   sobre una muestra y lo extrapola a todas las visitas.
+2. Ejecuta el backfill con concurrencia acotada y compara tiempo, round trips y lotes.
+3. Ejecuta el backfill con una cuota de tokens por minuto baja y comprueba que el
+   limitador la respeta.
+4. Interrumpe una ejecución con un fallo simulado al escribir una página, la retoma
+   desde el checkpoint y comprueba que cada visita tiene exactamente un resultado de la
+   ejecución, que triage_result no cambió y cuántas llamadas al LLM se repitieron.
+
+Uso:
+    python bench_backfill.py --visits 2000 --concurrency 32 --llm-latency-ms 100
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import clients
+from backfill import Backfill
+from fakes import InMemoryContainer, fake_chat_model
+from functions import TRIAGE_SYSTEM_PROMPT, agenerate_triage, build_triage_request, triage_fields
+from rate_limit import TokenBucket
+from repository import PartitionedCosmosPatientRepository
+from visit_writes import save_fields, start_visit
+
+ANSWERS = ("Sí", "No")
+SYMPTOMS = ("tos seca y fiebre", "dolor de cabeza desde ayer", "dolor abdominal leve", "mareo al levantarse")
+
+
+class FailingContainer:
+    """Contenedor que falla en el lote número `fail_at`, como un proceso que se cae a mitad de la escritura."""
+
+    def __init__(self, container, fail_at):
+        self.container = container
+        self.fail_at = fail_at
+        self.batches = 0
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise RuntimeError("fallo simulado")
+        return self.container.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.container, name)
+
+
+def write_visits(repository, rng, count):
+    for n in range(count):
+        identification = str(n // 4)
+        visit = start_visit(repository, {"id": repository.next_visit_id(), "identification": identification,
+                                         "name": f"Paciente {identification}", "age": 20 + n % 60, "sex": "Otro"})
+        save_fields(repository, visit, {
+            **{field: rng.choice(ANSWERS) for field in ("injury", "smoking", "allergies", "obesity", "hypertension")},
+            "symptoms": rng.choice(SYMPTOMS), "triage_result": "original", "urgency_level": rng.randint(2, 5),
+        })
+
+
+def visits(container):
+    return [document for document in container.query_items("SELECT * FROM c", enable_cross_partition_query=True)
+            if document.get("type", "visit") == "visit" and "symptoms" in document]
+
+
+async def single_record_loop(container, documents):
+    """Lo que haría hoy un script: una visita a la vez con la función de un solo registro."""
+    for document in documents:
+        pregunta, _ = build_triage_request(document)
+        result = await agenerate_triage(TRIAGE_SYSTEM_PROMPT, pregunta, use_cache=False)
+        container.patch_item(item=document["id"], partition_key=document["identification"],
+                             patch_operations=[{"op": "set", "path": "/retriage",
+                                                "value": {"run": "bucle", **triage_fields(result)}}])
+
+
+def measure(container, model, label, coroutine):
+    before = (container.round_trips, model.calls)
+    start = time.perf_counter()
+    result = asyncio.run(coroutine)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {elapsed:>7.2f} s  {container.round_trips - before[0]:>6} round trips  "
+          f"{model.calls - before[1]:>6} llamadas al modelo")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--llm-latency-ms", type=float, default=100.0)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=2.0)
+    parser.add_argument("--sample", type=int, default=50, help="Visitas del bucle de un solo registro")
+    args = parser.parse_args()
+
+    container = InMemoryContainer(latency=args.cosmos_latency_ms / 1000, partition_key_path="identification")
+    write_visits(PartitionedCosmosPatientRepository(container), random.Random(5), args.visits)
+    model = fake_chat_model(latency=args.llm_latency_ms / 1000)
+    clients.use_chat_model(model)
+    unlimited = TokenBucket(1e9, capacity=1e9)
+    failures = []
+
+    documents = visits(container)
+    elapsed, _ = measure(container, model, f"bucle de un solo registro ({args.sample} visitas)",
+                         single_record_loop(container, documents[:args.sample]))
+    print(f"{'  extrapolado a todas las visitas':<44} {elapsed / args.sample * len(documents):>7.2f} s")
+
+    backfill = Backfill(container, "rapido", concurrency=args.concurrency, limiter=unlimited,
+                        page_size=args.page_size, partition_key="identification")
+    _, stats = measure(container, model, f"backfill (concurrencia {args.concurrency})", backfill.run())
+    print(f"  {stats['written']} escritas en {stats['batches']} lotes; comparación con el triage original: "
+          f"{stats.get('same', 0)} igual, {stats.get('more_urgent', 0)} más urgente, "
+          f"{stats.get('less_urgent', 0)} menos urgente")
+
+    # Cuota baja: 100 llamadas por segundo, así que 400 visitas tardan unos 3 s tras la ráfaga inicial
+    subset = InMemoryContainer(partition_key_path="identification")
+    write_visits(PartitionedCosmosPatientRepository(subset), random.Random(6), 400)
+    probe = Backfill(subset, "cuota", limiter=unlimited)
+    per_call = probe.estimated_tokens(build_triage_request(visits(subset)[0])[0])
+    tpm = per_call * 100 * 60
+    limiter = TokenBucket.per_minute(tpm, burst_seconds=1)
+    limited = Backfill(subset, "cuota", concurrency=args.concurrency, limiter=limiter, partition_key="identification")
+    start = time.perf_counter()
+    stats = asyncio.run(limited.run())
+    elapsed = time.perf_counter() - start
+    observed = (stats["tokens_reserved"] - limiter.capacity) / elapsed * 60
+    print(f"cuota de {tpm} tokens/min: {observed:.0f} tokens/min observados en {elapsed:.2f} s")
+    if observed > tpm * 1.05:
+        failures.append(f"el limitador superó la cuota: {observed:.0f} > {tpm} tokens/min")
+
+    # Interrupción a mitad de la tercera página (unas 4 visitas por paciente y lote) y reanudación
+    checkpoint = {}
+
+    def save(token, stats):
+        checkpoint.update(token=token, pages=stats["pages"])
+
+    failing = FailingContainer(container, fail_at=args.page_size * 5 // 8)
+    calls_before = model.calls
+    try:
+        asyncio.run(Backfill(failing, "reanudada", concurrency=args.concurrency, limiter=unlimited,
+                             page_size=args.page_size, partition_key="identification").run(on_checkpoint=save))
+        failures.append("el fallo simulado no interrumpió la ejecución")
+    except RuntimeError:
+        print(f"ejecución interrumpida tras {checkpoint.get('pages', 0)} páginas guardadas")
+    resumed = Backfill(container, "reanudada", concurrency=args.concurrency, limiter=unlimited,
+                       page_size=args.page_size, partition_key="identification")
+    _, stats = measure(container, model, "reanudación desde el checkpoint", resumed.run(checkpoint.get("token")))
+    repeated = model.calls - calls_before - len(documents)
+    print(f"  llamadas repetidas por la interrupción: {repeated}")
+
+    final = visits(container)
+    missing = [document["id"] for document in final if (document.get("retriage") or {}).get("run") != "reanudada"]
+    if missing:
+        failures.append(f"{len(missing)} visitas sin resultado tras la reanudación")
+    if any(document["triage_result"] != "original" for document in final):
+        failures.append("el backfill modificó triage_result")
+    if stats.get("failed"):
+        failures.append(f"{stats['failed']} visitas fallaron")
+
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    if not failures:
+        print("OK: todas las visitas re-triadas una vez, cuota respetada y triage original intacto")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
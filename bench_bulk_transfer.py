@@ -0,0 +1,189 @@
+"""
+Verificación y benchmark de la exportación e importación masiva (bulk_transfer.py).
+
+1. Mide la memoria máxima (tracemalloc) de exportar contenedores de distinto tamaño
+   con export() y con el enfoque directo, list(container.query_items(...)) y un único
+   json.dump, y comprueba que la de export() no crece con el contenedor.
+2. Comprueba la proyección de campos y el filtro de fechas.
+3. Exporta a NDJSON un contenedor local particionado por paciente, lo importa en otro
+   contenedor vacío con lotes concurrentes y compara tiempo y round trips con un
+   upsert por documento; después comprueba que ambos contenedores son iguales.
+4. Si pyarrow está instalado, hace lo mismo con Parquet para las columnas exportadas.
+
+Uso:
+    python bench_bulk_transfer.py --documents 20000 --concurrency 8 --cosmos-latency-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from bulk_transfer import PARQUET_FIELDS, BulkImporter, export, read_documents
+from fakes import InMemoryContainer
+from migrate_partitions import SYSTEM_FIELDS
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def visit(n):
+    return {
+        "id": str(n), "identification": str(n // 4), "type": "visit",
+        "created_at": (START + timedelta(hours=n)).isoformat(), "name": f"Paciente {n // 4}",
+        "age": 20 + n % 60, "sex": "Otro", "injury": "No", "smoking": "Sí", "allergies": "No", "obesity": "No",
+        "hypertension": "Sí", "symptoms": "dolor de cabeza desde ayer y fiebre leve por la noche",
+        "triage_result": "Nivel de urgencia 4: consulta prioritaria. " * 4, "urgency_level": 4,
+        "urgency_rationale": "síntomas leves sin signos de alarma",
+        "retriage": {"run": "prompt-v2", "urgency_level": 3, "at": START.isoformat()} if n % 3 == 0 else None,
+    }
+
+
+class GeneratedContainer:
+    """Contenedor que genera cada página al pedirla, como el servidor: no guarda los documentos."""
+
+    def __init__(self, count):
+        self.count = count
+
+    def query_items(self, query, parameters=None, max_item_count=100, **kwargs):
+        return _GeneratedItems(self.count, max_item_count)
+
+
+class _GeneratedItems:
+    def __init__(self, count, page_size):
+        self.count = count
+        self.page_size = page_size
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        for start in range(0, self.count, self.page_size):
+            yield [visit(n) for n in range(start, min(start + self.page_size, self.count))]
+
+
+def naive_export(container, path):
+    documents = list(container.query_items("SELECT * FROM c", enable_cross_partition_query=True))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(documents, f, ensure_ascii=False)
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def seed(count):
+    container = InMemoryContainer(partition_key_path="identification")
+    for n in range(count):
+        container.upsert_item(visit(n))
+    for n in range(0, count, 4):
+        container.upsert_item({"id": f"profile-{n // 4}", "identification": str(n // 4), "type": "patient_profile",
+                               "name": f"Paciente {n // 4}", "age": 20 + n % 60, "sex": "Otro"})
+    container.upsert_item({"id": "visit-id-counter", "identification": "_system", "next": count + 1})
+    return container
+
+
+def contents(container, fields=None):
+    documents = {}
+    for document in container.query_items("SELECT * FROM c", enable_cross_partition_query=True):
+        document = {key: value for key, value in document.items() if key not in SYSTEM_FIELDS}
+        if fields is not None:
+            document = {key: value for key, value in document.items() if key in fields and value is not None}
+        documents[(document["identification"], document["id"])] = document
+    return documents
+
+
+def timed_import(target, path, args):
+    importer = BulkImporter(target, partition_key="identification", concurrency=args.concurrency)
+    start = time.perf_counter()
+    stats = asyncio.run(importer.run(read_documents(path)))
+    return time.perf_counter() - start, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=2.0)
+    parser.add_argument("--sample", type=int, default=500, help="Documentos del upsert uno por uno")
+    args = parser.parse_args()
+    latency = args.cosmos_latency_ms / 1000
+    failures = []
+    workdir = tempfile.mkdtemp(prefix="bulk-")
+
+    print(f"{'memoria máxima':<28} {'export()':>12} {'list + json.dump':>18}")
+    peaks = []
+    for count in (args.documents // 4, args.documents):
+        source = GeneratedContainer(count)
+        streamed = peak_memory(export, source, os.path.join(workdir, "streamed.ndjson"))
+        naive = peak_memory(naive_export, source, os.path.join(workdir, "naive.json"))
+        peaks.append(streamed)
+        print(f"{count:>8} documentos{'':<11} {streamed:>9.1f} MB {naive:>15.1f} MB")
+    if peaks[1] > peaks[0] * 1.5:
+        failures.append(f"la memoria de export() crece con el contenedor: {peaks[0]:.1f} → {peaks[1]:.1f} MB")
+
+    source = seed(args.documents)
+    path = os.path.join(workdir, "filtered.ndjson")
+    fields = ("id", "identification", "created_at", "urgency_level")
+    since, until = (START + timedelta(hours=100)).isoformat(), (START + timedelta(hours=300)).isoformat()
+    stats = export(source, path, fields=fields, since=since, until=until)
+    exported = list(read_documents(path))
+    if stats["documents"] != 200 or any(set(document) != set(fields) for document in exported):
+        failures.append(f"proyección o filtro de fechas incorrectos: {stats['documents']} documentos")
+    print(f"proyección y fechas: {stats['documents']} visitas entre {since[:10]} y {until[:10]}")
+
+    path = os.path.join(workdir, "respaldo.ndjson.gz")
+    stats = export(source, path)
+    print(f"exportación NDJSON: {stats['documents']} documentos en {stats['pages']} páginas, "
+          f"{os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+    loop_target = InMemoryContainer(latency=latency, partition_key_path="identification")
+    documents = list(read_documents(path))[:args.sample]
+    start = time.perf_counter()
+    for document in documents:
+        loop_target.upsert_item(document)
+    elapsed = (time.perf_counter() - start) / len(documents) * stats["documents"]
+    print(f"{'upsert uno por uno (extrapolado)':<36} {elapsed:>7.2f} s {stats['documents']:>7} round trips")
+
+    target = InMemoryContainer(latency=latency, partition_key_path="identification")
+    elapsed, imported = timed_import(target, path, args)
+    print(f"{f'importación (concurrencia {args.concurrency})':<36} {elapsed:>7.2f} s {target.round_trips:>7} round trips"
+          f"  ({imported.get('batches', 0)} lotes, {imported.get('upserts', 0)} upserts)")
+    if contents(target) != contents(source):
+        failures.append("el contenedor importado no es igual al original")
+    if imported.get("failed") or imported.get("invalid"):
+        failures.append(f"documentos no importados: {imported}")
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("pyarrow no está instalado: se omite la prueba de Parquet")
+    else:
+        path = os.path.join(workdir, "visitas.parquet")
+        stats = export(source, path, document_type="visit")
+        target = InMemoryContainer(partition_key_path="identification")
+        _, imported = timed_import(target, path, args)
+        expected = {key: document for key, document in contents(source, PARQUET_FIELDS).items()
+                    if document.get("type") == "visit"}
+        print(f"Parquet: {stats['documents']} visitas, {os.path.getsize(path) / 1024 / 1024:.1f} MB, "
+              f"{imported['written']} importadas")
+        if contents(target, PARQUET_FIELDS) != expected:
+            failures.append("las visitas importadas desde Parquet no coinciden con las exportadas")
+
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    if not failures:
+        print("OK: exportación en memoria constante y contenedores iguales tras exportar e importar")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
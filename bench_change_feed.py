@@ -0,0 +1,139 @@
+"""
+Verificación y benchmark del procesador del change feed (change_feed.py).
+
+Escribe visitas paso a paso en un contenedor local particionado por paciente, igual
+que app.py, y procesa el change feed en tramos: con visitas a medio escribir, con un
+fallo simulado a mitad de una página y tras reiniciar el procesador con el mismo
+archivo de agregados. Al final compara los agregados con los que daría una consulta
+completa del contenedor y muestra el costo de cada enfoque.
+
+Uso:
+    python bench_change_feed.py --visits 2000 --page-size 100
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from change_feed import AggregateStore, ChangeFeedProcessor, visit_contribution
+from fakes import InMemoryContainer
+from repository import PartitionedCosmosPatientRepository
+from visit_writes import save_fields, start_visit
+
+ANSWERS = ("Sí", "No")
+
+
+class FailingStore(AggregateStore):
+    """AggregateStore que falla en la página número `fail_at`, como un proceso que se cae."""
+
+    def __init__(self, path, fail_at):
+        super().__init__(path)
+        self.fail_at = fail_at
+        self.pages = 0
+
+    def apply(self, documents, name, continuation):
+        self.pages += 1
+        if self.pages == self.fail_at:
+            raise RuntimeError("fallo simulado")
+        return super().apply(documents, name, continuation)
+
+
+def write_visits(repository, rng, first, count):
+    """Crea visitas con el formulario de salud y devuelve las que quedan sin triage."""
+    visits = []
+    for n in range(first, first + count):
+        identification = str(rng.randrange(count // 4 + 1))
+        visit = start_visit(repository, {"id": repository.next_visit_id(), "identification": identification,
+                                         "name": f"Paciente {identification}", "age": 40, "sex": "Otro"})
+        visit = save_fields(repository, visit, {field: rng.choice(ANSWERS) for field in (
+            "injury", "smoking", "allergies", "obesity", "hypertension")})
+        visits.append(visit)
+    return visits
+
+
+def finish_visits(repository, rng, visits):
+    for visit in visits:
+        visit = save_fields(repository, visit, {"symptoms": "tos"})
+        level = rng.choice((1, 2, 3, 3, 4, 4, 5, None))
+        save_fields(repository, visit, {"triage_result": "...", "urgency_level": level})
+
+
+def expected_aggregates(container):
+    """Agregados recalculados desde cero, como lo haría una consulta completa."""
+    counts = Counter()
+    for document in container.query_items("SELECT * FROM c", enable_cross_partition_query=True):
+        counts.update(visit_contribution(document) or [])
+    return counts
+
+
+def stored_aggregates(store):
+    rows = store._connection().execute("SELECT metric, key, value FROM aggregates").fetchall()
+    return Counter({(metric, key): value for metric, key, value in rows})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    container = InMemoryContainer(partition_key_path="identification")
+    repository = PartitionedCosmosPatientRepository(container)
+    path = os.path.join(tempfile.mkdtemp(), "aggregates.db")
+    half = args.visits // 2
+
+    def run(store, label):
+        before = (container.round_trips, container.request_charge)
+        start = time.perf_counter()
+        processed = ChangeFeedProcessor(container, store, page_size=args.page_size).run_once()
+        print(f"{label:<38} {processed:>6} documentos  {container.round_trips - before[0]:>5} round trips  "
+              f"{container.request_charge - before[1]:>7.0f} RU  {time.perf_counter() - start:>6.2f} s")
+
+    # Visitas a medio escribir: el triage llega después y debe reemplazar su aporte
+    pending = write_visits(repository, rng, 0, half)
+    run(AggregateStore(path), "primer tramo (sin triage)")
+
+    finish_visits(repository, rng, pending)
+    failing = FailingStore(path, fail_at=3)
+    try:
+        run(failing, "segundo tramo (falla en la página 3)")
+    except RuntimeError:
+        print("segundo tramo interrumpido por el fallo simulado")
+    run(AggregateStore(path), "reanudación tras el fallo")
+
+    finish_visits(repository, rng, write_visits(repository, rng, half, args.visits - half))
+    run(AggregateStore(path), "tercer tramo (visitas nuevas)")
+    run(AggregateStore(path), "sin cambios nuevos")
+
+    before = (container.round_trips, container.request_charge)
+    start = time.perf_counter()
+    expected = expected_aggregates(container)
+    print(f"{'consulta completa del contenedor':<38} {'':>17} {container.round_trips - before[0]:>5} round trips  "
+          f"{container.request_charge - before[1]:>7.0f} RU  {time.perf_counter() - start:>6.2f} s")
+
+    store = AggregateStore(path)
+    start = time.perf_counter()
+    for _ in range(1000):
+        dashboard = store.dashboard()
+    print(f"lectura del tablero: {(time.perf_counter() - start):.3f} ms por lectura, 0 RU")
+    print(f"urgencia: {dashboard['urgency']}")
+    print(f"tabaquismo: {dashboard['prevalence']['smoking']}")
+
+    stored = stored_aggregates(store)
+    if stored != expected:
+        differences = {key: (stored.get(key), expected.get(key)) for key in set(stored) | set(expected)
+                       if stored.get(key) != expected.get(key)}
+        print(f"FALLO: los agregados no coinciden con la consulta completa: {differences}")
+        sys.exit(1)
+    if sum(dashboard["urgency"].values()) != args.visits:
+        print("FALLO: el total por nivel de urgencia no coincide con las visitas")
+        sys.exit(1)
+    print("OK: agregados idénticos a la consulta completa, sin duplicados tras el fallo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Prueba de carga de extremo a extremo del flujo de triage de main.py.
+
+Simula muchos pacientes concurrentes que recorren el flujo completo
+(/chatbot/ → /health_form/ → /symptoms/ → /triage/) contra la aplicación FastAPI
+en proceso. Con --jobs usa el modo trabajo (POST /triage/jobs y consultas a
+GET /triage/jobs/{id} hasta que termina) con --workers workers de triage_jobs.py. Cosmos DB y AzureChatOpenAI se sustituyen por los dobles de fakes.py
+con latencias configurables, así que los resultados son reproducibles y no
+consumen RU ni tokens.
+
+Informa latencia p50/p95/p99 por endpoint, throughput y round trips a Cosmos DB y
+llamadas al modelo por visita. Con --save-baseline guarda los resultados en JSON;
+con --baseline los compara contra un archivo guardado y termina con error si hay
+una regresión mayor que --tolerance.
+
+Uso:
+    python bench_load.py --patients 500 --concurrency 50 --save-baseline baseline.json
+    python bench_load.py --patients 500 --concurrency 50 --baseline baseline.json
+    python bench_load.py --stream --llm-latency-ms 300 --token-latency-ms 10
+    python bench_load.py --jobs --workers 8
+    python bench_load.py --admission --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+import clients
+import main
+from fakes import AsyncInMemoryContainer, fake_chat_model
+from repository import AsyncCosmosPatientRepository
+from triage_jobs import DONE, FAILED, JobQueue, TriageWorkerPool
+
+HEALTH = {"injury": "No", "smoking": "No", "allergies": "Sí", "obesity": "No", "hypertension": "No"}
+SYMPTOMS = "Dolor de cabeza intenso desde hace dos días, con náuseas y sensibilidad a la luz."
+PERCENTILES = (50, 95, 99)
+# Espera entre consultas a GET /triage/jobs/{id} en modo trabajo
+JOB_POLL_INTERVAL = 0.05
+
+
+def percentile(values, p):
+    """Percentil por rango más cercano; values debe estar ordenado."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class LoadRecorder:
+    """Acumula las latencias de cada endpoint y las respuestas con error."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name, request, expected=200):
+        start = time.perf_counter()
+        response = await request
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code != expected:
+            self.errors[name] += 1
+        return response
+
+    def summary(self):
+        endpoints = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            endpoints[name] = {f"p{p}": round(percentile(values, p), 2) for p in PERCENTILES}
+            endpoints[name]["requests"] = len(values)
+            endpoints[name]["errors"] = self.errors[name]
+        return endpoints
+
+
+async def stream_triage(client, recorder, headers):
+    # ASGITransport entrega el cuerpo completo al final, así que se mide la duración total del stream
+    response = await recorder.call("/triage/stream", client.get("/triage/stream", params={"fresh": "true"},
+                                                                headers=headers))
+    if "event: end" not in response.text:
+        recorder.errors["/triage/stream"] += 1
+
+
+async def job_triage(client, recorder, headers, poll_interval):
+    # Se mide la respuesta de POST /triage/jobs y, aparte, el tiempo hasta que el trabajo termina
+    start = time.perf_counter()
+    response = await recorder.call("/triage/jobs", client.post("/triage/jobs", params={"fresh": "true"},
+                                                               headers=headers), expected=202)
+    if response.status_code != 202:
+        return
+    job_url = f"/triage/jobs/{response.json()['job_id']}"
+    while True:
+        await asyncio.sleep(poll_interval)
+        job = (await recorder.call("/triage/jobs/{job_id}", client.get(job_url, headers=headers))).json()
+        if job["status"] in (DONE, FAILED):
+            break
+    recorder.latencies["triage por trabajo (total)"].append((time.perf_counter() - start) * 1000)
+    if job["status"] != DONE:
+        recorder.errors["triage por trabajo (total)"] += 1
+
+
+async def patient_visit(client, recorder, n, stream, jobs=False):
+    # Cada paciente llega desde su propio kiosco, para el límite de tasa por cliente
+    kiosk = {"X-Forwarded-For": f"10.0.{n // 256 % 256}.{n % 256}"}
+    response = await recorder.call("/chatbot/", client.post("/chatbot/", headers=kiosk, json={
+        "name": f"Paciente {n}", "identification": f"load-{n}", "age": 20 + n % 60, "sex": "Otro",
+    }))
+    if response.status_code != 200:
+        return
+    headers = {**kiosk, "X-Session-Id": response.json()["session_id"]}
+    await recorder.call("/health_form/", client.post("/health_form/", headers=headers, json=HEALTH))
+    await recorder.call("/symptoms/", client.post("/symptoms/", headers=headers, json={"symptoms": SYMPTOMS}))
+    # fresh=true para que cada visita llegue al modelo y la caché no oculte su latencia
+    if stream:
+        await stream_triage(client, recorder, headers)
+    elif jobs:
+        await job_triage(client, recorder, headers, JOB_POLL_INTERVAL)
+    else:
+        await recorder.call("/triage/", client.get("/triage/", params={"fresh": "true"}, headers=headers))
+
+
+async def run_load(args):
+    container = AsyncInMemoryContainer(latency=args.cosmos_latency_ms / 1000)
+    model = fake_chat_model(latency=args.llm_latency_ms / 1000, token_latency=args.token_latency_ms / 1000)
+    repository = AsyncCosmosPatientRepository(container)
+    clients.use_chat_model(model)
+    main.app.dependency_overrides[main.get_repository] = lambda: repository
+    # Sin --admission se mide solo la aplicación; el control de admisión se evalúa en bench_admission.py
+    main.admission.enabled = args.admission
+    main.admission.trust_forwarded = True
+
+    # ASGITransport no ejecuta el lifespan: la cola y los workers se crean aquí
+    pool = None
+    if args.jobs:
+        queue = JobQueue(os.path.join(tempfile.mkdtemp(), "triage_jobs.db"))
+        pool = TriageWorkerPool(queue, lambda job: main.run_session_triage_job(
+            repository, main.session_store, main.waiting_room, job), workers=args.workers)
+        main.app.state.jobs, main.app.state.job_pool = queue, pool
+        pool.start()
+
+    recorder = LoadRecorder()
+    pending = iter(range(args.patients))
+
+    async def simulated_patient(client):
+        for n in pending:
+            await patient_visit(client, recorder, n, args.stream, args.jobs)
+
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(simulated_patient(client) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+    finally:
+        main.app.dependency_overrides.clear()
+        if pool is not None:
+            await pool.stop()
+
+    endpoints = recorder.summary()
+    requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "config": {
+            "patients": args.patients, "concurrency": args.concurrency, "stream": args.stream,
+            "cosmos_latency_ms": args.cosmos_latency_ms, "llm_latency_ms": args.llm_latency_ms,
+            "token_latency_ms": args.token_latency_ms, "draft": main.VISIT_DRAFT_MODE,
+            "jobs": args.jobs, "workers": args.workers if args.jobs else None, "admission": args.admission,
+        },
+        "throughput": {
+            "visits_per_s": round(args.patients / elapsed, 2),
+            "requests_per_s": round(requests / elapsed, 2),
+        },
+        "per_visit": {
+            "cosmos_round_trips": round(container.round_trips / args.patients, 2),
+            "cosmos_ru": round(container.request_charge / args.patients, 2),
+            "llm_calls": round(model.calls / args.patients, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def report(results):
+    print(f"{'endpoint':<30} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'requests':>9} {'errores':>8}")
+    for name, endpoint in results["endpoints"].items():
+        print(f"{name:<30} {endpoint['p50']:>9.1f} {endpoint['p95']:>9.1f} {endpoint['p99']:>9.1f} "
+              f"{endpoint['requests']:>9} {endpoint['errors']:>8}")
+    throughput, per_visit = results["throughput"], results["per_visit"]
+    print(f"throughput: {throughput['visits_per_s']:.1f} visitas/s, {throughput['requests_per_s']:.1f} req/s")
+    print(f"por visita: {per_visit['cosmos_round_trips']:.1f} round trips, {per_visit['cosmos_ru']:.1f} RU, "
+          f"{per_visit['llm_calls']:.1f} llamadas al modelo")
+
+
+def compare(results, baseline, tolerance):
+    """Devuelve la lista de regresiones respecto a la línea base."""
+    regressions = []
+    for name, previous in baseline["endpoints"].items():
+        current = results["endpoints"].get(name)
+        if current is None:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}"
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {current[key]:.1f} ms (base {previous[key]:.1f} ms)")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: {current['errors']} errores (base {previous['errors']})")
+
+    for key, previous in baseline["throughput"].items():
+        if results["throughput"][key] < previous * (1 - tolerance):
+            regressions.append(f"throughput {key}: {results['throughput'][key]:.1f} (base {previous:.1f})")
+
+    # Los round trips y las llamadas al modelo son deterministas: cualquier aumento es una regresión
+    for key, previous in baseline["per_visit"].items():
+        if results["per_visit"][key] > previous:
+            regressions.append(f"{key} por visita: {results['per_visit'][key]} (base {previous})")
+
+    if baseline.get("config") != results["config"]:
+        print("AVISO: la configuración difiere de la línea base; la comparación puede no ser válida.")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=300, help="Visitas simuladas en total")
+    parser.add_argument("--concurrency", type=int, default=30, help="Pacientes simultáneos")
+    parser.add_argument("--cosmos-latency-ms", type=float, default=10.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Latencia hasta el primer token")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Latencia adicional por token")
+    parser.add_argument("--stream", action="store_true", help="Usar /triage/stream en lugar de /triage/")
+    parser.add_argument("--jobs", action="store_true", help="Usar el modo trabajo (POST /triage/jobs)")
+    parser.add_argument("--workers", type=int, default=8, help="Workers de triage en modo trabajo")
+    parser.add_argument("--admission", action="store_true",
+                        help="Aplicar el control de admisión de admission.py (un kiosco por paciente)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Guardar los resultados como línea base")
+    parser.add_argument("--baseline", metavar="PATH", help="Comparar contra una línea base guardada")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Margen relativo permitido en latencia y throughput (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args))
+    report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,113 @@
+"""
+Verificación y benchmark de migrate_partitions.py sobre contenedores locales.
+
+Genera un contenedor con el modelo original (un documento por visita, particionado
+por id, más perfiles antiguos y el contador de IDs), lo migra en dos tramos para
+probar el checkpoint y comprueba que el destino quede completo: todas las visitas en
+la partición de su paciente, un perfil por paciente con los datos más recientes y el
+contador preservado. Informa RU y round trips de la migración, y el costo de buscar
+un paciente y leer su historial en el modelo nuevo.
+
+Uso:
+    python bench_migration.py --patients 500 --visits 5000 --page-size 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from fakes import InMemoryContainer
+from migrate_partitions import COUNTER_ID, migrate
+from patient_lookup import PatientDirectory
+from repository import SYSTEM_PARTITION, PartitionedCosmosPatientRepository
+
+
+def legacy_container(patients, visits, seed=7):
+    """Contenedor con el modelo original; devuelve también el último nombre de cada paciente."""
+    rng = random.Random(seed)
+    source = InMemoryContainer()
+    latest = {}
+    for n in range(1, visits + 1):
+        identification = str(rng.randrange(patients))
+        document = {"id": str(n), "identification": identification, "name": f"Paciente {identification} v{n}",
+                    "age": rng.randrange(1, 99), "sex": "Otro", "symptoms": "tos" * rng.randrange(1, 50)}
+        source.create_item(document)
+        latest[identification] = document["name"]
+    for identification in list(latest)[::10]:
+        # Algunos pacientes ya tenían perfil (creado por PatientDirectory), anterior a sus visitas
+        profile_id = PatientDirectory.profile_id(identification)
+        source.upsert_item({"id": profile_id, "type": "patient_profile", "identification": identification,
+                            "name": "Perfil antiguo", "age": 1, "sex": "Otro"})
+    source.create_item({"id": COUNTER_ID, "next": visits + 1})
+
+    # _ts distinto por documento para que "el más reciente" sea inequívoco
+    for ts, (key, document) in enumerate(sorted(source._items.items(), key=lambda kv: (
+            kv[1].get("type") != "patient_profile", int(kv[1]["id"]) if kv[1]["id"].isdigit() else 0))):
+        document["_ts"] = ts
+    return source, latest
+
+
+def verify(target, latest, visits):
+    failures = []
+    stored = list(target._items.values())
+    migrated_visits = [d for d in stored if d.get("type") == "visit"]
+    profiles = {d["identification"]: d for d in stored if d.get("type") == "patient_profile"}
+    if len(migrated_visits) != visits:
+        failures.append(f"se esperaban {visits} visitas y hay {len(migrated_visits)}")
+    if any("created_at" not in d for d in migrated_visits):
+        failures.append("hay visitas sin created_at")
+    if set(profiles) != set(latest):
+        failures.append(f"se esperaban {len(latest)} perfiles y hay {len(profiles)}")
+    wrong = [i for i, name in latest.items() if profiles.get(i, {}).get("name") != name]
+    if wrong:
+        failures.append(f"{len(wrong)} perfiles no tienen los datos más recientes")
+    counter = target._items.get((SYSTEM_PARTITION, COUNTER_ID))
+    if counter is None or counter["next"] <= visits:
+        failures.append("el contador de IDs no se migró")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--visits", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    source, latest = legacy_container(args.patients, args.visits)
+    target = InMemoryContainer(partition_key_path="identification")
+    checkpoint = os.path.join(tempfile.mkdtemp(), "migracion.json")
+    pages = -(-len(source._items) // args.page_size)
+
+    first = migrate(source, target, args.page_size, args.batch_size, checkpoint_path=checkpoint,
+                    max_pages=max(1, pages // 2))
+    resumed = migrate(source, target, args.page_size, args.batch_size, checkpoint_path=checkpoint)
+
+    print(f"primer tramo: {first}")
+    print(f"reanudación:  {resumed}")
+    print(f"destino: {target.round_trips} round trips, {target.request_charge:.0f} RU")
+
+    repository = PartitionedCosmosPatientRepository(target)
+    identification = next(iter(latest))
+    before = (target.round_trips, target.request_charge)
+    repository.find_patient(identification)
+    page = repository.list_visits(identification, page_size=20)
+    print(f"búsqueda + historial ({len(page.items)} visitas): {target.round_trips - before[0]} round trips, "
+          f"{target.request_charge - before[1]:.0f} RU, una sola partición")
+    new_id = repository.next_visit_id()
+    if int(new_id) <= args.visits:
+        print(f"FALLO: next_visit_id devolvió {new_id}, ya usado en el modelo original")
+        sys.exit(1)
+
+    failures = verify(target, latest, args.visits)
+    if os.path.exists(checkpoint):
+        failures.append("el checkpoint no se eliminó al terminar")
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
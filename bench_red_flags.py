@@ -0,0 +1,158 @@
+"""
+Verificación y benchmark de las reglas de señales de alarma (red_flags.py).
+
+1. Evalúa las reglas sobre un conjunto de síntomas etiquetados (con casos negados y
+   casos que dependen del formulario de salud) e informa los aciertos y errores.
+2. Mide el costo de una evaluación en microsegundos.
+3. Mide en main.py el tiempo hasta la respuesta de /triage/ para una visita con señal
+   de alarma y para una sin ella, con el modelo local de fakes.py, y comprueba que la
+   explicación del LLM se guarda después en segundo plano. httpx.ASGITransport espera
+   a las tareas en segundo plano, así que aquí se llama a la aplicación ASGI
+   directamente y se toma el tiempo del último fragmento de la respuesta.
+4. Muestra la tasa de coincidencias de cada regla registrada en metrics.py.
+
+Uso:
+    python bench_red_flags.py --llm-latency-ms 800
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+import clients
+import main
+import metrics
+import red_flags
+from fakes import AsyncInMemoryContainer, fake_chat_model
+from repository import AsyncCosmosPatientRepository
+
+NO = {"injury": "No", "smoking": "No", "allergies": "No", "obesity": "No", "hypertension": "No"}
+
+# (síntomas, respuestas del formulario distintas de "No", regla esperada o None)
+CASES = (
+    ("Tengo un dolor muy fuerte en el pecho que baja al brazo", {}, "dolor_toracico"),
+    ("Siento opresión en el pecho y sudor frío", {}, "dolor_toracico"),
+    ("¡No puedo respirar!", {}, "paro_respiratorio"),
+    ("Me estoy ahogando, tengo los labios morados", {}, "paro_respiratorio"),
+    ("Tengo dificultad para respirar al subir escaleras", {}, "dificultad_respiratoria"),
+    ("Mi papá se desmayó y no responde", {}, "inconsciencia"),
+    ("Tuvo convulsiones hace una hora", {}, "convulsiones"),
+    ("Tengo la cara caída de un lado y no puedo hablar bien", {}, "signos_acv"),
+    ("Vómito con sangre desde la mañana", {}, "hemorragia"),
+    ("Ya no quiero vivir, pienso en quitarme la vida", {}, "riesgo_suicida"),
+    ("Comí maní y se me cierra la garganta", {"allergies": "Sí"}, "anafilaxia"),
+    ("Dolor de cabeza muy intenso y visión borrosa", {"hypertension": "Sí"}, "crisis_hipertensiva"),
+    ("Me caí de la moto, golpe en la cabeza", {"injury": "Sí"}, "trauma_grave"),
+    ("Dolor de cabeza intenso desde hace dos días", {}, None),
+    ("No tengo dolor en el pecho, solo tos seca", {}, None),
+    ("Tos y fiebre sin dificultad para respirar", {}, None),
+    ("Me duele la garganta y tengo mocos", {}, None),
+    ("Dolor de estómago después de comer", {}, None),
+    ("Tengo una fractura vieja en la muñeca que molesta", {}, None),
+    ("Nunca me he desmayado, pero me mareo al levantarme", {}, None),
+)
+
+
+def check_rules():
+    failures = []
+    for symptoms, health, expected in CASES:
+        flag = red_flags.check({"symptoms": symptoms, **NO, **health})
+        got = flag.rule if flag else None
+        if got != expected:
+            failures.append(f"'{symptoms}': se esperaba {expected} y se obtuvo {got}")
+    print(f"reglas: {len(CASES) - len(failures)}/{len(CASES)} casos correctos")
+    return failures
+
+
+def time_rules(iterations):
+    visits = [{"symptoms": " ".join([symptoms] * 3), **NO, **health} for symptoms, health, _ in CASES]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for visit in visits:
+            red_flags.check(visit)
+    per_check = (time.perf_counter() - start) / (iterations * len(visits)) * 1e6
+    print(f"evaluación de las reglas: {per_check:.1f} µs por visita")
+
+
+async def time_to_response(session_id):
+    """Llama a GET /triage/ directamente y devuelve (segundos hasta la respuesta, segundos en total)."""
+    start, responded = time.perf_counter(), None
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/triage/", "raw_path": b"/triage/", "query_string": b"fresh=true", "root_path": "",
+        "headers": [(b"x-session-id", session_id.encode())], "server": ("bench", 80), "client": ("bench", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal responded
+        if message["type"] == "http.response.body" and not message.get("more_body") and responded is None:
+            responded = time.perf_counter()
+
+    await main.app(scope, receive, send)
+    return responded - start, time.perf_counter() - start
+
+
+async def time_triage(llm_latency):
+    repository = AsyncCosmosPatientRepository(AsyncInMemoryContainer())
+    clients.use_chat_model(fake_chat_model(latency=llm_latency))
+    main.app.dependency_overrides[main.get_repository] = lambda: repository
+    failures = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            for label, symptoms in (("con señal de alarma", "Dolor en el pecho y falta de aire"),
+                                    ("sin señal de alarma", "Me duele la garganta")):
+                response = await client.post("/chatbot/", json={
+                    "name": "Paciente", "identification": f"bench-{label}", "age": 50, "sex": "Otro"})
+                session_id = response.json()["session_id"]
+                headers = {"X-Session-Id": session_id}
+                await client.post("/health_form/", headers=headers, json=NO)
+                await client.post("/symptoms/", headers=headers, json={"symptoms": symptoms})
+
+                responded, total = await time_to_response(session_id)
+                print(f"/triage/ {label:<20} respuesta en {responded * 1000:>7.1f} ms, "
+                      f"explicación guardada a los {total * 1000:>7.1f} ms")
+                visit = main.session_store.get(session_id)["visit"]
+                if "NIVEL DE URGENCIA" not in visit.get("triage_result", ""):
+                    failures.append(f"{label}: la explicación del LLM no se guardó")
+                if label == "con señal de alarma" and visit.get("urgency_level") != 2:
+                    failures.append(f"{label}: el LLM rebajó el nivel de urgencia de la regla")
+    finally:
+        main.app.dependency_overrides.clear()
+    return failures
+
+
+def report_hit_rates():
+    rows = {(row["metric"], row.get("result") or row.get("rule")): row["value"] for row in metrics.REGISTRY.snapshot()
+            if row["metric"].startswith("saracare_red_flag")}
+    checks = sum(value for (metric, _), value in rows.items() if metric == "saracare_red_flag_checks_total")
+    hits = rows.get(("saracare_red_flag_checks_total", "hit"), 0)
+    print(f"tasa de coincidencia: {hits / checks:.1%} de {checks:.0f} evaluaciones")
+    for (metric, rule), value in sorted(rows.items()):
+        if metric == "saracare_red_flag_rule_hits_total":
+            print(f"  {rule:<26} {value / checks:>6.1%}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    failures = check_rules()
+    metrics.REGISTRY.clear()
+    time_rules(args.iterations)
+    report_hit_rates()
+    failures += asyncio.run(time_triage(args.llm_latency_ms / 1000))
+
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,84 @@
+"""
+Benchmark de operaciones por segundo de los backends de PatientRepository.
+
+Por defecto se miden los backends en memoria y SQLite y los repositorios de Cosmos DB,
+sin particionar y particionado por paciente, sobre el contenedor local de fakes.py;
+con --cosmos también el contenedor configurado en el .env. Las pruebas de conformidad
+de todos los backends, síncronos y asíncronos, están en tests/test_repository.py.
+
+Uso:
+    python bench_repository.py --visits 2000
+    python bench_repository.py --visits 200 --cosmos
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from fakes import InMemoryContainer
+from repository import (VISIT_SUMMARY_FIELDS, CosmosPatientRepository, InMemoryPatientRepository,
+                        PartitionedCosmosPatientRepository, SQLitePatientRepository)
+
+
+def unique(prefix):
+    return f"{prefix}-{uuid.uuid4().hex[:12]}"
+
+
+def timed(label, count, operation):
+    start = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<16} {count / elapsed:>10.0f} ops/s")
+
+
+def performance(repo, visits, patients):
+    prefix = unique("perf")
+    identifications = [f"{prefix}-{n}" for n in range(patients)]
+    stored = []
+
+    def create(i):
+        stored.append(repo.create_visit({
+            "id": repo.next_visit_id(), "identification": identifications[i % patients], "name": "Paciente",
+        }))
+
+    def patch(i):
+        stored[i] = repo.patch_visit(stored[i], {"symptoms": "dolor de cabeza", "triage_result": "moderado"})
+
+    for identification in identifications:
+        repo.register_patient(identification, "Paciente", 40, "Otro")
+
+    timed("create_visit", visits, create)
+    timed("patch_visit", visits, patch)
+    timed("find_patient", visits, lambda i: repo.find_patient(identifications[i % patients]))
+    timed("list_visits", visits, lambda i: repo.list_visits(identifications[i % patients], page_size=10))
+    timed("list_summaries", visits, lambda i: repo.list_visits(identifications[i % patients], page_size=10,
+                                                                fields=VISIT_SUMMARY_FIELDS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=2000)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--cosmos", action="store_true", help="Incluir el contenedor de Cosmos DB configurado")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    backends = [
+        ("memory", InMemoryPatientRepository()),
+        ("sqlite", SQLitePatientRepository(os.path.join(workdir, "saracare.db"))),
+        ("cosmos-local", CosmosPatientRepository(InMemoryContainer())),
+        ("cosmos-local-partitioned", PartitionedCosmosPatientRepository(InMemoryContainer(partition_key_path="identification"))),
+    ]
+    if args.cosmos:
+        from repository import create_repository
+        backends.append(("cosmos", create_repository("cosmos")))
+
+    for name, repo in backends:
+        print(f"[{name}]")
+        performance(repo, args.visits, args.patients)
+
+
+if __name__ == "__main__":
+    main()
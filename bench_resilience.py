@@ -0,0 +1,170 @@
+"""
+Verificación y benchmark de la capa de resiliencia del LLM (resilience.py).
+
+Usa modelos locales de fakes.py con latencia y errores inyectados y compara, con la
+misma carga, la cadena sin protección contra ResilientLLM:
+
+- cola de latencia: una fracción de llamadas es lenta; el hedging al segundo deployment
+  recorta el p99;
+- errores transitorios: los reintentos con jitter los absorben dentro del presupuesto;
+- caída del deployment principal: el circuit breaker deja de llamarlo y usa el de respaldo;
+- deployment colgado: el plazo corta cada llamada, también en la ruta síncrona de Streamlit.
+
+Termina con error si alguna de estas mejoras no se observa.
+
+Uso:
+    python bench_resilience.py --calls 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import fake_chat_model
+from functions import get_chain
+from resilience import DeadlineExceeded, LLMUnavailableError, ResilientLLM, RetryBudget
+
+INPUTS = {"system_prompt": "Eres un sistema experto en triage médico.", "input": "Paciente con tos."}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)] if values else 0.0
+
+
+async def run_calls(call, calls, concurrency):
+    """Ejecuta `calls` llamadas con `concurrency` simultáneas; devuelve (latencias ms, errores)."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies, errors
+
+
+def report(label, latencies, errors, extra=""):
+    print(f"{label:<42} p50 {percentile(latencies, 50):>7.1f}  p95 {percentile(latencies, 95):>7.1f}  "
+          f"p99 {percentile(latencies, 99):>7.1f} ms  errores {errors:>4}  {extra}")
+
+
+def unprotected(model):
+    return lambda: get_chain(model).ainvoke(INPUTS)
+
+
+def protected(resilient):
+    return lambda: resilient.ainvoke(lambda model: get_chain(model).ainvoke(INPUTS))
+
+
+async def tail_latency(args):
+    slow = dict(latency=args.latency_ms / 1000, slow_rate=args.slow_rate, slow_latency=args.slow_latency_ms / 1000)
+    primary, hedge = fake_chat_model(seed=1, **slow), fake_chat_model(seed=2, **slow)
+    base, _ = await run_calls(unprotected(primary), args.calls, args.concurrency)
+    report("cola de latencia, sin protección", base, 0)
+
+    primary, hedge = fake_chat_model(seed=1, **slow), fake_chat_model(seed=2, **slow)
+    resilient = ResilientLLM(models=lambda: (primary, hedge), hedge_percentile=90, hedge_min_samples=20,
+                             hedge_initial_delay=args.latency_ms * 3 / 1000, budget=RetryBudget(ratio=0.2))
+    hedged, errors = await run_calls(protected(resilient), args.calls, args.concurrency)
+    report("cola de latencia, hedging tras p90", hedged, errors,
+           f"respaldo usado en {hedge.calls / args.calls:.1%} de las llamadas")
+    return [] if percentile(hedged, 99) < percentile(base, 99) / 2 else ["el hedging no redujo el p99 a la mitad"]
+
+
+async def transient_errors(args):
+    model = fake_chat_model(latency=args.latency_ms / 1000, failure_rate=0.1, seed=3)
+    base, base_errors = await run_calls(unprotected(model), args.calls, args.concurrency)
+    report("10 % de errores 503, sin protección", base, base_errors)
+
+    model = fake_chat_model(latency=args.latency_ms / 1000, failure_rate=0.1, seed=3)
+    resilient = ResilientLLM(models=lambda: (model, None), base_delay=0.02, max_delay=0.2, breaker_failures=20)
+    retried, errors = await run_calls(protected(resilient), args.calls, args.concurrency)
+    report("10 % de errores 503, con reintentos", retried, errors,
+           f"{model.calls / args.calls:.2f} llamadas al modelo por petición")
+    failures = []
+    if errors > base_errors / 5:
+        failures.append("los reintentos no absorbieron los errores transitorios")
+    if model.calls > args.calls * 1.25:
+        failures.append("los reintentos superaron el presupuesto")
+    return failures
+
+
+async def outage(args):
+    primary = fake_chat_model(latency=args.latency_ms / 1000, failure_rate=1.0, seed=4)
+    hedge = fake_chat_model(latency=args.latency_ms / 1000, seed=5)
+    resilient = ResilientLLM(models=lambda: (primary, hedge), base_delay=0.01, max_delay=0.05, breaker_failures=5,
+                             breaker_reset=60)
+    latencies, errors = await run_calls(protected(resilient), args.calls, args.concurrency)
+    report("deployment principal caído", latencies, errors,
+           f"llamadas al principal: {primary.calls}, al respaldo: {hedge.calls}")
+    failures = []
+    if primary.calls > args.concurrency * 3:
+        failures.append("el circuit breaker no dejó de llamar al deployment caído")
+    if errors > args.concurrency:
+        failures.append("el deployment de respaldo no atendió las llamadas")
+
+    # Sin respaldo, con el breaker abierto las llamadas fallan de inmediato
+    alone = ResilientLLM(models=lambda: (primary, None), breaker_failures=1, breaker_reset=60, max_retries=0)
+    await run_calls(protected(alone), 1, 1)
+    latencies, errors = await run_calls(protected(alone), 100, 10)
+    report("breaker abierto, sin respaldo", latencies, errors)
+    try:
+        await protected(alone)()
+    except LLMUnavailableError as error:
+        if error.retry_after <= 0:
+            failures.append("LLMUnavailableError sin retry_after")
+    return failures
+
+
+async def hung_deployment(args):
+    model = fake_chat_model(latency=10.0, seed=6)
+    resilient = ResilientLLM(models=lambda: (model, None), deadline=args.deadline_ms / 1000)
+    latencies, errors = await run_calls(protected(resilient), args.concurrency, args.concurrency)
+    report(f"deployment colgado, plazo {args.deadline_ms:.0f} ms (async)", latencies, errors)
+
+    # Ruta síncrona (Streamlit): cada sesión llama desde su propio hilo
+    def sync_call():
+        start = time.perf_counter()
+        try:
+            resilient.invoke(lambda cliente: get_chain(cliente).invoke(INPUTS))
+        except DeadlineExceeded:
+            pass
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        sync_latencies = list(pool.map(lambda _: sync_call(), range(10)))
+    report(f"deployment colgado, plazo {args.deadline_ms:.0f} ms (sync)", sync_latencies, 10)
+    worst = max(latencies + sync_latencies)
+    return [] if worst < args.deadline_ms * 1.5 else [f"una llamada tardó {worst:.0f} ms pese al plazo"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Fracción de llamadas lentas")
+    parser.add_argument("--slow-latency-ms", type=float, default=2000.0)
+    parser.add_argument("--deadline-ms", type=float, default=500.0)
+    args = parser.parse_args()
+
+    failures = []
+    for scenario in (tail_latency, transient_errors, outage, hung_deployment):
+        failures += asyncio.run(scenario(args))
+    for failure in failures:
+        print(f"FALLO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark de arranque en frío y de reruns de Streamlit.
+
+Mide, en procesos nuevos, cuánto tarda importar cada punto de entrada y comprueba
+que importar functions no cargue langchain. Luego ejecuta app.py con el AppTest de
+Streamlit sobre un contenedor local y mide el tiempo de cada rerun. Con --max-import-ms
+y --max-rerun-ms el script termina con error si se supera el límite, para detectar
+regresiones.
+
+Uso:
+    python bench_startup.py --runs 5 --max-import-ms 1500 --max-rerun-ms 200
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ["clients", "functions", "main"]
+
+IMPORT_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, int(any(name.startswith("langchain") for name in sys.modules)))
+"""
+
+
+def import_time(module, runs):
+    timings, loads_langchain = [], False
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+                                capture_output=True, text=True, check=True).stdout.split()
+        timings.append(float(output[0]) * 1000)
+        loads_langchain = loads_langchain or output[1] == "1"
+    return statistics.median(timings), loads_langchain
+
+
+def rerun_times(runs):
+    from streamlit.testing.v1 import AppTest
+
+    import clients
+    from fakes import InMemoryContainer
+
+    clients.use_container(InMemoryContainer())
+    app = AppTest.from_file("app.py", default_timeout=30)
+    start = time.perf_counter()
+    app.run()
+    first = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return first, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-rerun-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = []
+    for module in MODULES:
+        elapsed, loads_langchain = import_time(module, args.runs)
+        print(f"import {module:<10} {elapsed:>8.1f} ms  langchain cargado: {'sí' if loads_langchain else 'no'}")
+        if args.max_import_ms is not None and elapsed > args.max_import_ms:
+            failures.append(f"import {module} tardó {elapsed:.1f} ms")
+        if module == "functions" and loads_langchain:
+            failures.append("importar functions carga langchain")
+
+    first, rerun = rerun_times(args.runs)
+    print(f"app.py primera ejecución {first:>8.1f} ms")
+    print(f"app.py rerun (mediana)   {rerun:>8.1f} ms")
+    if args.max_rerun_ms is not None and rerun > args.max_rerun_ms:
+        failures.append(f"rerun de app.py tardó {rerun:.1f} ms")
+
+    for failure in failures:
+        print(f"REGRESIÓN: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Round trips y RU por visita completa según la forma de escribir los pasos.
+
+Compara el patrón anterior (leer el documento, modificarlo y hacer upsert en cada
+paso) contra las actualizaciones parciales con patch y el modo borrador de
+visit_writes. Por defecto usa el contenedor local de fakes.py, con un modelo
+aproximado de RU; con --cosmos mide los cargos reales en la cuenta configurada en
+el .env (los documentos de prueba se eliminan al terminar).
+
+Uso:
+    python bench_visit_writes.py --visits 50
+    python bench_visit_writes.py --visits 5 --cosmos
+"""
+import argparse
+import os
+import uuid
+
+from dotenv import load_dotenv
+
+from fakes import InMemoryContainer
+from repository import CosmosPatientRepository
+from visit_writes import commit_visit, save_fields, start_visit
+
+HEALTH = {"injury": "No", "smoking": "Sí", "allergies": "No", "obesity": "No", "hypertension": "Sí"}
+SYMPTOMS = "Dolor de cabeza intenso desde hace dos días, con náuseas y sensibilidad a la luz."
+TRIAGE = "Nivel de urgencia: moderado. " * 20
+
+
+class ChargeMeter:
+    """Acumula round trips y RU a partir de las cabeceras de respuesta de Cosmos DB."""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.request_charge = 0.0
+
+    def __call__(self, headers, result):
+        self.round_trips += 1
+        self.request_charge += float(headers.get("x-ms-request-charge", 0))
+
+
+class MeteredContainer:
+    """Envuelve un contenedor y mide cada llamada con un response_hook."""
+
+    def __init__(self, container, meter):
+        self.container = container
+        self.meter = meter
+
+    def __getattr__(self, name):
+        method = getattr(self.container, name)
+
+        def call(*args, **kwargs):
+            return method(*args, response_hook=self.meter, **kwargs)
+        return call
+
+
+def new_visit():
+    visit_id = f"bench-{uuid.uuid4().hex}"
+    return {"id": visit_id, "identification": visit_id, "name": "Paciente", "age": 40, "sex": "Otro"}
+
+
+def read_modify_write(container, visit):
+    container.create_item(visit)
+    for fields in (HEALTH, {"symptoms": SYMPTOMS}, {"triage_result": TRIAGE}):
+        item = container.read_item(item=visit["id"], partition_key=visit["id"])
+        item.update(fields)
+        container.upsert_item(item)
+    return visit["id"]
+
+
+def patched(container, visit, draft=False):
+    repository = CosmosPatientRepository(container)
+    visit = start_visit(repository, visit, draft=draft)
+    for fields in (HEALTH, {"symptoms": SYMPTOMS}, {"triage_result": TRIAGE}):
+        visit = save_fields(repository, visit, fields, draft=draft)
+    return commit_visit(repository, visit, draft=draft)["id"]
+
+
+def cosmos_container():
+    from azure.cosmos import CosmosClient
+
+    load_dotenv()
+    client = CosmosClient(os.getenv("COSMOS_URI"), os.getenv("COSMOS_KEY"))
+    database = client.get_database_client(os.getenv("DATABASE_NAME"))
+    return database.get_container_client(os.getenv("CONTAINER_NAME"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visits", type=int, default=50)
+    parser.add_argument("--cosmos", action="store_true", help="Medir contra la cuenta de Cosmos DB configurada")
+    args = parser.parse_args()
+
+    container = cosmos_container() if args.cosmos else InMemoryContainer()
+    scenarios = [
+        ("read-modify-write", read_modify_write),
+        ("patch", patched),
+        ("draft", lambda c, v: patched(c, v, draft=True)),
+    ]
+    created = []
+    try:
+        for name, flow in scenarios:
+            meter = ChargeMeter()
+            metered = MeteredContainer(container, meter)
+            for _ in range(args.visits):
+                created.append(flow(metered, new_visit()))
+            print(f"{name:<18} {meter.round_trips / args.visits:>6.1f} round trips/visita "
+                  f"{meter.request_charge / args.visits:>8.1f} RU/visita")
+    finally:
+        if args.cosmos:
+            for visit_id in created:
+                container.delete_item(item=visit_id, partition_key=visit_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+Exportación e importación masiva de los documentos del contenedor de pacientes.
+
+`export` lee el contenedor por páginas con tokens de continuación y escribe cada
+página en cuanto llega, así que en memoria solo hay una página, sin importar el
+tamaño del contenedor. El archivo de salida puede ser:
+
+- NDJSON: un documento JSON por línea, comprimido con gzip si el nombre termina en
+  .gz. Conserva los documentos tal cual y es el formato para respaldos.
+- Parquet (columnar, para análisis): una columna por campo de --fields (por defecto,
+  los de una visita) y un row group por página. Los campos anidados, como
+  `retriage`, se guardan como texto JSON. Requiere pyarrow, que es una dependencia
+  opcional (pip install pyarrow).
+
+Con --fields solo se leen esos campos (la proyección se hace en Cosmos DB), con
+--since/--until solo los documentos con `created_at` en ese intervalo y con --type
+solo las visitas o los perfiles. Las visitas del contenedor sin particionar
+(COSMOS_PARTITION_KEY=id) no tienen `type`, así que --type visit también incluye los
+documentos de pacientes sin ese campo. Las visitas muy antiguas tampoco tienen `created_at`: no
+entran en una exportación con --since o --until. Los campos de sistema de Cosmos DB (_rid, _etag,
+_ts...) no se exportan. El archivo se escribe con otro nombre y se renombra al
+terminar, así que una exportación interrumpida no deja un respaldo incompleto.
+
+`import` lee un archivo NDJSON o Parquet en streaming, agrupa los documentos por
+clave de partición y los escribe con upserts en lotes transaccionales de hasta 100
+operaciones (execute_item_batch), con --concurrency lotes en curso. En memoria hay
+como máximo --buffer documentos esperando a completar su lote. Como todo son
+upserts, repetir una importación no duplica documentos. Al importar desde Parquet
+los campos nulos se omiten, porque en ese formato no se distingue un campo nulo de
+uno ausente.
+
+Las escrituras rechazadas por throttling (429) o por un error transitorio del
+servidor (408, 5xx) se reintentan hasta BULK_MAX_RETRIES veces, esperando lo que
+indica Cosmos DB (x-ms-retry-after-ms) o, si no lo indica, un tiempo creciente. Si
+un lote falla por un documento, los de esa partición se escriben uno por uno y solo
+los que Cosmos DB rechaza por inválidos (400, 409, 412, 413) cuentan como fallidos;
+cualquier otro error detiene la importación. El comando termina con código 1 si
+algún documento no se importó.
+
+Uso:
+    python bulk_transfer.py export respaldo.ndjson.gz
+    python bulk_transfer.py export visitas.parquet --type visit --since 2024-01-01 --until 2024-07-01
+    python bulk_transfer.py export sintomas.ndjson --fields id,created_at,symptoms,urgency_level
+    python bulk_transfer.py import respaldo.ndjson.gz --container pacientes-pruebas --concurrency 16
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+from azure.cosmos import exceptions
+from dotenv import load_dotenv
+
+from migrate_partitions import MAX_BATCH_SIZE, SYSTEM_FIELDS
+from repository import COSMOS_PARTITION_KEY, SYSTEM_PARTITION, check_fields
+
+BULK_PAGE_SIZE = int(os.getenv("BULK_PAGE_SIZE", "1000"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+# Documentos que el importador acumula como máximo mientras agrupa por partición
+BULK_BUFFER_SIZE = int(os.getenv("BULK_BUFFER_SIZE", "5000"))
+# Reintentos de una escritura con throttling o error transitorio, y espera base entre ellos
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "5"))
+BULK_RETRY_DELAY = float(os.getenv("BULK_RETRY_DELAY", "1"))
+
+# Errores de un documento concreto: se cuenta como fallido y la importación sigue
+DOCUMENT_ERROR_STATUS = frozenset((400, 409, 412, 413))
+
+# Columnas por defecto de una exportación a Parquet
+PARQUET_FIELDS = ("id", "identification", "type", "created_at", "name", "age", "sex", "injury", "smoking",
+                  "allergies", "obesity", "hypertension", "symptoms", "triage_result", "urgency_level",
+                  "urgency_rationale", "retriage")
+# Columnas enteras en Parquet; el resto son texto
+INTEGER_FIELDS = ("age", "urgency_level", "next")
+# Columnas que se guardan como texto JSON y se vuelven a convertir al importar
+JSON_FIELDS = ("retriage",)
+
+
+def export_query(fields=None, since=None, until=None, document_type=None):
+    """
+    Consulta de exportación con la proyección y los filtros indicados. Lanza ValueError
+    si algún campo de la proyección no es un identificador.
+    """
+    projection = ", ".join(f"c.{field}" for field in check_fields(fields)) if fields else "*"
+    conditions, parameters = [], []
+    for condition, name, value in (("c.created_at >= @since", "@since", since),
+                                   ("c.created_at < @until", "@until", until),
+                                   ("c.type = @type", "@type", document_type)):
+        if value:
+            conditions.append(condition)
+            parameters.append({"name": name, "value": value})
+    if document_type == "visit":
+        # Las visitas del contenedor sin particionar no tienen `type`; el contador de IDs tampoco,
+        # pero no pertenece a ningún paciente
+        conditions[-1] = "(NOT IS_DEFINED(c.type) OR c.type = @type) AND c.identification != @system"
+        parameters.append({"name": "@system", "value": SYSTEM_PARTITION})
+    query = f"SELECT {projection} FROM c"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, parameters
+
+
+def iter_pages(container, query, parameters=None, page_size=BULK_PAGE_SIZE):
+    """Genera los documentos de la consulta página por página, sin los campos de sistema."""
+    pages = container.query_items(query=query, parameters=parameters or [], enable_cross_partition_query=True,
+                                  max_item_count=page_size).by_page()
+    for page in pages:
+        yield [{key: value for key, value in document.items() if key not in SYSTEM_FIELDS} for document in page]
+
+
+def _pyarrow():
+    """Importa pyarrow, que solo hace falta para Parquet."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("El formato Parquet necesita pyarrow, que es opcional: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def file_format(path):
+    return "parquet" if path.endswith(".parquet") else "ndjson"
+
+
+class _AtomicWriter:
+    """Escribe en `path`.tmp y lo renombra a `path` solo si la exportación termina bien."""
+
+    def __init__(self, path):
+        self.path = path
+        self.temporary = f"{path}.tmp"
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        if exc_type is None:
+            os.replace(self.temporary, self.path)
+        elif os.path.exists(self.temporary):
+            os.remove(self.temporary)
+
+
+class NdjsonWriter(_AtomicWriter):
+    def __init__(self, path):
+        super().__init__(path)
+        opener = gzip.open if path.endswith(".gz") else open
+        self._file = opener(self.temporary, "wt", encoding="utf-8")
+
+    def write(self, documents):
+        self._file.writelines(json.dumps(document, ensure_ascii=False, default=str) + "\n" for document in documents)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(_AtomicWriter):
+    """
+    Escribe cada página como un row group de un archivo Parquet.
+
+    Args:
+        path (str): Archivo de salida.
+        fields (tuple): Columnas del archivo; por defecto, PARQUET_FIELDS.
+    """
+
+    def __init__(self, path, fields=None):
+        super().__init__(path)
+        self._pa, parquet = _pyarrow()
+        self.fields = tuple(fields or PARQUET_FIELDS)
+        self.schema = self._pa.schema([
+            self._pa.field(field, self._pa.int64() if field in INTEGER_FIELDS else self._pa.string(),
+                           metadata={"json": "1"} if field in JSON_FIELDS else None)
+            for field in self.fields])
+        self._writer = parquet.ParquetWriter(self.temporary, self.schema, compression="zstd")
+
+    def _value(self, field, value):
+        if value is None:
+            return None
+        if field in INTEGER_FIELDS:
+            return int(value)
+        if field in JSON_FIELDS or not isinstance(value, str):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        return value
+
+    def write(self, documents):
+        columns = {field: [self._value(field, document.get(field)) for document in documents]
+                   for field in self.fields}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def export(container, path, fmt=None, fields=None, since=None, until=None, document_type=None,
+           page_size=BULK_PAGE_SIZE):
+    """
+    Exporta los documentos del contenedor a un archivo NDJSON o Parquet.
+
+    Args:
+        container: ContainerProxy síncrono de Cosmos DB.
+        path (str): Archivo de salida.
+        fmt (str): "ndjson" o "parquet"; por defecto, según la extensión de `path`.
+        fields (tuple): Campos a exportar; por defecto, todos (en Parquet, PARQUET_FIELDS).
+        since (str): Fecha ISO; solo documentos creados desde entonces.
+        until (str): Fecha ISO; solo documentos creados antes.
+        document_type (str): "visit" o "patient_profile"; por defecto, todos.
+        page_size (int): Documentos por página leída.
+
+    Returns:
+        dict: Documentos y páginas exportados.
+    """
+    fmt = fmt or file_format(path)
+    query, parameters = export_query(fields, since, until, document_type)
+    writer = ParquetWriter(path, fields) if fmt == "parquet" else NdjsonWriter(path)
+    stats = {"documents": 0, "pages": 0}
+    with writer:
+        for page in iter_pages(container, query, parameters, page_size):
+            writer.write(page)
+            stats["documents"] += len(page)
+            stats["pages"] += 1
+    return stats
+
+
+def read_ndjson(path):
+    """Genera los documentos de un archivo NDJSON (comprimido con gzip si termina en .gz)."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_parquet(path, batch_size=BULK_PAGE_SIZE):
+    """Genera los documentos de un archivo Parquet, un row group a la vez."""
+    _, parquet = _pyarrow()
+    source = parquet.ParquetFile(path)
+    json_fields = {field.name for field in source.schema_arrow if (field.metadata or {}).get(b"json") == b"1"}
+    for batch in source.iter_batches(batch_size=batch_size):
+        for row in batch.to_pylist():
+            yield {field: json.loads(value) if field in json_fields else value
+                   for field, value in row.items() if value is not None}
+
+
+def read_documents(path, fmt=None):
+    return read_parquet(path) if (fmt or file_format(path)) == "parquet" else read_ndjson(path)
+
+
+def _transient(error):
+    """Indica si la escritura se puede reintentar: throttling, timeout o error del servidor."""
+    return error.status_code in (408, 429) or error.status_code >= 500
+
+
+def _retry_delay(error, attempt, base_delay):
+    """Segundos que Cosmos DB pide esperar antes de reintentar, o la espera exponencial."""
+    retry_after_ms = (error.headers or {}).get("x-ms-retry-after-ms")
+    if retry_after_ms is not None:
+        return float(retry_after_ms) / 1000
+    return base_delay * 2 ** attempt
+
+
+def call_with_retries(operation, *args, max_retries=BULK_MAX_RETRIES, retry_delay=BULK_RETRY_DELAY, on_retry=None,
+                      **kwargs):
+    """
+    Ejecuta una escritura en Cosmos DB y la reintenta ante throttling o errores
+    transitorios, con la espera que indica Cosmos DB. Los demás errores, y el último
+    intento fallido, se propagan.
+
+    Args:
+        operation: Método del contenedor (p. ej. container.upsert_item).
+        max_retries (int): Reintentos como máximo.
+        retry_delay (float): Espera base entre reintentos si Cosmos DB no indica otra.
+        on_retry: Función sin argumentos que se llama antes de cada reintento.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return operation(*args, **kwargs)
+        except exceptions.CosmosHttpResponseError as e:
+            if not _transient(e) or attempt == max_retries:
+                raise
+            if on_retry is not None:
+                on_retry()
+            time.sleep(_retry_delay(e, attempt, retry_delay))
+
+
+class BulkImporter:
+    """
+    Escribe documentos agrupados por partición con lotes transaccionales concurrentes.
+
+    Args:
+        container: ContainerProxy síncrono de Cosmos DB.
+        partition_key (str): Campo de la clave de partición del contenedor.
+        concurrency (int): Lotes que se escriben a la vez.
+        batch_size (int): Operaciones por lote, como máximo 100.
+        buffer_size (int): Documentos acumulados como máximo antes de escribir los
+            lotes incompletos.
+        max_retries (int): Reintentos de una escritura con throttling o error transitorio.
+        retry_delay (float): Espera base entre reintentos si Cosmos DB no indica otra.
+    """
+
+    def __init__(self, container, partition_key=COSMOS_PARTITION_KEY, concurrency=BULK_CONCURRENCY,
+                 batch_size=MAX_BATCH_SIZE, buffer_size=BULK_BUFFER_SIZE, max_retries=BULK_MAX_RETRIES,
+                 retry_delay=BULK_RETRY_DELAY):
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size debe estar entre 1 y {MAX_BATCH_SIZE}.")
+        self.container = container
+        self.partition_key = partition_key
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stats = defaultdict(int)
+        self._error = None
+
+    def _with_retries(self, operation, counts, *args, **kwargs):
+        """Ejecuta una escritura con call_with_retries y cuenta sus reintentos en `counts`."""
+        def retried():
+            counts["retries"] = counts.get("retries", 0) + 1
+
+        return call_with_retries(operation, *args, max_retries=self.max_retries, retry_delay=self.retry_delay,
+                                 on_retry=retried, **kwargs)
+
+    def _write_partition(self, partition, documents):
+        """Escribe los documentos de una partición; devuelve los contadores de la escritura."""
+        counts = {}
+        if len(documents) > 1:
+            try:
+                self._with_retries(self.container.execute_item_batch, counts,
+                                   [("upsert", (document,)) for document in documents], partition_key=partition)
+                return {**counts, "written": len(documents), "batches": 1}
+            except exceptions.CosmosBatchOperationError:
+                # Un documento inválido hace fallar todo el lote: se escriben uno por uno
+                pass
+            except exceptions.CosmosHttpResponseError as e:
+                # El lote superó el tamaño máximo de una petición
+                if e.status_code != 413:
+                    raise
+        counts.update(written=0, upserts=0, failed=0)
+        for document in documents:
+            try:
+                self._with_retries(self.container.upsert_item, counts, document)
+                counts["written"] += 1
+                counts["upserts"] += 1
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code not in DOCUMENT_ERROR_STATUS:
+                    raise
+                counts["failed"] += 1
+        return counts
+
+    async def _write(self, partition, documents, semaphore):
+        try:
+            counts = await asyncio.to_thread(self._write_partition, partition, documents)
+            for name, count in counts.items():
+                self.stats[name] += count
+        except Exception as e:
+            # Un error que no es de un documento (credenciales, red) detiene la importación
+            self._error = self._error or e
+        finally:
+            semaphore.release()
+
+    async def run(self, documents):
+        """
+        Importa los documentos de un iterable.
+
+        Returns:
+            dict: Documentos escritos, lotes, upserts individuales, reintentos, fallidos e
+            inválidos (sin clave de partición o sin id).
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        pending, buffered = defaultdict(list), 0
+
+        async def submit(partition, batch):
+            await semaphore.acquire()
+            if self._error is not None:
+                raise self._error
+            task = asyncio.create_task(self._write(partition, batch, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            # Deja arrancar el lote antes de seguir leyendo el archivo
+            await asyncio.sleep(0)
+
+        for document in documents:
+            partition = document.get(self.partition_key)
+            if partition is None or "id" not in document:
+                self.stats["invalid"] += 1
+                continue
+            self.stats["read"] += 1
+            batch = pending[partition]
+            batch.append(document)
+            buffered += 1
+            if len(batch) >= self.batch_size:
+                del pending[partition]
+                buffered -= len(batch)
+                await submit(partition, batch)
+            elif buffered >= self.buffer_size:
+                for partition, batch in pending.items():
+                    await submit(partition, batch)
+                pending, buffered = defaultdict(list), 0
+
+        for partition, batch in pending.items():
+            await submit(partition, batch)
+        await asyncio.gather(*tasks)
+        if self._error is not None:
+            raise self._error
+        return dict(self.stats)
+
+
+def _container(name):
+    import clients
+
+    if not name:
+        return clients.get_container()
+    return clients.get_cosmos_client().get_database_client(clients.DATABASE_NAME).get_container_client(name)
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("path")
+    common.add_argument("--container", default=None, help="Por defecto, CONTAINER_NAME del .env")
+    common.add_argument("--format", choices=("ndjson", "parquet"), default=None,
+                        help="Por defecto, parquet si el archivo termina en .parquet y ndjson si no")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", parents=[common], help="Exportar el contenedor a un archivo")
+    export_parser.add_argument("--fields", help="Campos separados por comas (p. ej. id,created_at,symptoms)")
+    export_parser.add_argument("--since", help="Solo documentos creados desde esta fecha ISO (p. ej. 2024-01-01); "
+                                               "excluye los que no tienen created_at")
+    export_parser.add_argument("--until", help="Solo documentos creados antes de esta fecha ISO; "
+                                               "excluye los que no tienen created_at")
+    export_parser.add_argument("--type", choices=("visit", "patient_profile"), default=None)
+    export_parser.add_argument("--page-size", type=int, default=BULK_PAGE_SIZE)
+
+    import_parser = commands.add_parser("import", parents=[common], help="Importar un archivo al contenedor")
+    import_parser.add_argument("--partition-key", default=COSMOS_PARTITION_KEY)
+    import_parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    import_parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    import_parser.add_argument("--buffer", type=int, default=BULK_BUFFER_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    container = _container(args.container)
+    start = time.perf_counter()
+    if args.command == "export":
+        fields = tuple(field.strip() for field in args.fields.split(",")) if args.fields else None
+        try:
+            check_fields(fields or ())
+        except ValueError as e:
+            parser.error(str(e))
+        stats = export(container, args.path, fmt=args.format, fields=fields, since=args.since, until=args.until,
+                       document_type=args.type, page_size=args.page_size)
+    else:
+        importer = BulkImporter(container, partition_key=args.partition_key, concurrency=args.concurrency,
+                                batch_size=args.batch_size, buffer_size=args.buffer)
+        stats = asyncio.run(importer.run(read_documents(args.path, args.format)))
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(stats, ensure_ascii=False))
+    if stats.get("failed") or stats.get("invalid"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Procesador del change feed de Cosmos DB que mantiene agregados del triage.
+
+Lee en orden las visitas que escriben app.py y main.py y actualiza de forma
+incremental los agregados de los tableros: visitas por hora, distribución del nivel
+de urgencia y prevalencia de las respuestas del formulario de salud (tabaquismo,
+hipertensión, etc.). Los agregados se guardan en un archivo SQLite local, así que
+leerlos no cuesta RU ni recorre el contenedor.
+
+Cada visita aporta una sola vez a cada agregado: se guarda su aporte y, si el change
+feed vuelve a entregarla (p. ej. tras guardar el triage), se resta el aporte anterior
+antes de sumar el nuevo. Los agregados y el checkpoint del change feed se escriben en
+la misma transacción, así que al reiniciar el procesador continúa donde quedó sin
+contar nada dos veces. El change feed en modo "latest version" no informa borrados:
+una visita eliminada sigue contando.
+
+Uso:
+    python change_feed.py            # procesa los cambios de forma continua
+    python change_feed.py --once     # procesa lo pendiente y termina
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from repository import SYSTEM_PARTITION
+
+AGGREGATES_DB_PATH = os.getenv("AGGREGATES_DB_PATH", "aggregates.db")
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "5"))
+CHANGE_FEED_PAGE_SIZE = int(os.getenv("CHANGE_FEED_PAGE_SIZE", "100"))
+
+# Respuestas del formulario de salud cuya prevalencia se agrega
+PREVALENCE_FIELDS = ("smoking", "hypertension", "obesity", "allergies", "injury")
+UNKNOWN_URGENCY = "sin_nivel"
+
+
+def visit_contribution(document):
+    """
+    Devuelve los pares (métrica, clave) a los que aporta una visita, o None si el
+    documento no es una visita (perfiles de paciente, contador de IDs).
+    """
+    if document.get("type", "visit") != "visit" or document.get("identification") in (None, SYSTEM_PARTITION):
+        return None
+    created_at = document.get("created_at")
+    if created_at is None:
+        created_at = datetime.fromtimestamp(document.get("_ts", 0), timezone.utc).isoformat()
+    keys = [("visits_by_hour", created_at[:13])]
+    if "triage_result" in document:
+        level = document.get("urgency_level")
+        keys.append(("urgency", str(level) if level is not None else UNKNOWN_URGENCY))
+    for field in PREVALENCE_FIELDS:
+        if document.get(field) is not None:
+            keys.append((field, str(document[field])))
+    return keys
+
+
+class AggregateStore:
+    """
+    Agregados materializados y checkpoints del change feed en un archivo SQLite local.
+
+    Lo escribe un único procesador y lo leen los tableros desde cualquier proceso de
+    la máquina (modo WAL).
+    """
+
+    def __init__(self, path=AGGREGATES_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS aggregates (
+                    metric TEXT NOT NULL, key TEXT NOT NULL, value INTEGER NOT NULL,
+                    PRIMARY KEY (metric, key)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS contributions (visit_id TEXT PRIMARY KEY, keys TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    name TEXT PRIMARY KEY, continuation TEXT NOT NULL, updated_at REAL NOT NULL);
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def checkpoint(self, name):
+        """Devuelve el token de continuación guardado para el consumidor `name`, o None."""
+        row = self._connection().execute("SELECT continuation FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def apply(self, documents, name, continuation):
+        """
+        Aplica una página del change feed y guarda su checkpoint en una sola transacción.
+        Con `continuation` None se aplica la página y el checkpoint no cambia; como el
+        aporte de cada visita se guarda, volver a aplicarla no la cuenta dos veces.
+
+        Returns:
+            int: Visitas cuyo aporte a los agregados cambió.
+        """
+        changed = 0
+        with self._connection() as conn:
+            for document in documents:
+                keys = visit_contribution(document)
+                if keys is None:
+                    continue
+                row = conn.execute("SELECT keys FROM contributions WHERE visit_id = ?", (document["id"],)).fetchone()
+                previous = [tuple(key) for key in json.loads(row[0])] if row else []
+                if previous == keys:
+                    continue
+                for metric, key in previous:
+                    conn.execute("UPDATE aggregates SET value = value - 1 WHERE metric = ? AND key = ?", (metric, key))
+                conn.executemany(
+                    "INSERT INTO aggregates (metric, key, value) VALUES (?, ?, 1) "
+                    "ON CONFLICT (metric, key) DO UPDATE SET value = value + 1", keys)
+                conn.execute("INSERT OR REPLACE INTO contributions (visit_id, keys) VALUES (?, ?)",
+                             (document["id"], json.dumps(keys)))
+                changed += 1
+            conn.execute("DELETE FROM aggregates WHERE value <= 0")
+            if continuation is not None:
+                conn.execute("INSERT OR REPLACE INTO checkpoints (name, continuation, updated_at) VALUES (?, ?, ?)",
+                             (name, continuation, time.time()))
+        return changed
+
+    def metric(self, metric, since=None):
+        """Devuelve {clave: valor} de una métrica; `since` filtra claves mayores o iguales."""
+        query, parameters = "SELECT key, value FROM aggregates WHERE metric = ?", [metric]
+        if since is not None:
+            query += " AND key >= ?"
+            parameters.append(since)
+        return dict(self._connection().execute(query + " ORDER BY key", parameters).fetchall())
+
+    def dashboard(self, hours=24):
+        """
+        Resumen para los tableros: visitas de las últimas `hours` horas (UTC), visitas
+        por nivel de urgencia y prevalencia de cada respuesta del formulario de salud.
+        """
+        since = (datetime.now(timezone.utc) - timedelta(hours=hours - 1)).isoformat()[:13]
+        prevalence = {}
+        for field in PREVALENCE_FIELDS:
+            answers = self.metric(field)
+            answered = sum(answers.values())
+            prevalence[field] = {"answers": answers,
+                                 "rate": round(answers.get("Sí", 0) / answered, 4) if answered else None}
+        row = self._connection().execute("SELECT MAX(updated_at) FROM checkpoints").fetchone()
+        return {
+            "visits_by_hour": self.metric("visits_by_hour", since=since),
+            "urgency": self.metric("urgency"),
+            "prevalence": prevalence,
+            "updated_at": row[0],
+        }
+
+
+class ChangeFeedProcessor:
+    """
+    Consume el change feed de un contenedor y alimenta un AggregateStore.
+
+    Args:
+        container: ContainerProxy síncrono de Cosmos DB.
+        store (AggregateStore): Destino de los agregados y del checkpoint.
+        name (str): Nombre del consumidor; cada nombre tiene su propio checkpoint.
+        page_size (int): Documentos por página del change feed.
+    """
+
+    def __init__(self, container, store, name="triage-aggregates", page_size=CHANGE_FEED_PAGE_SIZE):
+        self.container = container
+        self.store = store
+        self.name = name
+        self.page_size = page_size
+
+    def run_once(self):
+        """Procesa los cambios pendientes y devuelve la cantidad de documentos leídos."""
+        continuation = self.store.checkpoint(self.name)
+        position = {"continuation": continuation} if continuation else {"start_time": "Beginning"}
+        feed = self.container.query_items_change_feed(max_item_count=self.page_size, **position)
+        pages = feed.by_page()
+        processed = 0
+        for page in pages:
+            documents = list(page)
+            # El token de la página es el estado de todas las particiones en base64; la
+            # cabecera etag solo trae el LSN de una de ellas y no sirve para reanudar.
+            # Sin token se aplican los documentos igual y se conserva el checkpoint anterior.
+            self.store.apply(documents, self.name, pages.continuation_token)
+            processed += len(documents)
+        return processed
+
+    def run_forever(self, poll_interval=CHANGE_FEED_POLL_INTERVAL, stop=None):
+        """Procesa los cambios hasta que se active `stop`, esperando `poll_interval` sin cambios nuevos."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Procesar lo pendiente y terminar")
+    parser.add_argument("--db", default=AGGREGATES_DB_PATH, help="Archivo SQLite de los agregados")
+    parser.add_argument("--name", default="triage-aggregates", help="Nombre del consumidor (checkpoint)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    import clients
+
+    processor = ChangeFeedProcessor(clients.get_container(), AggregateStore(args.db), name=args.name)
+    if args.once:
+        print(f"{processor.run_once()} documentos procesados")
+    else:
+        processor.run_forever()
+
+
+if __name__ == "__main__":
+    main()
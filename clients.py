@@ -0,0 +1,141 @@
+"""
+Fábrica compartida de clientes de Cosmos DB y Azure OpenAI.
+
+Los clientes se crean de forma perezosa la primera vez que se piden y se reutilizan
+en todo el proceso. Las importaciones pesadas (langchain) se hacen dentro de las
+funciones, de modo que importar este módulo no cuesta nada.
+"""
+import os
+import threading
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COSMOS_URI = os.getenv("COSMOS_URI")
+COSMOS_KEY = os.getenv("COSMOS_KEY")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+
+# Pool de conexiones HTTP del cliente asíncrono de Cosmos DB
+COSMOS_POOL_SIZE = int(os.getenv("COSMOS_POOL_SIZE", "100"))
+COSMOS_POOL_KEEPALIVE = float(os.getenv("COSMOS_POOL_KEEPALIVE", "30"))
+COSMOS_CONNECTION_TIMEOUT = int(os.getenv("COSMOS_CONNECTION_TIMEOUT", "10"))
+
+# Límite de cada petición HTTP a Azure OpenAI. Los reintentos los hace resilience.py,
+# así que el SDK no reintenta por su cuenta.
+AZURE_OPENAI_TIMEOUT = float(os.getenv("AZURE_OPENAI_TIMEOUT", "30"))
+# Segundo deployment opcional para las peticiones de respaldo (hedging) de resilience.py
+AZURE_OPENAI_HEDGE_DEPLOYMENT_ID = os.getenv("AZURE_OPENAI_HEDGE_DEPLOYMENT_ID")
+
+_lock = threading.Lock()
+_cosmos_client = None
+_container = None
+_chat_model = None
+_hedge_chat_model = None
+
+
+def get_cosmos_client():
+    """Devuelve el CosmosClient síncrono del proceso, creándolo si hace falta."""
+    global _cosmos_client
+    if _cosmos_client is None:
+        with _lock:
+            if _cosmos_client is None:
+                from azure.cosmos import CosmosClient
+                _cosmos_client = CosmosClient(COSMOS_URI, COSMOS_KEY)
+    return _cosmos_client
+
+
+def get_container():
+    """Devuelve el contenedor de pacientes del proceso, creándolo si hace falta."""
+    global _container
+    if _container is None:
+        client = get_cosmos_client()
+        with _lock:
+            if _container is None:
+                database = client.get_database_client(DATABASE_NAME)
+                _container = database.get_container_client(CONTAINER_NAME)
+    return _container
+
+
+def get_chat_model():
+    """Devuelve el modelo AzureChatOpenAI del proceso, creándolo si hace falta."""
+    global _chat_model
+    if _chat_model is None:
+        with _lock:
+            if _chat_model is None:
+                _chat_model = _azure_chat_model(os.getenv("AZURE_OPENAI_DEPLOYMENT_ID"))
+    return _chat_model
+
+
+def get_hedge_chat_model():
+    """Devuelve el modelo del deployment de respaldo, o None si no está configurado."""
+    global _hedge_chat_model
+    if _hedge_chat_model is None and AZURE_OPENAI_HEDGE_DEPLOYMENT_ID:
+        with _lock:
+            if _hedge_chat_model is None:
+                _hedge_chat_model = _azure_chat_model(AZURE_OPENAI_HEDGE_DEPLOYMENT_ID)
+    return _hedge_chat_model
+
+
+def _azure_chat_model(deployment):
+    from langchain_openai import AzureChatOpenAI
+    return AzureChatOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_deployment=deployment,
+        openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        temperature=0.7,
+        timeout=AZURE_OPENAI_TIMEOUT,
+        max_retries=0,
+    )
+
+
+def use_container(container):
+    """Reemplaza el contenedor del proceso (por ejemplo, por un sustituto local en benchmarks)."""
+    global _container
+    with _lock:
+        _container = container
+
+
+def use_chat_model(chat_model, hedge_chat_model=None):
+    """
+    Reemplaza el modelo de lenguaje del proceso (por ejemplo, por un modelo falso en
+    benchmarks) y, opcionalmente, el del deployment de respaldo.
+    """
+    global _chat_model, _hedge_chat_model
+    with _lock:
+        _chat_model = chat_model
+        _hedge_chat_model = hedge_chat_model
+
+
+@asynccontextmanager
+async def async_container():
+    """
+    Abre un cliente asíncrono de Cosmos DB con un pool de conexiones dimensionado
+    y entrega el contenedor de pacientes. Cliente y sesión HTTP se cierran al salir.
+    """
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+    from azure.cosmos.aio import CosmosClient
+
+    connector = aiohttp.TCPConnector(
+        limit=COSMOS_POOL_SIZE,
+        limit_per_host=COSMOS_POOL_SIZE,
+        keepalive_timeout=COSMOS_POOL_KEEPALIVE,
+        ttl_dns_cache=300,
+    )
+    session = aiohttp.ClientSession(connector=connector)
+    client = CosmosClient(
+        COSMOS_URI,
+        COSMOS_KEY,
+        transport=AioHttpTransport(session=session, session_owner=False),
+        connection_timeout=COSMOS_CONNECTION_TIMEOUT,
+    )
+    try:
+        database = client.get_database_client(DATABASE_NAME)
+        yield database.get_container_client(CONTAINER_NAME)
+    finally:
+        await client.close()
+        await session.close()
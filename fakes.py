@@ -0,0 +1,624 @@
+import asyncio
+import base64
+import copy
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+# Modelo aproximado de cargo en RU por KB de documento
+READ_RU_PER_KB = 1
+WRITE_RU_PER_KB = 5
+
+class InMemoryContainer:
+    """
+    Sustituto local de un ContainerProxy de Cosmos DB para pruebas de carga y benchmarks.
+
+    Implementa el subconjunto de la API que usa la aplicación, con latencia simulada
+    por operación, un contador de round trips y un cargo en RU aproximado
+    (1 RU por KB leído y 5 RU por KB escrito), que se informa a `response_hook` con la
+    misma cabecera que usa Cosmos DB.
+
+    Args:
+        latency (float): Segundos de latencia simulada por cada llamada.
+        scan_latency_per_item (float): Segundos adicionales por documento en lecturas completas.
+        partition_key_path (str): Campo del documento que actúa como clave de partición.
+    """
+
+    def __init__(self, latency=0.0, scan_latency_per_item=0.0, partition_key_path="id"):
+        self.latency = latency
+        self.partition_key_path = partition_key_path
+        self.scan_latency_per_item = scan_latency_per_item
+        self.round_trips = 0
+        self.request_charge = 0.0
+        self._items = {}
+        self._lsn = 0
+        self._lock = threading.Lock()
+
+    def _key(self, item_id, partition_key):
+        return (str(partition_key), str(item_id))
+
+    def _body_key(self, body):
+        return self._key(body["id"], body[self.partition_key_path])
+
+    def _round_trip(self, extra=0.0):
+        with self._lock:
+            self.round_trips += 1
+        delay = self.latency + extra
+        if delay:
+            time.sleep(delay)
+
+    def _stored(self, body):
+        stored = copy.deepcopy(body)
+        stored["_etag"] = uuid.uuid4().hex
+        stored["_ts"] = int(time.time())
+        # Número de secuencia de la escritura, con el que se ordena el change feed
+        self._lsn += 1
+        stored["_lsn"] = self._lsn
+        return stored
+
+    def _respond(self, document, ru_per_kb, response_hook=None):
+        kilobytes = max(1, math.ceil(len(json.dumps(document, default=str)) / 1024))
+        charge = float(ru_per_kb * kilobytes)
+        with self._lock:
+            self.request_charge += charge
+        result = copy.deepcopy(document)
+        if response_hook is not None:
+            response_hook({"x-ms-request-charge": str(charge)}, result)
+        return result
+
+    def _check_etag(self, current, etag, match_condition):
+        if match_condition == MatchConditions.IfNotModified and etag is not None:
+            if current is None or current.get("_etag") != etag:
+                raise exceptions.CosmosAccessConditionFailedError(
+                    status_code=412, message="El ETag del documento no coincide.")
+
+    def _get(self, key, item_id):
+        stored = self._items.get(key)
+        if stored is None:
+            raise exceptions.CosmosResourceNotFoundError(
+                status_code=404, message=f"No existe el documento {item_id}.")
+        return stored
+
+    def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        self._round_trip()
+        with self._lock:
+            stored = self._get(self._key(item, partition_key), item)
+        return self._respond(stored, READ_RU_PER_KB, response_hook)
+
+    def create_item(self, body, response_hook=None, **kwargs):
+        self._round_trip()
+        key = self._body_key(body)
+        with self._lock:
+            if key in self._items:
+                raise exceptions.CosmosResourceExistsError(
+                    status_code=409, message=f"Ya existe el documento {body['id']}.")
+            self._items[key] = stored = self._stored(body)
+        return self._respond(stored, WRITE_RU_PER_KB, response_hook)
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        self._round_trip()
+        with self._lock:
+            self._items[self._body_key(body)] = stored = self._stored(body)
+        return self._respond(stored, WRITE_RU_PER_KB, response_hook)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, response_hook=None, **kwargs):
+        self._round_trip()
+        key = self._body_key(body)
+        with self._lock:
+            self._check_etag(self._get(key, body["id"]), etag, match_condition)
+            self._items[key] = stored = self._stored(body)
+        return self._respond(stored, WRITE_RU_PER_KB, response_hook)
+
+    def patch_item(self, item, partition_key, patch_operations, etag=None, match_condition=None,
+                   response_hook=None, **kwargs):
+        self._round_trip()
+        key = self._key(item, partition_key)
+        with self._lock:
+            current = self._get(key, item)
+            self._check_etag(current, etag, match_condition)
+            patched = copy.deepcopy(current)
+            for operation in patch_operations:
+                _apply_patch(patched, operation)
+            self._items[key] = stored = self._stored(patched)
+        return self._respond(stored, WRITE_RU_PER_KB, response_hook)
+
+    def read_all_items(self, **kwargs):
+        with self._lock:
+            snapshot = [copy.deepcopy(item) for item in self._items.values()]
+        self._round_trip(self.scan_latency_per_item * len(snapshot))
+        return iter(snapshot)
+
+    def query_items(self, query, parameters=None, partition_key=None, max_item_count=None,
+                    response_hook=None, **kwargs):
+        """
+        Ejecuta un subconjunto del SQL de Cosmos DB: proyección (`*`, `VALUE c.campo` o
+        lista de `c.campo`), TOP, condiciones `c.campo <op> valor` o
+        `(NOT IS_DEFINED(c.campo) OR c.campo <op> valor)` unidas con AND y ORDER BY.
+        Cada página cuesta un round trip y se cobra como una lectura.
+        """
+        with self._lock:
+            snapshot = [copy.deepcopy(item) for key, item in self._items.items()
+                        if partition_key is None or key[0] == str(partition_key)]
+        results = _run_query(query, parameters or [], snapshot)
+        return _QueryIterable(self, results, max_item_count or 100, response_hook)
+
+    def _page(self, items, response_hook=None, headers=None):
+        self._round_trip()
+        kilobytes = max(1, math.ceil(len(json.dumps(items, default=str)) / 1024))
+        charge = float(READ_RU_PER_KB * kilobytes)
+        with self._lock:
+            self.request_charge += charge
+        if response_hook is not None:
+            response_hook({**(headers or {}), "x-ms-request-charge": str(charge)}, items)
+        return items
+
+    def query_items_change_feed(self, continuation=None, start_time=None, max_item_count=None,
+                                response_hook=None, **kwargs):
+        """
+        Change feed en modo "latest version": la última versión de cada documento escrito
+        después de la posición indicada, en orden de escritura. Como en Cosmos DB, la
+        cabecera etag de cada página trae el LSN de una sola partición y el token de
+        continuación que hay que guardar es el estado completo en base64 que expone
+        `continuation_token` del iterador de páginas.
+        """
+        with self._lock:
+            if continuation is not None:
+                start = _change_feed_position(continuation)
+            elif start_time == "Beginning":
+                start = 0
+            else:
+                start = self._lsn
+            changed = sorted((copy.deepcopy(item) for item in self._items.values() if item["_lsn"] > start),
+                             key=lambda item: item["_lsn"])
+        return _ChangeFeedIterable(self, changed, start, max_item_count or 100, response_hook)
+
+    def execute_item_batch(self, batch_operations, partition_key, response_hook=None, **kwargs):
+        """Lote transaccional: todas las operaciones se aplican o ninguna."""
+        self._round_trip()
+        with self._lock:
+            staged = dict(self._items)
+            results = []
+            for index, (operation, args, *rest) in enumerate(batch_operations):
+                body = args[0] if operation in ("create", "upsert", "replace") else None
+                item_id = body["id"] if body is not None else args[0]
+                key = self._key(item_id, partition_key)
+                if body is not None and str(body.get(self.partition_key_path)) != str(partition_key):
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=400,
+                        message="El documento no pertenece a la partición del lote.", operation_responses=[])
+                if operation == "create" and key in staged:
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=409,
+                        message=f"Ya existe el documento {item_id}.", operation_responses=[])
+                if operation in ("replace", "patch", "read", "delete") and key not in staged:
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=404,
+                        message=f"No existe el documento {item_id}.", operation_responses=[])
+                if operation == "delete":
+                    del staged[key]
+                    results.append({"statusCode": 204})
+                elif operation == "read":
+                    results.append({"statusCode": 200, "resourceBody": copy.deepcopy(staged[key])})
+                elif operation == "patch":
+                    patched = copy.deepcopy(staged[key])
+                    for patch_operation in args[1]:
+                        _apply_patch(patched, patch_operation)
+                    staged[key] = stored = self._stored(patched)
+                    results.append({"statusCode": 200, "resourceBody": stored})
+                else:
+                    staged[key] = stored = self._stored(body)
+                    results.append({"statusCode": 201 if operation == "create" else 200, "resourceBody": stored})
+            self._items = staged
+        charge = float(sum(WRITE_RU_PER_KB * max(1, math.ceil(len(json.dumps(result.get("resourceBody", {}),
+                                                                                  default=str)) / 1024))
+                           for result in results))
+        with self._lock:
+            self.request_charge += charge
+        if response_hook is not None:
+            response_hook({"x-ms-request-charge": str(charge)}, results)
+        return copy.deepcopy(results)
+
+
+_QUERY = re.compile(
+    r"^\s*SELECT\s+(?:TOP\s+(?P<top>\d+)\s+)?(?P<projection>.+?)\s+FROM\s+c"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?\s*$", re.IGNORECASE | re.DOTALL)
+_CONDITION = re.compile(r"^(?:\(NOT IS_DEFINED\(c\.(?P<optional>\w+)\) OR )?c\.(?P<field>\w+)\s*"
+                        r"(?P<operator>=|!=|<=|>=|<|>)\s*(?P<token>@\w+|'[^']*'|-?\d+(?:\.\d+)?|true|false)\)?$",
+                        re.IGNORECASE)
+_OPERATORS = {
+    "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+}
+
+
+def _literal(token, parameters):
+    if token.startswith("@"):
+        return parameters[token]
+    if token.startswith("'"):
+        return token[1:-1]
+    if token in ("true", "false"):
+        return token == "true"
+    return float(token) if "." in token else int(token)
+
+
+def _run_query(query, parameters, documents):
+    match = _QUERY.match(query)
+    if match is None:
+        raise NotImplementedError(f"Consulta no soportada por el contenedor local: {query}")
+    values = {parameter["name"]: parameter["value"] for parameter in parameters}
+
+    for condition in re.split(r"\s+AND\s+", match["where"], flags=re.IGNORECASE) if match["where"] else []:
+        parsed = _CONDITION.match(condition.strip())
+        if parsed is None or parsed["optional"] not in (None, parsed["field"]):
+            raise NotImplementedError(f"Condición no soportada por el contenedor local: {condition}")
+        field, operator, optional = parsed["field"], parsed["operator"], parsed["optional"] is not None
+        expected = _literal(parsed["token"], values)
+        documents = [document for document in documents if (
+            _OPERATORS[operator](document[field], expected) if field in document else optional)]
+
+    if match["order"]:
+        orders = [term.strip().split() for term in match["order"].split(",")]
+        for term in reversed(orders):
+            field = term[0].removeprefix("c.")
+            documents = [document for document in documents if field in document]
+            documents.sort(key=lambda document: document[field],
+                           reverse=len(term) > 1 and term[1].upper() == "DESC")
+
+    if match["top"]:
+        documents = documents[:int(match["top"])]
+
+    projection = match["projection"].strip()
+    if projection == "*":
+        return documents
+    if projection.upper().startswith("VALUE "):
+        field = projection[6:].strip().removeprefix("c.")
+        return [document[field] for document in documents if field in document]
+    fields = [field.strip().removeprefix("c.") for field in projection.split(",")]
+    return [{field: document[field] for field in fields if field in document} for document in documents]
+
+
+class _QueryIterable:
+    """Resultado de query_items con la interfaz de ItemPaged (iteración y by_page)."""
+
+    def __init__(self, container, results, page_size, response_hook=None):
+        self.container = container
+        self.results = results
+        self.page_size = page_size
+        self.response_hook = response_hook
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _QueryPages(self, int(continuation_token or 0))
+
+
+class _QueryPages:
+    def __init__(self, query, offset):
+        self.query = query
+        self.offset = offset
+        self.continuation_token = None
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        results = self.query.results
+        page = results[self.offset:self.offset + self.query.page_size]
+        self.offset += len(page)
+        self._finished = self.offset >= len(results)
+        self.continuation_token = None if self._finished else str(self.offset)
+        return self.query.container._page(page, self.query.response_hook)
+
+
+class _ChangeFeedIterable:
+    """Resultado de query_items_change_feed; sin cambios nuevos devuelve una página vacía."""
+
+    def __init__(self, container, changes, start, page_size, response_hook=None):
+        self.container = container
+        self.changes = changes
+        self.start = start
+        self.page_size = page_size
+        self.response_hook = response_hook
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _ChangeFeedPages(self)
+
+
+class _ChangeFeedPages:
+    def __init__(self, feed):
+        self.feed = feed
+        self.position = feed.start
+        self.offset = 0
+        self.continuation_token = None
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        feed = self.feed
+        page = feed.changes[self.offset:self.offset + feed.page_size]
+        self.offset += feed.page_size
+        self._finished = self.offset >= len(feed.changes)
+        if page:
+            self.position = page[-1]["_lsn"]
+        self.continuation_token = _change_feed_token(self.position)
+        return iter(feed.container._page(page, feed.response_hook, {"etag": f'"{self.position}"'}))
+
+
+def _change_feed_token(position):
+    """Token de continuación del change feed: estado versionado en JSON codificado en base64."""
+    state = {"v": "V2", "rid": "fake", "continuation": [{"range": {"min": "", "max": "FF"}, "token": f'"{position}"'}]}
+    return base64.b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+
+def _change_feed_position(token):
+    state = json.loads(base64.b64decode(token))
+    return int(state["continuation"][0]["token"].strip('"'))
+
+
+def _apply_patch(document, operation):
+    *parents, field = operation["path"].strip("/").split("/")
+    target = document
+    for parent in parents:
+        target = target.setdefault(parent, {})
+    op = operation["op"]
+    if op in ("set", "add", "replace"):
+        target[field] = copy.deepcopy(operation["value"])
+    elif op == "remove":
+        target.pop(field, None)
+    elif op == "incr":
+        target[field] = target.get(field, 0) + operation["value"]
+    else:
+        raise ValueError(f"Operación de patch no soportada: {op}")
+
+
+class AsyncInMemoryContainer:
+    """
+    Versión asíncrona de InMemoryContainer, con la API de azure.cosmos.aio.
+
+    Args:
+        latency (float): Segundos de latencia simulada por cada llamada.
+        blocking (bool): Si es True, la latencia se simula con time.sleep y bloquea el
+            bucle de eventos, igual que el cliente síncrono usado dentro de un endpoint async.
+        partition_key_path (str): Campo del documento que actúa como clave de partición.
+    """
+
+    def __init__(self, latency=0.0, blocking=False, partition_key_path="id"):
+        self.latency = latency
+        self.blocking = blocking
+        self.store = InMemoryContainer(partition_key_path=partition_key_path)
+
+    @property
+    def round_trips(self):
+        return self.store.round_trips
+
+    @property
+    def request_charge(self):
+        return self.store.request_charge
+
+    async def _wait(self):
+        if self.blocking:
+            time.sleep(self.latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await self._wait()
+        return self.store.read_item(item, partition_key, **kwargs)
+
+    async def create_item(self, body, **kwargs):
+        await self._wait()
+        return self.store.create_item(body, **kwargs)
+
+    async def upsert_item(self, body, **kwargs):
+        await self._wait()
+        return self.store.upsert_item(body, **kwargs)
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        await self._wait()
+        return self.store.replace_item(item, body, etag=etag, match_condition=match_condition, **kwargs)
+
+    async def patch_item(self, item, partition_key, patch_operations, etag=None, match_condition=None, **kwargs):
+        await self._wait()
+        return self.store.patch_item(item, partition_key, patch_operations, etag=etag,
+                                     match_condition=match_condition, **kwargs)
+
+    def query_items(self, query, parameters=None, partition_key=None, max_item_count=None, **kwargs):
+        results = self.store.query_items(query, parameters=parameters, partition_key=partition_key,
+                                         max_item_count=max_item_count, **kwargs)
+        return _AsyncQueryIterable(self, results)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        await self._wait()
+        return self.store.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+
+
+class _AsyncQueryIterable:
+    """Resultado de query_items con la interfaz de AsyncItemPaged."""
+
+    def __init__(self, container, results):
+        self.container = container
+        self.results = results
+
+    async def __aiter__(self):
+        async for page in self.by_page():
+            async for item in page:
+                yield item
+
+    def by_page(self, continuation_token=None):
+        return _AsyncQueryPages(self.container, self.results.by_page(continuation_token))
+
+
+class _AsyncQueryPages:
+    def __init__(self, container, pages):
+        self.container = container
+        self.pages = pages
+
+    @property
+    def continuation_token(self):
+        return self.pages.continuation_token
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.container._wait()
+        try:
+            page = next(self.pages)
+        except StopIteration:
+            raise StopAsyncIteration
+        return _AsyncPage(page)
+
+
+class _AsyncPage:
+    def __init__(self, items):
+        self.items = items
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+
+FAKE_TRIAGE_RESPONSE = ("Se recomienda consulta médica en las próximas horas.\n"
+                        "NIVEL DE URGENCIA: 3\n"
+                        "JUSTIFICACIÓN: Síntomas persistentes sin signos de alarma.")
+
+
+class FakeServiceUnavailable(Exception):
+    """Error que simula una respuesta 503 de Azure OpenAI."""
+
+    status_code = 503
+
+
+class FakeRateLimited(Exception):
+    """Error que simula una respuesta 429 de Azure OpenAI al superar la cuota."""
+
+    status_code = 429
+
+
+def fake_chat_model(response=FAKE_TRIAGE_RESPONSE, latency=0.0, token_latency=0.0, slow_rate=0.0, slow_latency=0.0,
+                    failure_rate=0.0, seed=None, capacity=None):
+    """
+    Crea un modelo de chat local que sustituye a AzureChatOpenAI en pruebas de carga.
+
+    Devuelve siempre la misma respuesta, dividida en tokens por palabra. langchain se
+    importa aquí dentro para que importar fakes siga siendo barato.
+
+    Args:
+        response (str): Texto que devuelve el modelo.
+        latency (float): Segundos hasta el primer token.
+        token_latency (float): Segundos adicionales por cada token generado.
+        slow_rate (float): Fracción de llamadas que tardan `slow_latency` en lugar de `latency`.
+        slow_latency (float): Segundos hasta el primer token en las llamadas lentas.
+        failure_rate (float): Fracción de llamadas que fallan con FakeServiceUnavailable.
+        seed (int): Semilla de las llamadas lentas y fallidas, para resultados reproducibles.
+        capacity (int): Llamadas simultáneas que admite el deployment; las que exceden
+            fallan de inmediato con FakeRateLimited, como al superar la cuota.
+
+    Returns:
+        BaseChatModel: Modelo con contadores de llamadas en `calls` y de llamadas
+        rechazadas por la cuota en `throttled`.
+    """
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    rng = random.Random(seed)
+
+    class FakeChatModel(BaseChatModel):
+        response: str
+        latency: float = 0.0
+        token_latency: float = 0.0
+        slow_rate: float = 0.0
+        slow_latency: float = 0.0
+        failure_rate: float = 0.0
+        capacity: Optional[int] = None
+        calls: int = 0
+        throttled: int = 0
+        in_flight: int = 0
+
+        @property
+        def _llm_type(self):
+            return "saracare-fake"
+
+        def _call(self):
+            """Cuenta la llamada y sortea su latencia hasta el primer token y si falla."""
+            self.calls += 1
+            delay = self.slow_latency if rng.random() < self.slow_rate else self.latency
+            return re.findall(r"\S+\s*", self.response), delay, rng.random() < self.failure_rate
+
+        def _check(self, failed):
+            if failed:
+                raise FakeServiceUnavailable("Servicio no disponible (simulado).")
+
+        @contextmanager
+        def _quota(self):
+            """Ocupa una de las llamadas simultáneas del deployment mientras dura la llamada."""
+            if self.capacity is not None and self.in_flight >= self.capacity:
+                self.throttled += 1
+                raise FakeRateLimited("Se superó la cuota del deployment (simulado).")
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+        def _result(self):
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            with self._quota():
+                tokens, delay, failed = self._call()
+                time.sleep(delay + self.token_latency * len(tokens))
+                self._check(failed)
+                return self._result()
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            with self._quota():
+                tokens, delay, failed = self._call()
+                await asyncio.sleep(delay + self.token_latency * len(tokens))
+                self._check(failed)
+                return self._result()
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            with self._quota():
+                tokens, delay, failed = self._call()
+                time.sleep(delay)
+                self._check(failed)
+                for token in tokens:
+                    time.sleep(self.token_latency)
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            with self._quota():
+                tokens, delay, failed = self._call()
+                await asyncio.sleep(delay)
+                self._check(failed)
+                for token in tokens:
+                    await asyncio.sleep(self.token_latency)
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    return FakeChatModel(response=response, latency=latency, token_latency=token_latency, slow_rate=slow_rate,
+                         slow_latency=slow_latency, failure_rate=failure_rate, capacity=capacity)
@@ -1,48 +1,456 @@
+import asyncio
+import hashlib
+import json
 import os
-from langchain_openai import AzureChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
 from dotenv import load_dotenv
+from clients import get_chat_model
+import metrics
+from resilience import llm
+from collections import namedtuple
+from ttl_cache import TTLCache
 
 load_dotenv()  
 
+# Máximo de llamadas simultáneas al LLM en las invocaciones por lotes
+TRIAGE_MAX_CONCURRENCY = int(os.getenv("TRIAGE_MAX_CONCURRENCY", "8"))
 
-cliente = AzureChatOpenAI(
-    azure_endpoint= os.getenv("AZURE_OPENAI_ENDPOINT"),  
-    azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_ID"),  
-    openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"), 
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"), 
-    temperature=0.7  
+# Caché de respuestas del triage: "memory", "disk" o "none"
+TRIAGE_CACHE_BACKEND = os.getenv("TRIAGE_CACHE_BACKEND", "memory")
+TRIAGE_CACHE_SIZE = int(os.getenv("TRIAGE_CACHE_SIZE", "1024"))
+TRIAGE_CACHE_TTL = float(os.getenv("TRIAGE_CACHE_TTL", "86400"))
+TRIAGE_CACHE_PATH = os.getenv("TRIAGE_CACHE_PATH", "triage_cache.db")
+
+# Instrucciones que se agregan al prompt del triage para poder extraer el nivel de urgencia.
+# La escala sigue el Emergency Severity Index: 1 es el más urgente.
+URGENCY_INSTRUCTIONS = (
+    "\n\nTermina siempre tu respuesta con estas dos líneas, exactamente con este formato:\n"
+    "NIVEL DE URGENCIA: <número del 1 (atención inmediata) al 5 (no urgente)>\n"
+    "JUSTIFICACIÓN: <una sola frase que explique el nivel>"
 )
 
+_URGENCY_LEVEL = re.compile(r"NIVEL\s+DE\s+URGENCIA[\s*]*[:=\-][\s*]*([1-5])\b", re.IGNORECASE)
+_URGENCY_RATIONALE = re.compile(r"JUSTIFICACI[OÓ]N[\s*]*[:=\-][\s*]*(.+)", re.IGNORECASE)
+
+# Resultado del triage: texto completo del modelo, nivel de urgencia (1-5 o None) y justificación
+TriageResult = namedtuple("TriageResult", ["text", "urgency_level", "urgency_rationale"])
+
+# Cadena de cada modelo (principal y de respaldo), por id del modelo
+_chains = {}
+_chain_lock = threading.Lock()
+
+
+def get_chain(cliente=None):
+    """
+    Devuelve la cadena prompt | modelo | parser, construida una sola vez por modelo.
+
+    langchain se importa aquí y no al importar el módulo, para no penalizar el arranque.
+
+    Args:
+        cliente: Modelo de chat; por defecto, el del proceso.
+    """
+    cliente = cliente or get_chat_model()
+    cached = _chains.get(id(cliente))
+    if cached is None or cached[0] is not cliente:
+        with _chain_lock:
+            cached = _chains.get(id(cliente))
+            if cached is None or cached[0] is not cliente:
+                from langchain_core.prompts import ChatPromptTemplate
+                from langchain_core.output_parsers import StrOutputParser
+
+                prompt_without_context = ChatPromptTemplate.from_messages([
+                    ("system", "{system_prompt}"),
+                    ("human", "{input}"),
+                    ("assistant", "")
+                ])
+
+                # Crear el parser de salida
+                output_parser = StrOutputParser()
+
+                # Encadenar los runnables usando el operador pipe
+                cached = _chains[id(cliente)] = (cliente, prompt_without_context | cliente | output_parser)
+    return cached[1]
+
+
+def __getattr__(name):
+    # Compatibilidad: `functions.cliente` sigue disponible, pero se crea al usarlo
+    if name == "cliente":
+        return get_chat_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+
+class MemoryCompletionCache:
+    """
+    Caché en memoria de respuestas del LLM, con desalojo LRU y TTL.
+
+    Args:
+        maxsize (int): Máximo de respuestas guardadas.
+        ttl (float): Segundos que una respuesta permanece válida.
+    """
+
+    def __init__(self, maxsize=1024, ttl=86400.0):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+
+class DiskCompletionCache:
+    """
+    Caché de respuestas del LLM en un archivo SQLite, que sobrevive a reinicios.
+
+    Al superar `maxsize` se desalojan las entradas usadas hace más tiempo.
+
+    Args:
+        path (str): Ruta del archivo SQLite.
+        maxsize (int): Máximo de respuestas guardadas.
+        ttl (float): Segundos que una respuesta permanece válida.
+    """
+
+    def __init__(self, path="triage_cache.db", maxsize=1024, ttl=86400.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM completions WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM completions WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+
+def create_completion_cache():
+    """Crea la caché de respuestas configurada en TRIAGE_CACHE_BACKEND."""
+    if TRIAGE_CACHE_BACKEND == "memory":
+        return MemoryCompletionCache(maxsize=TRIAGE_CACHE_SIZE, ttl=TRIAGE_CACHE_TTL)
+    if TRIAGE_CACHE_BACKEND == "disk":
+        return DiskCompletionCache(path=TRIAGE_CACHE_PATH, maxsize=TRIAGE_CACHE_SIZE, ttl=TRIAGE_CACHE_TTL)
+    if TRIAGE_CACHE_BACKEND == "none":
+        return None
+    raise ValueError(f"TRIAGE_CACHE_BACKEND desconocido: {TRIAGE_CACHE_BACKEND}")
+
+
+completion_cache = create_completion_cache()
+
 
+def _normalize(text):
+    return " ".join(unicodedata.normalize("NFC", str(text)).split())
 
-def generate_prompt_without_retrieval_new(system_prompt, pregunta):
+
+def completion_cache_key(system_prompt, pregunta):
+    """
+    Clave de caché basada en el contenido: hash del prompt del sistema, los datos del
+    paciente y la configuración del modelo, tras normalizar espacios y Unicode.
+    """
+    cliente = get_chat_model()
+    payload = json.dumps({
+        "system_prompt": _normalize(system_prompt),
+        "input": _normalize(pregunta),
+        "model": type(cliente).__name__,
+        "deployment": getattr(cliente, "deployment_name", None),
+        "api_version": getattr(cliente, "openai_api_version", None),
+        "temperature": getattr(cliente, "temperature", None),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cached(system_prompt, pregunta, use_cache):
+    if completion_cache is None:
+        return None, None
+    key = completion_cache_key(system_prompt, pregunta)
+    if not use_cache:
+        metrics.LLM_CACHE_REQUESTS.inc(result="bypass")
+        return key, None
+    response = completion_cache.get(key)
+    metrics.LLM_CACHE_REQUESTS.inc(result="miss" if response is None else "hit")
+    return key, response
+
+
+def _store(key, response):
+    if completion_cache is not None and key is not None:
+        completion_cache.set(key, response)
+
+
+def _config(**config):
+    # Registrar los tokens de cada llamada al modelo en las métricas
+    if metrics.METRICS_ENABLED:
+        config["callbacks"] = [metrics.llm_usage_callback()]
+    return config
+
+
+def generate_prompt_without_retrieval_new(system_prompt, pregunta, use_cache=True):
     """
     Genera una respuesta utilizando solo el LLM sin documentos recuperados.
-    
+
     Args:
         system_prompt (str): El prompt del sistema para el asistente.
         pregunta (str): La pregunta que deseas hacer al LLM.
-        cliente: La instancia del modelo de lenguaje (e.g., ChatOpenAI).
-    
+        use_cache (bool): Si es False, ignora la caché y pide una respuesta nueva al modelo
+            (que igualmente se guarda en la caché).
+
     Returns:
-        dict: Respuesta generada por el modelo con la clave 'answer'.
-    """
-
-    prompt_without_context = ChatPromptTemplate.from_messages([
-    ("system", "{system_prompt}"),
-    ("human", "{input}"),
-    ("assistant", "")
-    ])
-
-    # Crear el parser de salida
-    output_parser = StrOutputParser()
-    
-    # Encadenar los runnables usando el operador pipe
-    chain = prompt_without_context | cliente | output_parser
-    
-    # Ejecutar la cadena con la nueva pregunta
-    response = chain.invoke({"system_prompt": system_prompt, "input": pregunta})
-    
-    return response
\ No newline at end of file
+        str: Respuesta generada por el modelo.
+    """
+    key, response = _cached(system_prompt, pregunta, use_cache)
+    if response is not None:
+        return response
+
+    # Ejecutar la cadena con la nueva pregunta (con plazo, reintentos y hedging)
+    inputs = {"system_prompt": system_prompt, "input": pregunta}
+    with metrics.LLM_SECONDS.time(operation="invoke"):
+        response = llm.invoke(lambda cliente: get_chain(cliente).invoke(inputs, config=_config()))
+    _store(key, response)
+
+    return response
+
+
+async def agenerate_prompt_without_retrieval_new(system_prompt, pregunta, use_cache=True):
+    """
+    Versión asíncrona de generate_prompt_without_retrieval_new.
+
+    No bloquea el bucle de eventos mientras el modelo genera la respuesta.
+
+    Args:
+        system_prompt (str): El prompt del sistema para el asistente.
+        pregunta (str): La pregunta que deseas hacer al LLM.
+        use_cache (bool): Si es False, ignora la caché y pide una respuesta nueva al modelo.
+
+    Returns:
+        str: Respuesta generada por el modelo.
+    """
+    key, response = _cached(system_prompt, pregunta, use_cache)
+    if response is not None:
+        return response
+    inputs = {"system_prompt": system_prompt, "input": pregunta}
+    with metrics.LLM_SECONDS.time(operation="ainvoke"):
+        response = await llm.ainvoke(lambda cliente: get_chain(cliente).ainvoke(inputs, config=_config()))
+    _store(key, response)
+    return response
+
+
+async def abatch_generate_prompt_without_retrieval_new(system_prompt, preguntas,
+                                                       max_concurrency=TRIAGE_MAX_CONCURRENCY,
+                                                       use_cache=True):
+    """
+    Genera las respuestas de varias preguntas con el mismo prompt del sistema.
+
+    Solo las preguntas que no están en caché llegan al modelo.
+
+    Args:
+        system_prompt (str): El prompt del sistema para el asistente.
+        preguntas (list[str]): Las preguntas que deseas hacer al LLM.
+        max_concurrency (int): Máximo de llamadas simultáneas al modelo.
+        use_cache (bool): Si es False, ignora la caché y pide respuestas nuevas al modelo.
+
+    Returns:
+        list[str]: Respuestas en el mismo orden que las preguntas.
+    """
+    lookups = [_cached(system_prompt, pregunta, use_cache) for pregunta in preguntas]
+    pending = [i for i, (_, response) in enumerate(lookups) if response is None]
+    inputs = [{"system_prompt": system_prompt, "input": preguntas[i]} for i in pending]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate(item):
+        # Cada pregunta tiene su propio plazo y sus reintentos, como una llamada individual
+        async with semaphore:
+            return await llm.ainvoke(lambda cliente: get_chain(cliente).ainvoke(item, config=_config()))
+
+    generated = []
+    if inputs:
+        with metrics.LLM_SECONDS.time(operation="abatch"):
+            generated = await asyncio.gather(*(generate(item) for item in inputs))
+
+    responses = [response for _, response in lookups]
+    for i, response in zip(pending, generated):
+        _store(lookups[i][0], response)
+        responses[i] = response
+    return responses
+
+
+def stream_prompt_without_retrieval_new(system_prompt, pregunta, use_cache=True):
+    """
+    Genera la respuesta del LLM token por token, a medida que el modelo la produce.
+
+    Si la respuesta ya está en caché se entrega completa en un solo fragmento.
+
+    Args:
+        system_prompt (str): El prompt del sistema para el asistente.
+        pregunta (str): La pregunta que deseas hacer al LLM.
+        use_cache (bool): Si es False, ignora la caché y pide una respuesta nueva al modelo.
+
+    Yields:
+        str: Fragmentos de la respuesta en orden de llegada.
+    """
+    key, response = _cached(system_prompt, pregunta, use_cache)
+    if response is not None:
+        yield response
+        return
+
+    tokens = []
+    start = time.perf_counter()
+    inputs = {"system_prompt": system_prompt, "input": pregunta}
+    for token in llm.stream(lambda cliente: get_chain(cliente).stream(inputs, config=_config())):
+        if not tokens:
+            metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, operation="stream")
+        tokens.append(token)
+        yield token
+    metrics.LLM_SECONDS.observe(time.perf_counter() - start, operation="stream")
+    _store(key, "".join(tokens))
+
+
+async def astream_prompt_without_retrieval_new(system_prompt, pregunta, use_cache=True):
+    """
+    Versión asíncrona de stream_prompt_without_retrieval_new.
+
+    Yields:
+        str: Fragmentos de la respuesta en orden de llegada.
+    """
+    key, response = _cached(system_prompt, pregunta, use_cache)
+    if response is not None:
+        yield response
+        return
+
+    tokens = []
+    start = time.perf_counter()
+    inputs = {"system_prompt": system_prompt, "input": pregunta}
+    async for token in llm.astream(lambda cliente: get_chain(cliente).astream(inputs, config=_config())):
+        if not tokens:
+            metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, operation="astream")
+        tokens.append(token)
+        yield token
+    metrics.LLM_SECONDS.observe(time.perf_counter() - start, operation="astream")
+    _store(key, "".join(tokens))
+
+
+# Prompt del sistema del triage en la API y en el re-triage masivo (backfill.py)
+TRIAGE_SYSTEM_PROMPT = "Eres un sistema experto en triage médico. Proporciona el nivel de urgencia basado en los siguientes datos del paciente."
+
+
+def build_triage_request(user_item):
+    """
+    Extrae los datos del paciente y construye la pregunta para el modelo de IA.
+
+    Returns:
+        tuple: (pregunta, user) con el texto para el LLM y el resumen de datos del paciente.
+    """
+    # Extraer todos los datos necesarios
+    user = {
+        "name": user_item.get("name", "Usuario"),
+        "age": user_item.get("age", "No disponible"),
+        "sex": user_item.get("sex", "No disponible"),
+        "injury": user_item.get("injury", "No disponible"),
+        "smoking": user_item.get("smoking", "No disponible"),
+        "allergies": user_item.get("allergies", "No disponible"),
+        "obesity": user_item.get("obesity", "No disponible"),
+        "hypertension": user_item.get("hypertension", "No disponible"),
+        "symptoms": user_item.get("symptoms", "No hay síntomas registrados")
+    }
+
+    # Crear el prompt para el modelo de IA basado en los datos del usuario
+    pregunta = (f"Paciente {user['name']}, edad {user['age']}, sexo {user['sex']}. "
+                f"Síntomas: {user['symptoms']}. Datos clínicos: Lesión: {user['injury']}, "
+                f"Fuma: {user['smoking']}, Alergias: {user['allergies']}, Obesidad: {user['obesity']}, "
+                f"Hipertensión: {user['hypertension']}.")
+    return pregunta, user
+
+
+def triage_system_prompt(system_prompt):
+    """Agrega al prompt del sistema el formato con el que el modelo debe indicar la urgencia."""
+    return system_prompt + URGENCY_INSTRUCTIONS
+
+
+def parse_triage(text):
+    """
+    Extrae el nivel de urgencia y su justificación de la respuesta del modelo.
+
+    Args:
+        text (str): Respuesta completa del triage.
+
+    Returns:
+        TriageResult: El texto original, el nivel (int de 1 a 5, o None si el modelo no
+        siguió el formato) y la justificación (o None).
+    """
+    level = _URGENCY_LEVEL.search(text)
+    rationale = _URGENCY_RATIONALE.search(text)
+    return TriageResult(
+        text,
+        int(level.group(1)) if level else None,
+        rationale.group(1).strip().strip("*").strip() if rationale else None,
+    )
+
+
+def triage_fields(result):
+    """Campos de la visita que guardan el resultado del triage."""
+    return {
+        "triage_result": result.text,
+        "urgency_level": result.urgency_level,
+        "urgency_rationale": result.urgency_rationale,
+    }
+
+
+def generate_triage(system_prompt, pregunta, use_cache=True):
+    """
+    Genera el triage y devuelve también el nivel de urgencia estructurado.
+
+    Args:
+        system_prompt (str): El prompt del sistema para el asistente.
+        pregunta (str): Datos del paciente.
+        use_cache (bool): Si es False, ignora la caché y pide una respuesta nueva al modelo.
+
+    Returns:
+        TriageResult: Texto, nivel de urgencia y justificación.
+    """
+    return parse_triage(generate_prompt_without_retrieval_new(triage_system_prompt(system_prompt), pregunta,
+                                                              use_cache=use_cache))
+
+
+async def agenerate_triage(system_prompt, pregunta, use_cache=True):
+    """Versión asíncrona de generate_triage."""
+    return parse_triage(await agenerate_prompt_without_retrieval_new(triage_system_prompt(system_prompt), pregunta,
+                                                                     use_cache=use_cache))
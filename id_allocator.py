@@ -0,0 +1,160 @@
+import asyncio
+import random
+import threading
+import time
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+
+class IdAllocator:
+    """
+    Asigna IDs numéricos progresivos con costo constante por ID.
+
+    En lugar de recorrer todo el contenedor, cada proceso reserva bloques de IDs
+    sobre un documento contador. La reserva se hace con concurrencia optimista
+    (ETag + IfNotModified), por lo que dos kioscos nunca reciben el mismo ID.
+    Los IDs de un bloque que no se usen antes de reiniciar el proceso se pierden,
+    así que la secuencia puede tener huecos pero nunca duplicados.
+
+    Args:
+        container: Contenedor de Cosmos DB (o un sustituto compatible).
+        counter_id (str): ID del documento contador.
+        block_size (int): Cantidad de IDs reservados en cada viaje a la base de datos.
+        seed (callable): Función que devuelve el primer ID libre cuando el contador
+            todavía no existe (por ejemplo, a partir de los registros actuales).
+        max_retries (int): Intentos máximos ante conflictos de ETag antes de fallar.
+        partition_key_path (str): Campo del contenedor que actúa como clave de partición.
+        partition_key (str): Valor de la clave de partición del contador (por defecto, su ID).
+    """
+
+    def __init__(self, container, counter_id="visit-id-counter", block_size=20,
+                 seed=None, max_retries=50, partition_key_path="id", partition_key=None):
+        if block_size < 1:
+            raise ValueError("block_size debe ser mayor o igual a 1.")
+        self.container = container
+        self.counter_id = counter_id
+        self.block_size = block_size
+        self.seed = seed
+        self.max_retries = max_retries
+        self.partition_key_path = partition_key_path
+        self.partition_key = counter_id if partition_key is None else partition_key
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        """
+        Devuelve el siguiente ID disponible como cadena.
+
+        Returns:
+            str: ID único dentro del contenedor.
+        """
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._lease_block()
+            new_id = self._next
+            self._next += 1
+            return str(new_id)
+
+    def _counter_document(self, value):
+        return {"id": self.counter_id, self.partition_key_path: self.partition_key, "next": value}
+
+    def _create_counter(self):
+        start = int(self.seed()) if self.seed else 1
+        try:
+            self.container.create_item(self._counter_document(start + self.block_size))
+            return start
+        except exceptions.CosmosResourceExistsError:
+            # Otro proceso creó el contador primero; se reintenta con lectura normal
+            return None
+
+    def _lease_block(self):
+        for attempt in range(self.max_retries):
+            try:
+                counter = self.container.read_item(item=self.counter_id, partition_key=self.partition_key)
+            except exceptions.CosmosResourceNotFoundError:
+                start = self._create_counter()
+                if start is not None:
+                    return start, start + self.block_size
+                continue
+
+            start = int(counter["next"])
+            counter["next"] = start + self.block_size
+            try:
+                self.container.replace_item(
+                    item=self.counter_id,
+                    body=counter,
+                    etag=counter["_etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+                return start, start + self.block_size
+            except exceptions.CosmosAccessConditionFailedError:
+                # Otro proceso reservó un bloque entre la lectura y la escritura
+                time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+
+        raise RuntimeError("No se pudo reservar un bloque de IDs por exceso de contención.")
+
+
+class AsyncIdAllocator(IdAllocator):
+    """
+    Versión de IdAllocator para un contenedor asíncrono (azure.cosmos.aio).
+
+    Comparte el documento contador con IdAllocator, así que procesos síncronos y
+    asíncronos pueden asignar IDs del mismo contenedor sin repetirlos. `seed` puede
+    ser una función asíncrona.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = asyncio.Lock()
+
+    async def next_id(self):
+        """
+        Devuelve el siguiente ID disponible como cadena.
+
+        Returns:
+            str: ID único dentro del contenedor.
+        """
+        async with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = await self._lease_block()
+            new_id = self._next
+            self._next += 1
+            return str(new_id)
+
+    async def _create_counter(self):
+        start = 1
+        if self.seed:
+            start = self.seed()
+            start = int(await start if asyncio.iscoroutine(start) else start)
+        try:
+            await self.container.create_item(self._counter_document(start + self.block_size))
+            return start
+        except exceptions.CosmosResourceExistsError:
+            return None
+
+    async def _lease_block(self):
+        for attempt in range(self.max_retries):
+            try:
+                counter = await self.container.read_item(item=self.counter_id, partition_key=self.partition_key)
+            except exceptions.CosmosResourceNotFoundError:
+                start = await self._create_counter()
+                if start is not None:
+                    return start, start + self.block_size
+                continue
+
+            start = int(counter["next"])
+            counter["next"] = start + self.block_size
+            try:
+                await self.container.replace_item(
+                    item=self.counter_id,
+                    body=counter,
+                    etag=counter["_etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+                return start, start + self.block_size
+            except exceptions.CosmosAccessConditionFailedError:
+                await asyncio.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+
+        raise RuntimeError("No se pudo reservar un bloque de IDs por exceso de contención.")
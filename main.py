@@ -1,31 +1,147 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from azure.cosmos import CosmosClient, exceptions
+from admission import AdmissionControl, AdmissionMiddleware
+from azure.cosmos import exceptions
 from typing import Optional
 import uvicorn
-from functions import generate_prompt_without_retrieval_new
+import json
+from change_feed import AGGREGATES_DB_PATH, AggregateStore
+from functions import (TRIAGE_SYSTEM_PROMPT, TriageResult, agenerate_triage, astream_prompt_without_retrieval_new,
+                       build_triage_request, parse_triage, triage_fields, triage_system_prompt)
+from repository import VISIT_SUMMARY_FIELDS, async_repository
+from session_store import create_session_store
+from triage_jobs import (API_JOBS, DONE, QUEUED, RUNNING, TRIAGE_JOB_POLL_INTERVAL, TRIAGE_JOBS_DB_PATH,
+                         TRIAGE_WORKERS, JobQueue, TriageWorkerPool, job_result, run_triage_job, triage_payload)
+from visit_writes import acommit_visit, asave_fields, astart_visit
+from waiting_room import WaitingRoom
 import os
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Match
+import metrics
+import red_flags
+from resilience import DeadlineExceeded, LLMUnavailableError
+import asyncio
+import math
+import time
 
 from dotenv import load_dotenv
 
 load_dotenv()  
 
-app = FastAPI()
+# En modo borrador la visita se guarda con una sola escritura al completar el triage
+VISIT_DRAFT_MODE = os.getenv("VISIT_DRAFT_MODE", "false").lower() in ("1", "true", "yes")
 
-COSMOS_URI = os.getenv("COSMOS_URI")
-COSMOS_KEY = os.getenv("COSMOS_KEY")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+# Tamaño de página del historial de visitas y máximo que puede pedir un cliente
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "50"))
+# Modo clínico: el historial de cualquier paciente y la sala de espera. Sin él, cada sesión
+# solo ve el historial de su paciente y la sala de espera no está disponible
+CLINICIAN_MODE = os.getenv("CLINICIAN_MODE", "false").lower() in ("1", "true", "yes")
 
-client = CosmosClient(COSMOS_URI, COSMOS_KEY)
-database = client.get_database_client(DATABASE_NAME)
-container = database.get_container_client(CONTAINER_NAME)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único repositorio por proceso; con Cosmos DB usa el cliente asíncrono y su pool de conexiones
+    async with async_repository() as repository:
+        app.state.repository = repository
+        # Agregados que mantiene change_feed.py; aquí solo se leen
+        app.state.aggregates = AggregateStore(AGGREGATES_DB_PATH)
+        # Cola del modo trabajo; con TRIAGE_WORKERS=0 este proceso solo encola
+        app.state.jobs = JobQueue(TRIAGE_JOBS_DB_PATH, kind=API_JOBS)
+        app.state.job_pool = TriageWorkerPool(
+            app.state.jobs, lambda job: run_session_triage_job(repository, session_store, waiting_room, job),
+            workers=TRIAGE_WORKERS)
+        app.state.job_pool.start()
+        try:
+            yield
+        finally:
+            await app.state.job_pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Control de admisión: tasa por cliente y por sesión y triages con el LLM en curso.
+# Se agrega antes que record_metrics para que los rechazos también queden en sus métricas.
+admission = AdmissionControl.from_env()
+app.add_middleware(AdmissionMiddleware, control=admission)
+
+
+def route_template(request):
+    """Devuelve la ruta declarada (p. ej. /triage/) para no crear una serie por URL."""
+    for route in request.app.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            return route.path
+    return "desconocida"
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    # Todas las métricas de Cosmos DB y del LLM de esta petición quedan asociadas a su ruta
+    route = route_template(request)
+    start = time.perf_counter()
+    status = 500
+    with metrics.endpoint(route):
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route,
+                                         status=str(status))
+
+
+def get_repository(request: Request):
+    return request.app.state.repository
+
+
+def get_aggregate_store(request: Request):
+    return request.app.state.aggregates
+
+
+def get_job_queue(request: Request):
+    return request.app.state.jobs
+
+
+def get_job_pool(request: Request):
+    return request.app.state.job_pool
+
+
+# Estado de conversación de cada paciente, indexado por el token de sesión. Con SQLite sus
+# llamadas son bloqueantes: los endpoints las hacen en hilos con asyncio.to_thread, y
+# get_user_data es síncrona, así que FastAPI ya la ejecuta en un hilo
+session_store = create_session_store()
+
+
+def get_session_store():
+    return session_store
+
+
+# Sala de espera: pacientes con triage completado, ordenados por nivel de urgencia
+waiting_room = WaitingRoom()
+
+
+def get_waiting_room():
+    return waiting_room
+
+
+def require_clinician_mode():
+    """Rechaza con 403 las rutas del personal clínico si la API no está en modo clínico."""
+    if not CLINICIAN_MODE:
+        raise HTTPException(status_code=403, detail="Esta consulta solo está disponible para el personal clínico.")
+
+
+def get_session_id(x_session_id: Optional[str] = Header(None)):
+    return x_session_id
+
+
+def get_user_data(session_id=Depends(get_session_id), sessions=Depends(get_session_store)):
+    user_data = sessions.get(session_id) if session_id else None
+    if not user_data:
+        raise HTTPException(status_code=400, detail="Primero debes ingresar los datos básicos del usuario.")
+    return user_data
 
 
-print(client)
-print(database)
-print(container)
 # Modelo para los datos del usuario
 class UserData(BaseModel):
     name: str
@@ -44,11 +160,6 @@ class HealthForm(BaseModel):
 class SymptomsForm(BaseModel):
     symptoms: str
 
-app = FastAPI()
-
-
-# Variable global para guardar los datos del usuario y del formulario temporalmente
-user_data = {}
 
 @app.get("/")
 async def read_root():
@@ -61,17 +172,21 @@ async def start_chat():
 
 # Endpoint para capturar los datos básicos del usuario
 @app.post("/chatbot/")
-async def capture_data(user_data_request: UserData):
+async def capture_data(user_data_request: UserData, repository=Depends(get_repository),
+                       sessions=Depends(get_session_store)):
 
-    # Guardamos los datos básicos en la variable global
-    user_data['name'] = user_data_request.name
-    user_data['identification'] = user_data_request.identification
-    user_data['age'] = user_data_request.age
-    user_data['sex'] = user_data_request.sex
+    # Datos básicos de la sesión del paciente
+    user_data = {
+        "name": user_data_request.name,
+        "identification": user_data_request.identification,
+        "age": user_data_request.age,
+        "sex": user_data_request.sex,
+    }
     
-    # Guardamos en Cosmos DB
+    # Guardamos la visita en el repositorio; la identificación es la clave del paciente
+    # y cada visita recibe su propio ID, así que un paciente puede volver
     user = {
-        "id": user_data['identification'],
+        "id": await repository.next_visit_id(),
         "name": user_data['name'],
         "identification": user_data['identification'],
         "age": user_data['age'],
@@ -79,18 +194,21 @@ async def capture_data(user_data_request: UserData):
     }
 
     try:
-        container.create_item(user)
-        return {"message": f"Tus datos han sido guardados exitosamente, {user_data['name']}. Ahora, por favor, proporciona los datos clínicos."}
+        user_data['visit'] = await astart_visit(repository, user, draft=VISIT_DRAFT_MODE)
+        session_id = await asyncio.to_thread(sessions.create, user_data)
+        return {
+            "message": f"Tus datos han sido guardados exitosamente, {user_data['name']}. Ahora, por favor, proporciona los datos clínicos.",
+            "session_id": session_id
+        }
     except exceptions.CosmosResourceExistsError:
         raise HTTPException(status_code=400, detail="El usuario ya existe. Intenta con otra identificación.")
 
   
 # Endpoint para capturar los datos clínicos del usuario
 @app.post("/health_form/")
-async def capture_health_data(health_form: HealthForm):
-    if not user_data:
-        raise HTTPException(status_code=400, detail="Primero debes ingresar los datos básicos del usuario.")
-    
+async def capture_health_data(health_form: HealthForm, repository=Depends(get_repository),
+                              user_data=Depends(get_user_data), session_id=Depends(get_session_id),
+                              sessions=Depends(get_session_store)):
     health_data = {
         "injury": health_form.injury,
         "smoking": health_form.smoking,
@@ -99,77 +217,287 @@ async def capture_health_data(health_form: HealthForm):
         "hypertension": health_form.hypertension
     }
     try:
-        identification = user_data["identification"]
-        user_item = container.read_item(item=identification, partition_key=identification)
-        user_item.update(health_data)  # Actualizar con los nuevos datos de salud
-        container.upsert_item(user_item)  # Upsert actualiza el registro existente
+        # Enviar solo los datos de salud como actualización parcial del registro
+        user_data['visit'] = await asave_fields(repository, user_data['visit'], health_data, draft=VISIT_DRAFT_MODE)
+        await asyncio.to_thread(sessions.set, session_id, user_data)
         return {"message": f"Datos de salud guardados correctamente para {user_data['name']}. Ahora, proporciona tus síntomas."}
     except exceptions.CosmosResourceNotFoundError:
         return {"message": "No se encontró el registro para esta identificación."}
+    except exceptions.CosmosAccessConditionFailedError:
+        raise HTTPException(status_code=409, detail="El registro fue modificado desde otra sesión.")
 
 @app.post("/symptoms/")
-async def capture_symptoms(symptoms_form: SymptomsForm):
-    if not user_data:
-        raise HTTPException(status_code=400, detail="Primero debes ingresar los datos básicos del usuario.")
-    
+async def capture_symptoms(symptoms_form: SymptomsForm, repository=Depends(get_repository),
+                           user_data=Depends(get_user_data), session_id=Depends(get_session_id),
+                           sessions=Depends(get_session_store)):
     try:
-        identification = user_data['identification']
-        user_item = container.read_item(item=identification, partition_key=identification)
-        user_item['symptoms'] = symptoms_form.symptoms  # Actualizar con los síntomas
-        container.upsert_item(user_item)  # Upsert para guardar los cambios
+        # Actualizar solo el campo de síntomas
+        user_data['visit'] = await asave_fields(repository, user_data['visit'], {"symptoms": symptoms_form.symptoms},
+                                                draft=VISIT_DRAFT_MODE)
+        await asyncio.to_thread(sessions.set, session_id, user_data)
         return {"message": "Síntomas guardados correctamente."}
     except exceptions.CosmosResourceNotFoundError:
         return {"message": "No se encontró el registro para esta identificación."}
+    except exceptions.CosmosAccessConditionFailedError:
+        raise HTTPException(status_code=409, detail="El registro fue modificado desde otra sesión.")
+
+
+LLM_UNAVAILABLE_MESSAGE = "El servicio de triage no está disponible. Intenta de nuevo en unos segundos."
+LLM_DEADLINE_MESSAGE = "El servicio de triage tardó demasiado en responder. Intenta de nuevo."
+
+
+async def save_triage_result(repository, sessions, session_id, user_data, result, room):
+    """
+    Guarda el resultado del triage (texto y nivel de urgencia) en la visita, la escribe
+    completa en modo borrador y pone al paciente en la sala de espera.
+    """
+    visit = await asave_fields(repository, user_data['visit'], triage_fields(result), draft=VISIT_DRAFT_MODE)
+    user_data['visit'] = visit = await acommit_visit(repository, visit, draft=VISIT_DRAFT_MODE)
+    await asyncio.to_thread(sessions.set, session_id, user_data)
+    admit_patient(room, visit, result)
+
+
+def admit_patient(room, visit, result):
+    """Pone al paciente en la sala de espera (o actualiza su prioridad) con el resultado del triage."""
+    room.push(visit["id"], result.urgency_level, {
+        "identification": visit.get("identification"),
+        "name": visit.get("name"),
+        "age": visit.get("age"),
+        "symptoms": visit.get("symptoms"),
+        "urgency_rationale": result.urgency_rationale,
+    })
+
+
+async def complete_triage_narrative(repository, sessions, session_id, pregunta, flag, fresh, room):
+    """
+    Pide al LLM la explicación de un triage resuelto por una señal de alarma y la guarda
+    en la visita. El nivel de la regla solo cambia si el LLM lo considera más urgente.
+    """
+    result = red_flags.combine(await agenerate_triage(TRIAGE_SYSTEM_PROMPT, pregunta, use_cache=not fresh), flag)
+    user_data = await asyncio.to_thread(sessions.get, session_id)
+    if user_data is None:
+        return
+    try:
+        await save_triage_result(repository, sessions, session_id, user_data, result, room)
+    except exceptions.CosmosAccessConditionFailedError:
+        # La visita cambió mientras tanto (p. ej. se pidió otro triage); se conserva ese resultado
+        pass
+
 
+async def run_session_triage_job(repository, sessions, room, job):
+    """
+    Worker del modo trabajo: completa el triage, actualiza la visita en la sesión del
+    paciente (si sigue abierta) y lo pone en la sala de espera.
+    """
+    result, visit = await run_triage_job(repository, job.payload)
+    user_data = await asyncio.to_thread(sessions.get, job.session_id) if job.session_id else None
+    if user_data is not None and user_data['visit'].get('id') == visit['id']:
+        user_data['visit'] = visit
+        await asyncio.to_thread(sessions.set, job.session_id, user_data)
+    admit_patient(room, visit, result)
+    return job_result(result, visit, job.payload.get("red_flag"))
 
-# Endpoint para realizar el triage con todos los datos del usuario
+
+# Endpoint para realizar el triage con todos los datos del usuario.
+# Con ?fresh=true se ignora la caché de respuestas y se consulta de nuevo al modelo.
 @app.get("/triage/")
-async def get_triage():
+async def get_triage(background_tasks: BackgroundTasks, fresh: bool = False, repository=Depends(get_repository),
+                     user_data=Depends(get_user_data), session_id=Depends(get_session_id),
+                     sessions=Depends(get_session_store), room=Depends(get_waiting_room)):
     try:
-        # Buscar el registro del usuario basado en su identificación
-        identification = user_data['identification']
-        user_item = container.read_item(item=identification, partition_key=identification)
-        
-        # Extraer todos los datos necesarios
-        name = user_item.get("name", "Usuario")
-        age = user_item.get("age", "No disponible")
-        sex = user_item.get("sex", "No disponible")
-        injury = user_item.get("injury", "No disponible")
-        smoking = user_item.get("smoking", "No disponible")
-        allergies = user_item.get("allergies", "No disponible")
-        obesity = user_item.get("obesity", "No disponible")
-        hypertension = user_item.get("hypertension", "No disponible")
-        symptoms = user_item.get("symptoms", "No hay síntomas registrados")
-
-        # Crear el prompt para el modelo de IA basado en los datos del usuario
-        # Crear el prompt para el modelo de IA basado en los datos del usuario
-        system_prompt = "Eres un sistema experto en triage médico. Proporciona el nivel de urgencia basado en los siguientes datos del paciente."
-        pregunta = (f"Paciente {name}, edad {age}, sexo {sex}. "
-                    f"Síntomas: {symptoms}. Datos clínicos: Lesión: {injury}, "
-                    f"Fuma: {smoking}, Alergias: {allergies}, Obesidad: {obesity}, "
-                    f"Hipertensión: {hypertension}.")
-        
-        # Llamar a la función para generar el triage usando Langchain y OpenAI
-        response = generate_prompt_without_retrieval_new(system_prompt, pregunta)
+        # La sesión ya tiene la última versión del registro; no hace falta volver a leerlo
+        pregunta, user = build_triage_request(user_data['visit'])
+
+        # Señal de alarma: se responde de inmediato y el LLM redacta la explicación en segundo plano
+        flag = red_flags.check(user_data['visit'])
+        if flag is not None:
+            result = TriageResult(red_flags.alert_message(flag), flag.urgency_level, flag.urgency_rationale)
+            await save_triage_result(repository, sessions, session_id, user_data, result, room)
+            background_tasks.add_task(complete_triage_narrative, repository, sessions, session_id, pregunta, flag,
+                                      fresh, room)
+        else:
+            # Llamar a la función para generar el triage usando Langchain y OpenAI
+            result = await agenerate_triage(TRIAGE_SYSTEM_PROMPT, pregunta, use_cache=not fresh)
+            await save_triage_result(repository, sessions, session_id, user_data, result, room)
         
         return {
             "message": "Triage completado.",
-            "user": {
-                "name": name,
-                "age": age,
-                "sex": sex,
-                "injury": injury,
-                "smoking": smoking,
-                "allergies": allergies,
-                "obesity": obesity,
-                "hypertension": hypertension,
-                "symptoms": symptoms
-            },
-            "triage_result": response
+            "user": user,
+            "triage_result": result.text,
+            "urgency_level": result.urgency_level,
+            "urgency_rationale": result.urgency_rationale,
+            "red_flag": flag.rule if flag else None
         }
 
     except exceptions.CosmosResourceNotFoundError:
         raise HTTPException(status_code=404, detail="No se encontraron los datos del usuario con esta identificación.")
+    except exceptions.CosmosResourceExistsError:
+        raise HTTPException(status_code=400, detail="El usuario ya existe. Intenta con otra identificación.")
+    except exceptions.CosmosAccessConditionFailedError:
+        raise HTTPException(status_code=409, detail="El registro fue modificado desde otra sesión.")
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=LLM_UNAVAILABLE_MESSAGE,
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail=LLM_DEADLINE_MESSAGE)
+
+
+# Endpoint de triage en streaming (server-sent events): envía cada token en cuanto llega
+@app.get("/triage/stream")
+async def stream_triage(fresh: bool = False, repository=Depends(get_repository), user_data=Depends(get_user_data),
+                        session_id=Depends(get_session_id), sessions=Depends(get_session_store),
+                        room=Depends(get_waiting_room)):
+    pregunta, user = build_triage_request(user_data['visit'])
+    flag = red_flags.check(user_data['visit'])
+
+    async def events():
+        if flag is not None:
+            # El nivel de la señal de alarma se envía y se guarda antes del primer token
+            alert = TriageResult(red_flags.alert_message(flag), flag.urgency_level, flag.urgency_rationale)
+            try:
+                await save_triage_result(repository, sessions, session_id, user_data, alert, room)
+            except exceptions.CosmosHttpResponseError as e:
+                yield f"event: error\ndata: {json.dumps({'detail': e.message}, ensure_ascii=False)}\n\n"
+                return
+            red_flag = {"rule": flag.rule, "urgency_level": flag.urgency_level,
+                        "urgency_rationale": flag.urgency_rationale, "message": alert.text}
+            yield f"event: red_flag\ndata: {json.dumps(red_flag, ensure_ascii=False)}\n\n"
+
+        tokens = []
+        try:
+            async for token in astream_prompt_without_retrieval_new(triage_system_prompt(TRIAGE_SYSTEM_PROMPT),
+                                                                    pregunta, use_cache=not fresh):
+                tokens.append(token)
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+        except (LLMUnavailableError, DeadlineExceeded) as e:
+            detail = LLM_UNAVAILABLE_MESSAGE if isinstance(e, LLMUnavailableError) else LLM_DEADLINE_MESSAGE
+            yield f"event: error\ndata: {json.dumps({'detail': detail}, ensure_ascii=False)}\n\n"
+            return
+
+        # Guardar el texto completo y el nivel de urgencia una vez terminado el stream
+        result = red_flags.combine(parse_triage("".join(tokens)), flag)
+        try:
+            await save_triage_result(repository, sessions, session_id, user_data, result, room)
+        except exceptions.CosmosHttpResponseError as e:
+            yield f"event: error\ndata: {json.dumps({'detail': e.message}, ensure_ascii=False)}\n\n"
+            return
+        end = {"user": user, "triage_result": result.text, "urgency_level": result.urgency_level,
+               "urgency_rationale": result.urgency_rationale, "red_flag": flag.rule if flag else None}
+        yield f"event: end\ndata: {json.dumps(end, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Modo trabajo: encola el triage y responde de inmediato con el ID del trabajo; el
+# resultado se consulta en GET /triage/jobs/{job_id}. Si hay una señal de alarma, su
+# nivel se guarda y se devuelve antes de encolar, igual que en /triage/.
+@app.post("/triage/jobs", status_code=202)
+async def create_triage_job(fresh: bool = False, repository=Depends(get_repository), user_data=Depends(get_user_data),
+                            session_id=Depends(get_session_id), sessions=Depends(get_session_store),
+                            room=Depends(get_waiting_room), queue=Depends(get_job_queue), pool=Depends(get_job_pool)):
+    pregunta, user = build_triage_request(user_data['visit'])
+    flag = red_flags.check(user_data['visit'])
+    if flag is not None:
+        alert = TriageResult(red_flags.alert_message(flag), flag.urgency_level, flag.urgency_rationale)
+        try:
+            await save_triage_result(repository, sessions, session_id, user_data, alert, room)
+        except exceptions.CosmosAccessConditionFailedError:
+            raise HTTPException(status_code=409, detail="El registro fue modificado desde otra sesión.")
+
+    payload = triage_payload(TRIAGE_SYSTEM_PROMPT, pregunta, user_data['visit'], use_cache=not fresh, flag=flag,
+                             draft=VISIT_DRAFT_MODE)
+    job_id = await asyncio.to_thread(queue.enqueue, payload, session_id=session_id)
+    pool.notify()
+    return {
+        "message": "Triage en proceso.",
+        "job_id": job_id,
+        "status": QUEUED,
+        "user": user,
+        "urgency_level": flag.urgency_level if flag else None,
+        "urgency_rationale": flag.urgency_rationale if flag else None,
+        "red_flag": flag.rule if flag else None
+    }
+
+
+# Estado de un trabajo de triage; mientras no termina, Retry-After indica cuándo volver a consultar
+@app.get("/triage/jobs/{job_id}")
+async def get_triage_job(job_id: str, response: Response, session_id=Depends(get_session_id),
+                         queue=Depends(get_job_queue)):
+    job = await asyncio.to_thread(queue.get, job_id)
+    # Solo la sesión que creó el trabajo puede consultarlo
+    if job is None or (job["session_id"] and job["session_id"] != session_id):
+        raise HTTPException(status_code=404, detail="No se encontró el trabajo de triage.")
+    status = {"job_id": job["id"], "status": job["status"], "attempts": job["attempts"], "error": job["error"]}
+    if job["status"] == DONE:
+        result = job["result"]
+        return {**status, "triage_result": result["triage_result"], "urgency_level": result["urgency_level"],
+                "urgency_rationale": result["urgency_rationale"], "red_flag": result["red_flag"]}
+    if job["status"] in (QUEUED, RUNNING):
+        response.headers["Retry-After"] = str(math.ceil(TRIAGE_JOB_POLL_INTERVAL))
+    return status
+
+
+# Historial de visitas de un paciente, de la más reciente a la más antigua.
+# Cada página trae solo los campos de resumen y un token opaco para pedir la siguiente.
+# Sin CLINICIAN_MODE solo lo consulta la sesión (X-Session-Id) de ese paciente.
+# No es control de acceso: la identificación de la sesión es la que declaró el propio
+# cliente en POST /chatbot/, así que solo evita recorrer el historial de otros pacientes
+# desde un kiosco. Expuesta fuera de la clínica, la API necesita autenticación delante.
+@app.get("/patients/{identification}/visits")
+async def list_patient_visits(identification: str,
+                              page_size: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+                              continuation_token: Optional[str] = None, repository=Depends(get_repository),
+                              session_id=Depends(get_session_id), sessions=Depends(get_session_store)):
+    if not CLINICIAN_MODE:
+        user_data = await asyncio.to_thread(sessions.get, session_id) if session_id else None
+        if not user_data or user_data['identification'] != identification:
+            raise HTTPException(status_code=403,
+                                detail="Solo puedes consultar el historial del paciente de tu sesión.")
+    try:
+        page = await repository.list_visits(identification, page_size=page_size,
+                                            continuation_token=continuation_token, fields=VISIT_SUMMARY_FIELDS)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="El token de continuación no es válido.")
+    except exceptions.CosmosHttpResponseError as e:
+        if e.status_code == 400:
+            raise HTTPException(status_code=400, detail="El token de continuación no es válido.")
+        raise
+    return {"visits": page.items, "continuation_token": page.continuation_token}
+
+
+# Sala de espera: lista en orden de atención, siguiente paciente y retiro de un paciente.
+# Muestra los datos de todos los pacientes en espera, así que solo responde en modo clínico.
+@app.get("/waiting-room/", dependencies=[Depends(require_clinician_mode)])
+async def list_waiting_room(room=Depends(get_waiting_room)):
+    return {"waiting": len(room), "patients": room.snapshot()}
+
+
+@app.post("/waiting-room/next", dependencies=[Depends(require_clinician_mode)])
+async def call_next_patient(room=Depends(get_waiting_room)):
+    patient = room.pop()
+    if patient is None:
+        raise HTTPException(status_code=404, detail="No hay pacientes en la sala de espera.")
+    return patient
+
+
+@app.delete("/waiting-room/{visit_id}", dependencies=[Depends(require_clinician_mode)])
+async def remove_waiting_patient(visit_id: str, room=Depends(get_waiting_room)):
+    if not room.remove(visit_id):
+        raise HTTPException(status_code=404, detail="La visita no está en la sala de espera.")
+    return {"message": "Paciente retirado de la sala de espera."}
+
+
+# Tablero: agregados precalculados por el procesador del change feed
+@app.get("/dashboard/")
+async def get_dashboard(hours: int = Query(24, ge=1, le=24 * 31), store=Depends(get_aggregate_store)):
+    return await asyncio.to_thread(store.dashboard, hours)
+
+
+# Métricas en formato Prometheus: duración por endpoint, RU de Cosmos DB y tokens del LLM
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
 
 
 @app.get("/schedule-appointment/")
@@ -0,0 +1,397 @@
+"""
+Instrumentación ligera de SaraCare: duración, cargos en RU y tokens por operación.
+
+Las métricas se guardan en memoria en un registro por proceso y se exponen en el
+formato de texto de Prometheus (ruta /metrics de main.py) o como tabla (panel de
+depuración de app.py). Cada observación lleva la etiqueta `endpoint` del contexto
+actual, que fijan el middleware HTTP de main.py y cada rerun de app.py.
+
+Los contenedores de Cosmos DB se instrumentan envolviéndolos con
+InstrumentedContainer / AsyncInstrumentedContainer, que leen la cabecera
+`x-ms-request-charge` con un response_hook; los repositorios, con
+InstrumentedRepository; y las llamadas al LLM registran los tokens con el callback
+de llm_usage_callback(). Con METRICS_ENABLED=false no se registra nada.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Límites de los buckets en segundos; los últimos cubren respuestas lentas del LLM
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Aproximación de tokens cuando el proveedor no informa el uso
+CHARS_PER_TOKEN = 4
+
+_endpoint = contextvars.ContextVar("saracare_endpoint", default="-")
+
+
+def current_endpoint():
+    return _endpoint.get()
+
+
+def set_endpoint(name):
+    """Fija el endpoint del contexto actual (p. ej. al inicio de un rerun de Streamlit)."""
+    _endpoint.set(name)
+
+
+@contextmanager
+def endpoint(name):
+    """Atribuye al endpoint `name` todas las métricas registradas dentro del bloque."""
+    token = _endpoint.set(name)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, labels):
+        if "endpoint" in self.labelnames and "endpoint" not in labels:
+            labels["endpoint"] = current_endpoint()
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Contador que solo aumenta."""
+
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, labels, value
+
+    def rows(self):
+        for _, labels, value in self.samples():
+            yield {"metric": self.name, **dict(labels), "count": None, "value": value}
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos, como los de Prometheus."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._labels(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observa la duración del bloque en segundos."""
+        labels = dict(self._labels(labels))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(state[0]), state[1], state[2]) for labels, state in self._values.items()}
+        for labels, (counts, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + (("le", repr(bound)),), cumulative
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), count
+            yield f"{self.name}_count", labels, count
+            yield f"{self.name}_sum", labels, total
+
+    def rows(self):
+        with self._lock:
+            values = {labels: (state[1], state[2]) for labels, state in self._values.items()}
+        for labels, (count, total) in sorted(values.items()):
+            yield {"metric": self.name, **dict(labels), "count": count, "value": total}
+
+
+class Registry:
+    """Conjunto de métricas de un proceso."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Devuelve todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Devuelve una fila por métrica y combinación de etiquetas (count es None en contadores)."""
+        return [row for metric in list(self._metrics.values()) for row in metric.rows()]
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_SECONDS = REGISTRY.histogram(
+    "saracare_http_request_seconds", "Duración de las peticiones HTTP de la API.", ("method", "route", "status"))
+STORAGE_SECONDS = REGISTRY.histogram(
+    "saracare_storage_operation_seconds", "Duración de cada llamada a Cosmos DB.", ("operation", "endpoint"))
+STORAGE_REQUEST_CHARGE = REGISTRY.counter(
+    "saracare_storage_request_charge_total", "Request units consumidas en Cosmos DB.", ("operation", "endpoint"))
+REPOSITORY_SECONDS = REGISTRY.histogram(
+    "saracare_repository_operation_seconds", "Duración de cada operación del repositorio de pacientes.",
+    ("operation", "endpoint"))
+LLM_SECONDS = REGISTRY.histogram(
+    "saracare_llm_request_seconds", "Duración de las llamadas al LLM.", ("operation", "endpoint"))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "saracare_llm_first_token_seconds", "Tiempo hasta el primer token en las llamadas en streaming.",
+    ("operation", "endpoint"))
+LLM_TOKENS = REGISTRY.counter(
+    "saracare_llm_tokens_total", "Tokens del LLM; source=estimated si el proveedor no informó el uso.",
+    ("kind", "source", "endpoint"))
+LLM_CACHE_REQUESTS = REGISTRY.counter(
+    "saracare_llm_cache_requests_total", "Consultas a la caché de respuestas del triage.", ("result", "endpoint"))
+LLM_RESILIENCE_EVENTS = REGISTRY.counter(
+    "saracare_llm_resilience_events_total",
+    "Reintentos, peticiones de respaldo (hedge), aperturas del circuit breaker y plazos vencidos del LLM.",
+    ("event", "deployment", "endpoint"))
+RED_FLAG_CHECKS = REGISTRY.counter(
+    "saracare_red_flag_checks_total", "Evaluaciones de las reglas de señales de alarma; result=hit si alguna coincidió.",
+    ("result", "endpoint"))
+RED_FLAG_RULE_HITS = REGISTRY.counter(
+    "saracare_red_flag_rule_hits_total", "Coincidencias de cada regla de señales de alarma.", ("rule", "endpoint"))
+RED_FLAG_LLM_LEVELS = REGISTRY.counter(
+    "saracare_red_flag_llm_levels_total", "Nivel de urgencia que dio el LLM en las visitas marcadas por cada regla.",
+    ("rule", "llm_level", "endpoint"))
+TRIAGE_JOBS = REGISTRY.counter(
+    "saracare_triage_jobs_total",
+    "Trabajos de triage procesados por los workers, por estado (done, failed, retry, lease_lost).",
+    ("status", "endpoint"))
+TRIAGE_JOB_WAIT_SECONDS = REGISTRY.histogram(
+    "saracare_triage_job_wait_seconds", "Tiempo en cola de los trabajos de triage hasta que un worker los toma.",
+    ("endpoint",))
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "saracare_admission_rejections_total",
+    "Peticiones rechazadas por el control de admisión (tasa por cliente o sesión, cola del LLM).",
+    ("reason", "endpoint"))
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "saracare_admission_wait_seconds", "Espera de las peticiones admitidas en las cubetas de tasa y en la cola del LLM.",
+    ("limiter", "endpoint"))
+
+
+def estimate_tokens(text_length):
+    return max(1, round(text_length / CHARS_PER_TOKEN)) if text_length else 0
+
+
+def record_llm_usage(prompt_tokens, completion_tokens, source="reported"):
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt", source=source)
+    LLM_TOKENS.inc(completion_tokens, kind="completion", source=source)
+
+
+class _ChargeHook:
+    """response_hook que suma la cabecera x-ms-request-charge y llama al hook original."""
+
+    def __init__(self, operation, chained=None):
+        self.operation = operation
+        self.chained = chained
+        self.endpoint = current_endpoint()
+
+    def __call__(self, headers, result):
+        charge = headers.get("x-ms-request-charge") if headers else None
+        if charge is not None:
+            STORAGE_REQUEST_CHARGE.inc(float(charge), operation=self.operation, endpoint=self.endpoint)
+        if self.chained is not None:
+            self.chained(headers, result)
+
+
+# Operaciones de ContainerProxy que se miden; el resto se delega sin cambios
+POINT_OPERATIONS = ("read_item", "create_item", "upsert_item", "replace_item", "patch_item", "delete_item")
+QUERY_OPERATIONS = ("query_items", "read_all_items", "query_items_change_feed")
+
+
+class InstrumentedContainer:
+    """
+    Envuelve un ContainerProxy síncrono y registra la duración y las RU de cada llamada.
+
+    En las consultas la duración se mide en el repositorio, porque las páginas se piden
+    de forma diferida; las RU de cada página llegan igualmente por el response_hook.
+    """
+
+    def __init__(self, container):
+        self.container = container
+
+    def __getattr__(self, name):
+        attribute = getattr(self.container, name)
+        if name not in POINT_OPERATIONS + QUERY_OPERATIONS:
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, response_hook=None, **kwargs):
+            hook = _ChargeHook(name, response_hook)
+            if name in QUERY_OPERATIONS:
+                return attribute(*args, response_hook=hook, **kwargs)
+            with STORAGE_SECONDS.time(operation=name):
+                return attribute(*args, response_hook=hook, **kwargs)
+        return call
+
+
+class AsyncInstrumentedContainer:
+    """Versión de InstrumentedContainer para el ContainerProxy de azure.cosmos.aio."""
+
+    def __init__(self, container):
+        self.container = container
+
+    def __getattr__(self, name):
+        attribute = getattr(self.container, name)
+        if name in QUERY_OPERATIONS:
+            @functools.wraps(attribute)
+            def query(*args, response_hook=None, **kwargs):
+                return attribute(*args, response_hook=_ChargeHook(name, response_hook), **kwargs)
+            return query
+        if name not in POINT_OPERATIONS:
+            return attribute
+
+        @functools.wraps(attribute)
+        async def call(*args, response_hook=None, **kwargs):
+            hook = _ChargeHook(name, response_hook)
+            with STORAGE_SECONDS.time(operation=name):
+                return await attribute(*args, response_hook=hook, **kwargs)
+        return call
+
+
+class InstrumentedRepository:
+    """Envuelve un PatientRepository (síncrono o asíncrono) y mide cada operación pública."""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __getattr__(self, name):
+        attribute = getattr(self.repository, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        if inspect.iscoroutinefunction(attribute):
+            @functools.wraps(attribute)
+            async def acall(*args, **kwargs):
+                with REPOSITORY_SECONDS.time(operation=name):
+                    return await attribute(*args, **kwargs)
+            return acall
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            with REPOSITORY_SECONDS.time(operation=name):
+                return attribute(*args, **kwargs)
+        return call
+
+
+_usage_callback = None
+_usage_callback_lock = threading.Lock()
+
+
+def llm_usage_callback():
+    """
+    Devuelve el callback de langchain que registra los tokens de cada llamada al modelo.
+
+    Usa el uso informado por el proveedor (usage_metadata) y, si no viene, lo estima a
+    partir de la longitud del prompt y de la respuesta. langchain se importa aquí para
+    que importar este módulo siga siendo barato.
+    """
+    global _usage_callback
+    if _usage_callback is None:
+        with _usage_callback_lock:
+            if _usage_callback is None:
+                _usage_callback = _create_usage_callback()
+    return _usage_callback
+
+
+def _create_usage_callback():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallback(BaseCallbackHandler):
+        def __init__(self):
+            self._prompt_chars = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._prompt_chars[run_id] = sum(len(str(message.content)) for batch in messages for message in batch)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._prompt_chars.pop(run_id, None)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            prompt_chars = self._prompt_chars.pop(run_id, 0)
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        record_llm_usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+                    else:
+                        record_llm_usage(estimate_tokens(prompt_chars), estimate_tokens(len(generation.text)),
+                                         source="estimated")
+
+    return UsageCallback()
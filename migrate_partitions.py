@@ -0,0 +1,233 @@
+"""
+Migración única al modelo particionado por paciente.
+
+Copia los documentos del contenedor original (clave de partición /id, un documento
+por visita con nombre, edad y sexo copiados) a un contenedor nuevo con clave de
+partición /identification, donde cada paciente tiene un perfil (`type:
+"patient_profile"`) y sus visitas (`type: "visit"`) en la misma partición.
+
+Los documentos se leen en páginas ordenadas por identificación, así que en memoria
+solo hay una página de origen y un lote por escribir. Las visitas de cada paciente se
+escriben con lotes transaccionales (execute_item_batch) junto con su perfil, que se
+toma del documento más reciente del paciente. Todas las escrituras son upserts: la
+migración se puede repetir, y con --checkpoint se retoma desde la última página
+completada.
+
+Detén las escrituras en el contenedor original mientras dura la migración (o vuelve a
+ejecutarla al final) y después configura COSMOS_PARTITION_KEY=identification y
+CONTAINER_NAME con el contenedor nuevo.
+
+Uso:
+    python migrate_partitions.py --target-container pacientes --create-target
+    python migrate_partitions.py --target-container pacientes --checkpoint migracion.json
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+from azure.cosmos import exceptions
+from dotenv import load_dotenv
+
+from patient_lookup import PROFILE_FIELDS, PatientDirectory
+from repository import SYSTEM_PARTITION
+
+SOURCE_QUERY = "SELECT * FROM c ORDER BY c.identification"
+COUNTER_ID = "visit-id-counter"
+# Límite de operaciones de Cosmos DB por lote transaccional
+MAX_BATCH_SIZE = 100
+SYSTEM_FIELDS = ("_rid", "_self", "_etag", "_attachments", "_ts", "_lsn")
+
+
+def _clean(document):
+    return {key: value for key, value in document.items() if key not in SYSTEM_FIELDS}
+
+
+def to_visit(document):
+    """Convierte un documento del modelo original en una visita del modelo nuevo."""
+    visit = _clean(document)
+    visit["type"] = "visit"
+    if "created_at" not in visit and "_ts" in document:
+        visit["created_at"] = datetime.fromtimestamp(document["_ts"], timezone.utc).isoformat()
+    return visit
+
+
+class PartitionMigrator:
+    """
+    Agrupa los documentos de cada paciente y los escribe en lotes transaccionales.
+
+    Args:
+        target: Contenedor de destino, particionado por /identification.
+        batch_size (int): Operaciones por lote (incluido el perfil), como máximo 100.
+    """
+
+    def __init__(self, target, batch_size=MAX_BATCH_SIZE):
+        if not 2 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size debe estar entre 2 y {MAX_BATCH_SIZE}.")
+        self.target = target
+        self.batch_size = batch_size
+        self.identification = None
+        self.pending = []
+        self.profile = None
+        self.profile_ts = -1
+        self.stats = {"visits": 0, "patients": 0, "skipped": 0, "batches": 0}
+
+    def add(self, document):
+        identification = document.get("identification")
+        if identification is None:
+            # Documentos sin paciente, como el contador de IDs (se migra aparte)
+            self.stats["skipped"] += 1
+            return
+        identification = str(identification)
+        if identification != self.identification:
+            self.finish_patient()
+            self._start_patient(identification)
+
+        ts = document.get("_ts", 0)
+        if ts >= self.profile_ts:
+            self.profile = {field: document.get(field) for field in PROFILE_FIELDS}
+            self.profile["identification"] = identification
+            self.profile_ts = ts
+
+        if document.get("type") != "patient_profile":
+            self.pending.append(("upsert", (to_visit(document),)))
+            self.stats["visits"] += 1
+            if len(self.pending) >= self.batch_size - 1:
+                self.flush()
+
+    def _start_patient(self, identification):
+        self.identification = identification
+        self.pending = []
+        self.profile, self.profile_ts = None, -1
+        # Si una ejecución anterior ya escribió el perfil, solo se reemplaza por uno más reciente
+        profile_id = PatientDirectory.profile_id(identification)
+        try:
+            existing = self.target.read_item(item=profile_id, partition_key=identification)
+            self.profile = {field: existing.get(field) for field in PROFILE_FIELDS}
+            self.profile_ts = existing.get("source_ts", -1)
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+
+    def flush(self):
+        """Escribe las visitas pendientes y el perfil actual del paciente en un único lote."""
+        if self.identification is None or self.profile is None:
+            return
+        profile = {"id": PatientDirectory.profile_id(self.identification), "type": "patient_profile",
+                   **self.profile, "source_ts": self.profile_ts}
+        self.target.execute_item_batch(self.pending + [("upsert", (profile,))], partition_key=self.identification)
+        self.stats["batches"] += 1
+        self.pending = []
+
+    def finish_patient(self):
+        if self.identification is not None:
+            self.flush()
+            self.stats["patients"] += 1
+
+
+def _load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None, None
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    return checkpoint["continuation_token"], checkpoint["stats"]
+
+
+def _save_checkpoint(path, continuation_token, stats):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"continuation_token": continuation_token, "stats": stats}, f)
+    os.replace(temporary, path)
+
+
+def migrate_counter(source, target):
+    """Lleva el contador de IDs de visita al modelo nuevo sin retroceder nunca."""
+    try:
+        counter = source.read_item(item=COUNTER_ID, partition_key=COUNTER_ID)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+    next_id = int(counter["next"])
+    try:
+        current = target.read_item(item=COUNTER_ID, partition_key=SYSTEM_PARTITION)
+        next_id = max(next_id, int(current["next"]))
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+    target.upsert_item({"id": COUNTER_ID, "identification": SYSTEM_PARTITION, "next": next_id})
+    return next_id
+
+
+def migrate(source, target, page_size=200, batch_size=MAX_BATCH_SIZE, checkpoint_path=None, max_pages=None):
+    """
+    Copia todos los pacientes y visitas de `source` a `target`.
+
+    Args:
+        source: Contenedor original, particionado por /id.
+        target: Contenedor nuevo, particionado por /identification.
+        page_size (int): Documentos leídos por página.
+        batch_size (int): Operaciones por lote transaccional.
+        checkpoint_path (str): Archivo donde se guarda el avance tras cada página.
+        max_pages (int): Detenerse tras esta cantidad de páginas (para migrar por tramos).
+
+    Returns:
+        dict: Cantidad de visitas, pacientes, lotes y páginas procesados, y si terminó.
+    """
+    continuation_token, stats = _load_checkpoint(checkpoint_path)
+    migrator = PartitionMigrator(target, batch_size=batch_size)
+    if stats:
+        migrator.stats.update(stats)
+    migrator.stats.setdefault("pages", 0)
+
+    pages = source.query_items(query=SOURCE_QUERY, enable_cross_partition_query=True,
+                               max_item_count=page_size).by_page(continuation_token)
+    processed = 0
+    for page in pages:
+        for document in page:
+            migrator.add(document)
+        # Al cerrar cada página todo lo leído queda escrito, así el checkpoint es consistente
+        migrator.flush()
+        migrator.stats["pages"] += 1
+        processed += 1
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, pages.continuation_token, migrator.stats)
+        if pages.continuation_token is None or (max_pages is not None and processed >= max_pages):
+            break
+
+    finished = pages.continuation_token is None
+    if finished:
+        if migrator.identification is not None:
+            migrator.stats["patients"] += 1
+        migrator.stats["counter"] = migrate_counter(source, target)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    return {**migrator.stats, "finished": finished}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source-container", default=None, help="Por defecto, CONTAINER_NAME del .env")
+    parser.add_argument("--target-container", required=True)
+    parser.add_argument("--create-target", action="store_true",
+                        help="Crear el contenedor de destino con clave de partición /identification")
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=None, help="Archivo JSON para retomar la migración")
+    args = parser.parse_args()
+
+    from azure.cosmos import CosmosClient, PartitionKey
+
+    load_dotenv()
+    client = CosmosClient(os.getenv("COSMOS_URI"), os.getenv("COSMOS_KEY"))
+    database = client.get_database_client(os.getenv("DATABASE_NAME"))
+    source = database.get_container_client(args.source_container or os.getenv("CONTAINER_NAME"))
+    if args.create_target:
+        target = database.create_container_if_not_exists(id=args.target_container,
+                                                          partition_key=PartitionKey(path="/identification"))
+    else:
+        target = database.get_container_client(args.target_container)
+
+    stats = migrate(source, target, page_size=args.page_size, batch_size=args.batch_size,
+                    checkpoint_path=args.checkpoint)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from azure.cosmos import exceptions
+
+from ttl_cache import TTLCache
+
+PROFILE_FIELDS = ("identification", "name", "age", "sex")
+
+
+class PatientDirectory:
+    """
+    Búsqueda de pacientes por número de identificación.
+
+    Cada paciente tiene un documento de perfil cuyo ID se deriva de la identificación,
+    así que la búsqueda es una lectura puntual en lugar de una consulta entre particiones.
+    Los registros anteriores a los perfiles se encuentran con una consulta parametrizada
+    que solo proyecta los campos necesarios, y el perfil se crea en ese momento.
+    Delante de todo hay una caché LRU con TTL.
+
+    En un contenedor particionado por `identification` el perfil y las visitas del
+    paciente comparten partición, así que la consulta de respaldo tampoco sale de ella.
+
+    Args:
+        container: Contenedor de Cosmos DB.
+        cache_size (int): Máximo de pacientes en caché.
+        cache_ttl (float): Segundos que un paciente permanece en caché.
+        partition_key_path (str): Clave de partición del contenedor: "id" o "identification".
+    """
+
+    # Datos del paciente en su visita más reciente, para los registros anteriores a los perfiles
+    LEGACY_QUERY = ("SELECT TOP 1 c.identification, c.name, c.age, c.sex FROM c "
+                    "WHERE c.identification = @identification ORDER BY c._ts DESC")
+
+    def __init__(self, container, cache_size=1024, cache_ttl=300.0, partition_key_path="id"):
+        self.container = container
+        self.partition_key_path = partition_key_path
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    @staticmethod
+    def profile_id(identification):
+        return f"patient-{identification}"
+
+    def _partition_key(self, identification):
+        if self.partition_key_path == "identification":
+            return identification
+        return self.profile_id(identification)
+
+    def find(self, identification):
+        """
+        Busca un paciente por su identificación.
+
+        Args:
+            identification (str): Número de identificación del paciente.
+
+        Returns:
+            dict: Campos identification, name, age y sex, o None si no existe.
+        """
+        patient = self.cache.get(identification)
+        if patient is not None:
+            return patient
+
+        profile_id = self.profile_id(identification)
+        try:
+            profile = self.container.read_item(item=profile_id, partition_key=self._partition_key(identification))
+            patient = {field: profile[field] for field in PROFILE_FIELDS}
+        except exceptions.CosmosResourceNotFoundError:
+            patient = self._find_legacy(identification)
+            if patient is None:
+                return None
+            self._write_profile(patient)
+
+        self.cache.set(identification, patient)
+        return patient
+
+    def register(self, identification, name, age, sex):
+        """Crea o actualiza el perfil del paciente e invalida su entrada en caché."""
+        self._write_profile({"identification": identification, "name": name, "age": age, "sex": sex})
+        self.cache.invalidate(identification)
+
+    def invalidate(self, identification):
+        self.cache.invalidate(identification)
+
+    def _write_profile(self, patient):
+        profile_id = self.profile_id(patient["identification"])
+        self.container.upsert_item({"id": profile_id, "type": "patient_profile", **patient})
+
+    def _find_legacy(self, identification):
+        if self.partition_key_path == "identification":
+            scope = {"partition_key": identification}
+        else:
+            scope = {"enable_cross_partition_query": True}
+        items = list(self.container.query_items(
+            query=self.LEGACY_QUERY,
+            parameters=[{"name": "@identification", "value": identification}],
+            **scope,
+        ))
+        return items[0] if items else None
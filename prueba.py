@@ -1,6 +1,7 @@
 import streamlit as st
 import functions as fu
-from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import exceptions
+import clients
 from dotenv import load_dotenv
 import os
 
@@ -15,9 +16,9 @@ CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 #print(CONTAINER_NAME)
 
 
-client = CosmosClient(url=os.environ["COSMOS_URI"], credential= os.environ["COSMOS_KEY"]) 
+client = clients.get_cosmos_client()
 database = client.get_database_client(DATABASE_NAME)
-container = database.get_container_client(CONTAINER_NAME)
+container = clients.get_container()
 
 
 #databases = client.list_databases()
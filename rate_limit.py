@@ -0,0 +1,96 @@
+"""
+Limitador de tasa por cubeta de tokens (token bucket).
+
+La cubeta se llena a `rate` tokens por segundo hasta `capacity` y cada operación
+consume los tokens que cuesta: una petición, o los tokens estimados de una llamada
+al LLM para respetar la cuota de tokens por minuto de Azure OpenAI.
+
+`reserve` descuenta los tokens aunque aún no estén disponibles (el saldo queda
+negativo) y devuelve cuánto hay que esperar, así que quienes esperan se atienden en
+orden de llegada sin sondear la cubeta.
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Cubeta de tokens segura entre hilos.
+
+    Args:
+        rate (float): Tokens que se reponen por segundo.
+        capacity (float): Máximo de tokens acumulados (la ráfaga permitida); por
+            defecto, un segundo de reposición.
+        clock: Reloj monotónico en segundos (reemplazable en pruebas).
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate debe ser mayor que cero.")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount, burst_seconds=60.0, clock=time.monotonic):
+        """Cubeta para una cuota por minuto (p. ej. tokens por minuto) con ráfagas de `burst_seconds`."""
+        return cls(amount / 60.0, capacity=amount * burst_seconds / 60.0, clock=clock)
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        """Tokens disponibles ahora (negativo si hay reservas pendientes)."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self, amount=1.0):
+        """Consume `amount` tokens si están disponibles ahora; devuelve si se consumieron."""
+        return self.reserve(amount, max_wait=0.0) == 0.0
+
+    def reserve(self, amount=1.0, max_wait=None):
+        """
+        Reserva `amount` tokens.
+
+        Args:
+            amount (float): Tokens que cuesta la operación.
+            max_wait (float): Espera máxima aceptable en segundos; None para esperar lo
+                que haga falta.
+
+        Returns:
+            float: Segundos que hay que esperar antes de hacer la operación, o None si
+            la espera superaría `max_wait` (en ese caso no se reserva nada).
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def refund(self, amount=1.0):
+        """Devuelve `amount` tokens reservados para una operación que no se hizo."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def retry_after(self, amount=1.0):
+        """Segundos hasta que haya `amount` tokens disponibles, sin reservarlos."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (amount - self._tokens) / self.rate)
+
+    async def acquire(self, amount=1.0):
+        """Espera, sin bloquear el bucle de eventos, hasta poder consumir `amount` tokens."""
+        wait = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
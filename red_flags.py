@@ -0,0 +1,166 @@
+"""
+Reglas locales de señales de alarma que se evalúan antes de llamar al LLM.
+
+Los síntomas se normalizan (minúsculas, sin tildes ni signos) y se buscan con una
+única expresión regular compilada que combina los patrones de todas las reglas, así
+que evaluar una visita cuesta microsegundos. Algunas reglas exigen además una
+respuesta del formulario de salud (p. ej. hipertensión = "Sí"). Un síntoma precedido
+por una negación ("no", "sin", "nunca"...) en su misma cláusula no cuenta; una
+negación de una cláusula anterior ("No tengo fiebre, dolor en el pecho") no lo anula.
+
+Si una regla coincide, el triage devuelve de inmediato su nivel de urgencia y el LLM
+se sigue llamando para redactar la explicación. El nivel de una regla nunca se rebaja
+con el del LLM. Cada evaluación y cada regla que coincide se cuentan en metrics.py
+(saracare_red_flag_*), junto con el nivel que dio después el LLM, para poder ajustar
+las reglas.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+
+import metrics
+
+RedFlagRule = namedtuple("RedFlagRule", ["name", "urgency_level", "urgency_rationale", "patterns", "requires"])
+RedFlag = namedtuple("RedFlag", ["rule", "urgency_level", "urgency_rationale", "rules"])
+
+# Patrones sobre el texto normalizado: minúsculas, sin tildes y con espacios simples
+RULES = (
+    RedFlagRule("paro_respiratorio", 1, "Dificultad respiratoria grave.", (
+        r"no puedo respirar", r"no puede respirar", r"me (?:estoy )?ahog\w*", r"se (?:esta )?ahog\w*",
+        r"asfixi\w*", r"labios (?:morados|azules)",
+    ), {}),
+    RedFlagRule("inconsciencia", 1, "Pérdida de conocimiento.", (
+        r"perdi\w* (?:el )?conocimiento", r"inconsciente", r"desmay\w*", r"no responde",
+    ), {}),
+    RedFlagRule("convulsiones", 1, "Convulsiones.", (r"convuls\w*",), {}),
+    RedFlagRule("riesgo_suicida", 1, "Riesgo de autolesión.", (
+        r"suicid\w*", r"quitarme la vida", r"hacerme dano", r"no quiero vivir",
+    ), {}),
+    RedFlagRule("anafilaxia", 1, "Posible reacción alérgica grave.", (
+        r"se me cierra la garganta", r"(?:garganta|lengua|labios|cara) hinchad\w*", r"anafila\w*",
+    ), {}),
+    RedFlagRule("dolor_toracico", 2, "Dolor torácico, posible síndrome coronario.", (
+        r"dolor (?:\w+ ){0,2}(?:en el|de|del) pecho", r"(?:duel|doli)\w* (?:\w+ ){0,2}(?:el )?pecho",
+        r"(?:opresion|presion) (?:en el|del) pecho", r"dolor toracico", r"infarto",
+    ), {}),
+    RedFlagRule("dificultad_respiratoria", 2, "Dificultad para respirar.", (
+        r"dificultad (?:para|al) respirar", r"falta de aire", r"me falta el aire", r"respiro con dificultad",
+    ), {}),
+    RedFlagRule("signos_acv", 2, "Posibles signos de accidente cerebrovascular.", (
+        r"cara (?:caida|torcida|dormida)", r"boca torcida", r"no puedo (?:hablar|mover (?:el|la|un) \w+)",
+        r"habla arrastrada", r"paralisis", r"debilidad (?:en|de) un lado",
+    ), {}),
+    RedFlagRule("hemorragia", 2, "Sangrado abundante.", (
+        r"hemorragia", r"sangrado (?:abundante|que no para|fuerte)", r"(?:vomito|tos\w*) (?:con )?sangre",
+        r"sangra mucho",
+    ), {}),
+    RedFlagRule("crisis_hipertensiva", 2, "Posible crisis hipertensiva en paciente hipertenso.", (
+        r"dolor de cabeza (?:muy )?(?:intenso|fuerte|insoportable)", r"vision borrosa", r"presion (?:muy )?alta",
+    ), {"hypertension": "Sí"}),
+    RedFlagRule("trauma_grave", 2, "Lesión con signos de gravedad.", (
+        r"golpe (?:fuerte )?en la cabeza", r"hueso expuesto", r"fractura\w*", r"accidente de (?:transito|trafico|moto)",
+    ), {"injury": "Sí"}),
+)
+
+# Palabras que, justo antes de un patrón, indican que el paciente niega el síntoma
+NEGATIONS = frozenset(("no", "sin", "niega", "nunca", "ni"))
+NEGATION_WINDOW = 3
+# Una negación no alcanza más allá del inicio de su cláusula: los signos de puntuación
+# cortan el texto antes de normalizarlo y estas palabras lo cortan después
+_CLAUSE_BREAK = re.compile(r"[,.;:!?¡¿()\n]+")
+CLAUSE_WORDS = frozenset(("pero", "y", "aunque"))
+
+_RULES_BY_NAME = {rule.name: rule for rule in RULES}
+# Una sola expresión para todas las reglas; el grupo que coincide indica la regla. La
+# condición inicial descarta enseguida las posiciones que no son inicio de palabra.
+_MATCHER = re.compile(r"(?<![a-z0-9])(?=[a-z])(?:" + "|".join(
+    rf"(?P<{rule.name}>{'|'.join(rule.patterns)})" for rule in RULES) + r")\b")
+_NOT_WORD = re.compile(r"[^a-z0-9]+")
+# Letras latinas con tilde o diéresis -> letra base (á -> a, ñ -> n, ü -> u)
+_ACCENTS = {code: unicodedata.normalize("NFD", chr(code))[0] for code in range(0xC0, 0x180)
+            if unicodedata.normalize("NFD", chr(code))[0].isascii()}
+
+RED_FLAG_MESSAGE = ("⚠️ Señal de alarma: {rationale} Nivel de urgencia {level}. "
+                    "Acuda de inmediato al servicio de urgencias o llame a emergencias.")
+
+
+def normalize(text):
+    """Minúsculas, sin tildes ni signos de puntuación (la ñ pasa a n)."""
+    return _NOT_WORD.sub(" ", text.lower().translate(_ACCENTS)).strip()
+
+
+def _clauses(symptoms):
+    """Texto normalizado y la posición de inicio de cada cláusula dentro de él."""
+    starts, parts, offset = [], [], 0
+    for clause in _CLAUSE_BREAK.split(symptoms):
+        clause = normalize(clause)
+        if clause:
+            starts.append(offset)
+            parts.append(clause)
+            offset += len(clause) + 1
+    return " ".join(parts), starts
+
+
+def _negated(text, start, clause_starts):
+    clause_start = max((position for position in clause_starts if position <= start), default=0)
+    words = text[clause_start:start].split()
+    for index in range(len(words) - 1, -1, -1):
+        if words[index] in CLAUSE_WORDS:
+            words = words[index + 1:]
+            break
+    return any(word in NEGATIONS for word in words[-NEGATION_WINDOW:])
+
+
+def check(visit):
+    """
+    Evalúa las reglas sobre los síntomas y el formulario de salud de la visita.
+
+    Args:
+        visit (dict): Visita con `symptoms` y las respuestas del formulario de salud.
+
+    Returns:
+        RedFlag: La regla más urgente que coincidió (y los nombres de todas las que
+        coincidieron), o None si ninguna coincidió.
+    """
+    text, clause_starts = _clauses(visit.get("symptoms") or "")
+    matched = []
+    for match in _MATCHER.finditer(text):
+        rule = _RULES_BY_NAME[match.lastgroup]
+        if rule.name in matched or _negated(text, match.start(), clause_starts):
+            continue
+        if all(visit.get(field) == value for field, value in rule.requires.items()):
+            matched.append(rule.name)
+
+    metrics.RED_FLAG_CHECKS.inc(result="hit" if matched else "miss")
+    if not matched:
+        return None
+    for name in matched:
+        metrics.RED_FLAG_RULE_HITS.inc(rule=name)
+    top = min((_RULES_BY_NAME[name] for name in matched), key=lambda rule: rule.urgency_level)
+    return RedFlag(top.name, top.urgency_level, top.urgency_rationale, tuple(matched))
+
+
+def alert_message(flag):
+    """Mensaje que se muestra al paciente mientras el LLM redacta la explicación."""
+    return RED_FLAG_MESSAGE.format(rationale=flag.urgency_rationale, level=flag.urgency_level)
+
+
+def combine(result, flag):
+    """
+    Aplica la señal de alarma al resultado del LLM: si la regla es más urgente (o el
+    LLM no dio nivel), su nivel y justificación reemplazan a los del LLM.
+
+    Args:
+        result (TriageResult): Resultado del LLM.
+        flag (RedFlag): Señal de alarma, o None.
+
+    Returns:
+        TriageResult: Resultado con el nivel de urgencia final.
+    """
+    if flag is None:
+        return result
+    # Para ajustar las reglas: qué nivel dio el LLM en los casos que la regla marcó
+    metrics.RED_FLAG_LLM_LEVELS.inc(rule=flag.rule, llm_level=str(result.urgency_level))
+    if result.urgency_level is not None and result.urgency_level <= flag.urgency_level:
+        return result
+    return result._replace(urgency_level=flag.urgency_level, urgency_rationale=flag.urgency_rationale)
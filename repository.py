@@ -0,0 +1,743 @@
+"""
+Repositorio de pacientes y visitas con backends intercambiables.
+
+Las dos interfaces (Streamlit y FastAPI) acceden a los datos solo a través de un
+PatientRepository, así que pueden funcionar contra Cosmos DB, en memoria o sobre un
+archivo SQLite local (pensado para clínicas pequeñas con mala conectividad).
+
+Todos los backends devuelven documentos con `_etag` y lanzan las mismas excepciones
+de azure.cosmos.exceptions, de modo que el código que los usa no depende del backend.
+"""
+import asyncio
+import base64
+import copy
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, namedtuple
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from id_allocator import AsyncIdAllocator, IdAllocator
+from metrics import AsyncInstrumentedContainer, InstrumentedContainer, InstrumentedRepository
+from patient_lookup import PROFILE_FIELDS, PatientDirectory
+from ttl_cache import TTLCache
+
+REPOSITORY_BACKEND = os.getenv("REPOSITORY_BACKEND", "cosmos")
+REPOSITORY_DB_PATH = os.getenv("REPOSITORY_DB_PATH", "saracare.db")
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "20"))
+# Clave de partición del contenedor de Cosmos DB: "id" (modelo original) o "identification"
+COSMOS_PARTITION_KEY = os.getenv("COSMOS_PARTITION_KEY", "id")
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "1024"))
+PATIENT_CACHE_TTL = float(os.getenv("PATIENT_CACHE_TTL", "300"))
+
+# Partición de los documentos que no pertenecen a un paciente (contador de IDs)
+SYSTEM_PARTITION = "_system"
+
+# Página de visitas: los documentos y el token para pedir la siguiente (None si no hay más)
+VisitPage = namedtuple("VisitPage", ["items", "continuation_token"])
+
+# Campos que se proyectan en el historial de visitas, en lugar del documento completo
+VISIT_SUMMARY_FIELDS = ("id", "created_at", "symptoms", "urgency_level", "triage_result")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_etag():
+    return uuid.uuid4().hex
+
+
+def _encode_token(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_token(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("El token de continuación no es válido.") from e
+
+
+def _decode_keyset(token):
+    # Los backends locales paginan por (created_at, id) de la última visita entregada
+    values = _decode_token(token)
+    if not (isinstance(values, list) and len(values) == 2 and all(isinstance(v, str) for v in values)):
+        raise ValueError("El token de continuación no es válido.")
+    return values
+
+
+def _not_found(visit_id):
+    return exceptions.CosmosResourceNotFoundError(status_code=404, message=f"No existe la visita {visit_id}.")
+
+
+def _exists(visit_id):
+    return exceptions.CosmosResourceExistsError(status_code=409, message=f"Ya existe la visita {visit_id}.")
+
+
+def _conflict(visit_id):
+    return exceptions.CosmosAccessConditionFailedError(
+        status_code=412, message=f"La visita {visit_id} fue modificada por otra sesión.")
+
+
+def check_fields(fields):
+    # Los nombres de campo se interpolan en las consultas: solo se aceptan identificadores
+    for field in fields:
+        if not field.isidentifier():
+            raise ValueError(f"Campo no válido: {field!r}")
+    return fields
+
+
+def _project(document, fields):
+    if fields is None:
+        return document
+    return {field: document[field] for field in fields if field in document}
+
+
+def _patch_operations(fields):
+    return [{"op": "set", "path": f"/{field}", "value": value} for field, value in fields.items()]
+
+
+class PatientRepository(ABC):
+    """Operaciones de datos que necesitan las interfaces de SaraCare."""
+
+    @abstractmethod
+    def next_visit_id(self):
+        """Devuelve un ID nuevo y único para una visita."""
+
+    @abstractmethod
+    def find_patient(self, identification):
+        """Devuelve identification, name, age y sex del paciente, o None si no existe."""
+
+    @abstractmethod
+    def register_patient(self, identification, name, age, sex):
+        """Crea o actualiza el perfil del paciente."""
+
+    @abstractmethod
+    def create_visit(self, visit):
+        """
+        Crea una visita. Debe tener `id` e `identification`; si no tiene `created_at`
+        se le asigna la hora actual.
+
+        Raises:
+            CosmosResourceExistsError: Si ya existe una visita con ese ID.
+        """
+
+    @abstractmethod
+    def get_visit(self, visit_id, identification=None):
+        """
+        Devuelve la visita con ese ID. Con la identificación del paciente, los backends
+        particionados por paciente la leen sin salir de su partición.
+
+        Raises:
+            CosmosResourceNotFoundError: Si la visita no existe.
+        """
+
+    @abstractmethod
+    def patch_visit(self, visit, fields):
+        """
+        Actualiza solo los campos indicados, protegido con el `_etag` de `visit`.
+
+        Returns:
+            dict: Nueva versión de la visita.
+
+        Raises:
+            CosmosResourceNotFoundError: Si la visita no existe.
+            CosmosAccessConditionFailedError: Si la visita cambió desde `visit`.
+        """
+
+    @abstractmethod
+    def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        """
+        Devuelve una página de visitas del paciente, de la más reciente a la más antigua.
+
+        Args:
+            identification (str): Identificación del paciente.
+            page_size (int): Máximo de visitas por página.
+            continuation_token (str): Token devuelto por la página anterior.
+            fields (tuple): Si se indica, cada visita trae solo estos campos
+                (p. ej. VISIT_SUMMARY_FIELDS) y sin `_etag`.
+
+        Returns:
+            VisitPage: Visitas de la página y token opaco para pedir la siguiente.
+
+        Raises:
+            ValueError: Si el token de continuación no es válido.
+        """
+
+
+class InMemoryPatientRepository(PatientRepository):
+    """Repositorio en memoria del proceso, útil para pruebas y benchmarks."""
+
+    def __init__(self):
+        self._visits = {}
+        self._visits_by_patient = defaultdict(list)
+        self._patients = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_visit_id(self):
+        with self._lock:
+            return str(next(self._ids))
+
+    def find_patient(self, identification):
+        with self._lock:
+            patient = self._patients.get(identification)
+            return dict(patient) if patient else None
+
+    def register_patient(self, identification, name, age, sex):
+        with self._lock:
+            self._patients[identification] = {
+                "identification": identification, "name": name, "age": age, "sex": sex,
+            }
+
+    def create_visit(self, visit):
+        stored = {"created_at": _now(), **copy.deepcopy(visit), "_etag": _new_etag()}
+        with self._lock:
+            if stored["id"] in self._visits:
+                raise _exists(stored["id"])
+            self._visits[stored["id"]] = stored
+            self._visits_by_patient[stored["identification"]].append(stored["id"])
+            return copy.deepcopy(stored)
+
+    def get_visit(self, visit_id, identification=None):
+        with self._lock:
+            if visit_id not in self._visits:
+                raise _not_found(visit_id)
+            return copy.deepcopy(self._visits[visit_id])
+
+    def patch_visit(self, visit, fields):
+        with self._lock:
+            current = self._visits.get(visit["id"])
+            if current is None:
+                raise _not_found(visit["id"])
+            if visit.get("_etag") is not None and current["_etag"] != visit["_etag"]:
+                raise _conflict(visit["id"])
+            current.update(copy.deepcopy(fields))
+            current["_etag"] = _new_etag()
+            return copy.deepcopy(current)
+
+    def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        with self._lock:
+            visits = sorted(
+                (self._visits[visit_id] for visit_id in self._visits_by_patient.get(identification, ())),
+                key=lambda v: (v["created_at"], v["id"]), reverse=True,
+            )
+            if continuation_token:
+                after = tuple(_decode_keyset(continuation_token))
+                visits = [v for v in visits if (v["created_at"], v["id"]) < after]
+            page = [copy.deepcopy(_project(v, fields)) for v in visits[:page_size]]
+            token = None
+            if len(visits) > page_size:
+                # El token sale de la visita completa: la proyección puede no incluir created_at ni id
+                last = visits[page_size - 1]
+                token = _encode_token([last["created_at"], last["id"]])
+        return VisitPage(page, token)
+
+
+class SQLitePatientRepository(PatientRepository):
+    """
+    Repositorio sobre un archivo SQLite local en modo WAL.
+
+    Las visitas se guardan como JSON con columnas indexadas para la identificación y
+    la fecha, así que buscar y paginar el historial de un paciente no recorre la tabla.
+
+    Args:
+        path (str): Ruta del archivo SQLite.
+    """
+
+    def __init__(self, path="saracare.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS patients (
+                    identification TEXT PRIMARY KEY, name TEXT, age INTEGER, sex TEXT);
+                CREATE TABLE IF NOT EXISTS visits (
+                    id TEXT PRIMARY KEY, identification TEXT NOT NULL, created_at TEXT NOT NULL,
+                    etag TEXT NOT NULL, data TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS visits_by_patient ON visits (identification, created_at, id);
+                CREATE INDEX IF NOT EXISTS visits_by_urgency ON visits (json_extract(data, '$.urgency_level'));
+                CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return _Transaction(conn)
+
+    @staticmethod
+    def _document(data, etag):
+        return {**json.loads(data), "_etag": etag}
+
+    def next_visit_id(self):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('visit', 0)")
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'visit'")
+            (value,) = conn.execute("SELECT value FROM counters WHERE name = 'visit'").fetchone()
+        return str(value)
+
+    def find_patient(self, identification):
+        row = self._connection().execute(
+            "SELECT identification, name, age, sex FROM patients WHERE identification = ?", (identification,)
+        ).fetchone()
+        return dict(zip(PROFILE_FIELDS, row)) if row else None
+
+    def register_patient(self, identification, name, age, sex):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO patients (identification, name, age, sex) VALUES (?, ?, ?, ?)",
+                         (identification, name, age, sex))
+
+    def create_visit(self, visit):
+        document = {"created_at": _now(), **visit}
+        document.pop("_etag", None)
+        etag = _new_etag()
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO visits (id, identification, created_at, etag, data) VALUES (?, ?, ?, ?, ?)",
+                    (document["id"], document["identification"], document["created_at"], etag,
+                     json.dumps(document, ensure_ascii=False)),
+                )
+        except sqlite3.IntegrityError:
+            raise _exists(document["id"])
+        return {**document, "_etag": etag}
+
+    def get_visit(self, visit_id, identification=None):
+        row = self._connection().execute("SELECT data, etag FROM visits WHERE id = ?", (visit_id,)).fetchone()
+        if row is None:
+            raise _not_found(visit_id)
+        return self._document(*row)
+
+    def patch_visit(self, visit, fields):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data, etag FROM visits WHERE id = ?", (visit["id"],)).fetchone()
+            if row is None:
+                raise _not_found(visit["id"])
+            if visit.get("_etag") is not None and row[1] != visit["_etag"]:
+                raise _conflict(visit["id"])
+            document = {**json.loads(row[0]), **fields}
+            etag = _new_etag()
+            conn.execute("UPDATE visits SET data = ?, etag = ? WHERE id = ?",
+                         (json.dumps(document, ensure_ascii=False), etag, visit["id"]))
+        return {**document, "_etag": etag}
+
+    def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        if fields is None:
+            columns = "data, etag"
+        else:
+            columns = ", ".join(f"json_extract(data, '$.{field}')" for field in check_fields(fields))
+        query = f"SELECT {columns}, created_at, id FROM visits WHERE identification = ?"
+        parameters = [identification]
+        if continuation_token:
+            query += " AND (created_at, id) < (?, ?)"
+            parameters.extend(_decode_keyset(continuation_token))
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        parameters.append(page_size + 1)
+        rows = self._connection().execute(query, parameters).fetchall()
+
+        token = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            token = _encode_token([rows[-1][-2], rows[-1][-1]])
+        if fields is None:
+            return VisitPage([self._document(data, etag) for data, etag, _, _ in rows], token)
+        items = [{field: value for field, value in zip(fields, row) if value is not None} for row in rows]
+        return VisitPage(items, token)
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _cosmos_projection(fields):
+    if fields is None:
+        return "*"
+    return ", ".join(f"c.{field}" for field in check_fields(fields))
+
+
+def _cosmos_token(token):
+    # El token de Cosmos DB se envuelve para que sea opaco y seguro en una URL, como los demás backends
+    return _encode_token(token) if token else None
+
+
+class CosmosPatientRepository(PatientRepository):
+    """
+    Repositorio sobre un contenedor de Cosmos DB particionado por `id`.
+
+    Usa IdAllocator para los IDs de visita y PatientDirectory (perfil + caché) para
+    buscar pacientes.
+
+    Args:
+        container: Contenedor de Cosmos DB.
+    """
+
+    VISITS_QUERY = ("SELECT {projection} FROM c WHERE c.identification = @identification "
+                    "AND (NOT IS_DEFINED(c.type) OR c.type != 'patient_profile') ORDER BY c._ts DESC")
+
+    def __init__(self, container, id_block_size=ID_BLOCK_SIZE, cache_size=PATIENT_CACHE_SIZE,
+                 cache_ttl=PATIENT_CACHE_TTL):
+        self.container = container
+        self.allocator = IdAllocator(container, block_size=id_block_size, seed=self._scan_next_id)
+        self.directory = PatientDirectory(container, cache_size=cache_size, cache_ttl=cache_ttl)
+
+    def _partition_key(self, visit_id, identification):
+        return visit_id
+
+    def _visits_scope(self, identification):
+        return {"enable_cross_partition_query": True}
+
+    def _scan_next_id(self):
+        # Solo se usa una vez, para inicializar el contador de IDs a partir de los registros existentes
+        try:
+            id_results = self.container.query_items(query="SELECT VALUE c.id FROM c",
+                                                    enable_cross_partition_query=True)
+            numeric_ids = [int(id) for id in id_results if id.isdigit()]
+        except exceptions.CosmosResourceNotFoundError:
+            numeric_ids = []
+        return str(max(numeric_ids) + 1) if numeric_ids else "1"
+
+    def next_visit_id(self):
+        return self.allocator.next_id()
+
+    def find_patient(self, identification):
+        return self.directory.find(identification)
+
+    def register_patient(self, identification, name, age, sex):
+        self.directory.register(identification, name, age, sex)
+
+    def create_visit(self, visit):
+        visit = {"created_at": _now(), **visit}
+        created = self.container.create_item(visit)
+        self.directory.invalidate(visit["identification"])
+        return created
+
+    def get_visit(self, visit_id, identification=None):
+        return self.container.read_item(item=visit_id, partition_key=visit_id)
+
+    def patch_visit(self, visit, fields):
+        guard = {}
+        if visit.get("_etag") is not None:
+            guard = {"etag": visit["_etag"], "match_condition": MatchConditions.IfNotModified}
+        return self.container.patch_item(item=visit["id"],
+                                         partition_key=self._partition_key(visit["id"], visit["identification"]),
+                                         patch_operations=_patch_operations(fields), **guard)
+
+    def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        pager = self.container.query_items(
+            query=self.VISITS_QUERY.format(projection=_cosmos_projection(fields)),
+            parameters=[{"name": "@identification", "value": identification}],
+            max_item_count=page_size,
+            **self._visits_scope(identification),
+        ).by_page(_decode_token(continuation_token) if continuation_token else None)
+        items = list(next(pager, []))
+        return VisitPage(items, _cosmos_token(pager.continuation_token))
+
+
+class PartitionedCosmosPatientRepository(CosmosPatientRepository):
+    """
+    Repositorio sobre un contenedor de Cosmos DB particionado por `identification`.
+
+    El perfil del paciente (`type: "patient_profile"`) y sus visitas (`type: "visit"`)
+    comparten partición, así que buscar un paciente es una lectura puntual y el
+    historial es una consulta dentro de una sola partición, donde también se pueden
+    usar lotes transaccionales. Cada visita conserva nombre, edad y sexo tal como eran
+    el día de la visita; el perfil es la versión actual. El contador de IDs vive en la
+    partición SYSTEM_PARTITION. migrate_partitions.py pasa los datos del modelo original
+    a este.
+
+    Args:
+        container: Contenedor de Cosmos DB con clave de partición /identification.
+    """
+
+    VISITS_QUERY = ("SELECT {projection} FROM c WHERE c.identification = @identification AND c.type = 'visit' "
+                    "ORDER BY c.created_at DESC")
+    VISIT_BY_ID_QUERY = "SELECT * FROM c WHERE c.id = @id AND c.type = 'visit'"
+
+    def __init__(self, container, id_block_size=ID_BLOCK_SIZE, cache_size=PATIENT_CACHE_SIZE,
+                 cache_ttl=PATIENT_CACHE_TTL):
+        self.container = container
+        self.allocator = IdAllocator(container, block_size=id_block_size, seed=self._scan_next_id,
+                                     partition_key_path="identification", partition_key=SYSTEM_PARTITION)
+        self.directory = PatientDirectory(container, cache_size=cache_size, cache_ttl=cache_ttl,
+                                          partition_key_path="identification")
+
+    def _partition_key(self, visit_id, identification):
+        return identification
+
+    def _visits_scope(self, identification):
+        return {"partition_key": identification}
+
+    def create_visit(self, visit):
+        return super().create_visit({**visit, "type": "visit"})
+
+    def get_visit(self, visit_id, identification=None):
+        if identification is not None:
+            return self.container.read_item(item=visit_id, partition_key=identification)
+        # Sin la identificación no se conoce la partición: consulta entre particiones
+        items = list(self.container.query_items(query=self.VISIT_BY_ID_QUERY,
+                                                parameters=[{"name": "@id", "value": visit_id}],
+                                                enable_cross_partition_query=True))
+        if not items:
+            raise _not_found(visit_id)
+        return items[0]
+
+
+class AsyncPatientRepository(ABC):
+    """Versión asíncrona de PatientRepository, usada por el servicio FastAPI."""
+
+    @abstractmethod
+    async def next_visit_id(self):
+        """Ver PatientRepository.next_visit_id."""
+
+    @abstractmethod
+    async def find_patient(self, identification):
+        """Ver PatientRepository.find_patient."""
+
+    @abstractmethod
+    async def register_patient(self, identification, name, age, sex):
+        """Ver PatientRepository.register_patient."""
+
+    @abstractmethod
+    async def create_visit(self, visit):
+        """Ver PatientRepository.create_visit."""
+
+    @abstractmethod
+    async def get_visit(self, visit_id, identification=None):
+        """Ver PatientRepository.get_visit."""
+
+    @abstractmethod
+    async def patch_visit(self, visit, fields):
+        """Ver PatientRepository.patch_visit."""
+
+    @abstractmethod
+    async def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        """Ver PatientRepository.list_visits."""
+
+
+class AsyncRepositoryAdapter(AsyncPatientRepository):
+    """
+    Expone un repositorio síncrono local (memoria o SQLite) con la interfaz asíncrona,
+    ejecutando cada llamada en un hilo para no bloquear el bucle de eventos.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    async def next_visit_id(self):
+        return await asyncio.to_thread(self.repository.next_visit_id)
+
+    async def find_patient(self, identification):
+        return await asyncio.to_thread(self.repository.find_patient, identification)
+
+    async def register_patient(self, identification, name, age, sex):
+        return await asyncio.to_thread(self.repository.register_patient, identification, name, age, sex)
+
+    async def create_visit(self, visit):
+        return await asyncio.to_thread(self.repository.create_visit, visit)
+
+    async def get_visit(self, visit_id, identification=None):
+        return await asyncio.to_thread(self.repository.get_visit, visit_id, identification)
+
+    async def patch_visit(self, visit, fields):
+        return await asyncio.to_thread(self.repository.patch_visit, visit, fields)
+
+    async def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        return await asyncio.to_thread(self.repository.list_visits, identification, page_size, continuation_token,
+                                       fields)
+
+
+class AsyncCosmosPatientRepository(AsyncPatientRepository):
+    """
+    Repositorio sobre un contenedor asíncrono de Cosmos DB (azure.cosmos.aio).
+
+    Args:
+        container: Contenedor asíncrono de Cosmos DB.
+    """
+
+    VISITS_QUERY = CosmosPatientRepository.VISITS_QUERY
+
+    def __init__(self, container, id_block_size=ID_BLOCK_SIZE, cache_size=PATIENT_CACHE_SIZE,
+                 cache_ttl=PATIENT_CACHE_TTL):
+        self.container = container
+        self.allocator = self._id_allocator(container, id_block_size)
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _id_allocator(self, container, block_size):
+        return AsyncIdAllocator(container, block_size=block_size, seed=self._scan_next_id)
+
+    async def _scan_next_id(self):
+        try:
+            numeric_ids = [int(id) async for id in self.container.query_items(query="SELECT VALUE c.id FROM c")
+                           if id.isdigit()]
+        except exceptions.CosmosResourceNotFoundError:
+            numeric_ids = []
+        return str(max(numeric_ids) + 1) if numeric_ids else "1"
+
+    def _partition_key(self, visit_id, identification):
+        return visit_id
+
+    def _profile_partition_key(self, identification):
+        return PatientDirectory.profile_id(identification)
+
+    def _visits_scope(self, identification):
+        return {}
+
+    async def next_visit_id(self):
+        return await self.allocator.next_id()
+
+    async def find_patient(self, identification):
+        patient = self.cache.get(identification)
+        if patient is not None:
+            return patient
+
+        profile_id = PatientDirectory.profile_id(identification)
+        try:
+            profile = await self.container.read_item(item=profile_id,
+                                                     partition_key=self._profile_partition_key(identification))
+            patient = {field: profile[field] for field in PROFILE_FIELDS}
+        except exceptions.CosmosResourceNotFoundError:
+            items = [item async for item in self.container.query_items(
+                query=PatientDirectory.LEGACY_QUERY, parameters=[{"name": "@identification", "value": identification}],
+                **self._visits_scope(identification))]
+            if not items:
+                return None
+            patient = items[0]
+            await self.container.upsert_item({"id": profile_id, "type": "patient_profile", **patient})
+
+        self.cache.set(identification, patient)
+        return patient
+
+    async def register_patient(self, identification, name, age, sex):
+        profile_id = PatientDirectory.profile_id(identification)
+        await self.container.upsert_item({
+            "id": profile_id, "type": "patient_profile",
+            "identification": identification, "name": name, "age": age, "sex": sex,
+        })
+        self.cache.invalidate(identification)
+
+    async def create_visit(self, visit):
+        created = await self.container.create_item({"created_at": _now(), **visit})
+        self.cache.invalidate(visit["identification"])
+        return created
+
+    async def get_visit(self, visit_id, identification=None):
+        return await self.container.read_item(item=visit_id, partition_key=visit_id)
+
+    async def patch_visit(self, visit, fields):
+        guard = {}
+        if visit.get("_etag") is not None:
+            guard = {"etag": visit["_etag"], "match_condition": MatchConditions.IfNotModified}
+        return await self.container.patch_item(item=visit["id"],
+                                               partition_key=self._partition_key(visit["id"], visit["identification"]),
+                                               patch_operations=_patch_operations(fields), **guard)
+
+    async def list_visits(self, identification, page_size=20, continuation_token=None, fields=None):
+        pager = self.container.query_items(
+            query=self.VISITS_QUERY.format(projection=_cosmos_projection(fields)),
+            parameters=[{"name": "@identification", "value": identification}],
+            max_item_count=page_size,
+            **self._visits_scope(identification),
+        ).by_page(_decode_token(continuation_token) if continuation_token else None)
+        items = []
+        async for page in pager:
+            items = [item async for item in page]
+            break
+        return VisitPage(items, _cosmos_token(pager.continuation_token))
+
+
+class AsyncPartitionedCosmosPatientRepository(AsyncCosmosPatientRepository):
+    """Versión asíncrona de PartitionedCosmosPatientRepository."""
+
+    VISITS_QUERY = PartitionedCosmosPatientRepository.VISITS_QUERY
+
+    def _id_allocator(self, container, block_size):
+        return AsyncIdAllocator(container, block_size=block_size, seed=self._scan_next_id,
+                                partition_key_path="identification", partition_key=SYSTEM_PARTITION)
+
+    def _partition_key(self, visit_id, identification):
+        return identification
+
+    def _profile_partition_key(self, identification):
+        return identification
+
+    def _visits_scope(self, identification):
+        return {"partition_key": identification}
+
+    async def create_visit(self, visit):
+        return await super().create_visit({**visit, "type": "visit"})
+
+    async def get_visit(self, visit_id, identification=None):
+        if identification is not None:
+            return await self.container.read_item(item=visit_id, partition_key=identification)
+        items = [item async for item in self.container.query_items(
+            query=PartitionedCosmosPatientRepository.VISIT_BY_ID_QUERY,
+            parameters=[{"name": "@id", "value": visit_id}])]
+        if not items:
+            raise _not_found(visit_id)
+        return items[0]
+
+
+def create_repository(backend=REPOSITORY_BACKEND):
+    """
+    Crea el repositorio configurado en REPOSITORY_BACKEND: "cosmos" (por defecto),
+    "memory" o "sqlite" (archivo en REPOSITORY_DB_PATH). El repositorio se devuelve
+    instrumentado: registra la duración de cada operación y las RU de Cosmos DB.
+    """
+    return InstrumentedRepository(_create_repository(backend))
+
+
+def _create_repository(backend):
+    if backend == "cosmos":
+        from clients import get_container
+        if COSMOS_PARTITION_KEY == "identification":
+            return PartitionedCosmosPatientRepository(InstrumentedContainer(get_container()))
+        return CosmosPatientRepository(InstrumentedContainer(get_container()))
+    if backend == "memory":
+        return InMemoryPatientRepository()
+    if backend == "sqlite":
+        return SQLitePatientRepository(REPOSITORY_DB_PATH)
+    raise ValueError(f"REPOSITORY_BACKEND desconocido: {backend}")
+
+
+@asynccontextmanager
+async def async_repository(backend=REPOSITORY_BACKEND):
+    """
+    Abre el repositorio asíncrono configurado en REPOSITORY_BACKEND. Con Cosmos DB
+    usa el cliente asíncrono y lo cierra al salir; los backends locales se envuelven
+    con AsyncRepositoryAdapter.
+    """
+    if backend == "cosmos":
+        from clients import async_container
+        async with async_container() as container:
+            if COSMOS_PARTITION_KEY == "identification":
+                repository = AsyncPartitionedCosmosPatientRepository(AsyncInstrumentedContainer(container))
+            else:
+                repository = AsyncCosmosPatientRepository(AsyncInstrumentedContainer(container))
+            yield InstrumentedRepository(repository)
+    else:
+        yield InstrumentedRepository(AsyncRepositoryAdapter(_create_repository(backend)))
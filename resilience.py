@@ -0,0 +1,441 @@
+"""
+Capa de resiliencia para las llamadas al LLM.
+
+Cada llamada de functions.py pasa por ResilientLLM, que aplica:
+
+- Plazo: la llamada completa (reintentos y esperas incluidos) termina en LLM_DEADLINE
+  segundos o lanza DeadlineExceeded, en lugar de dejar colgada la página o la petición.
+- Reintentos con espera exponencial y jitter completo, solo ante errores transitorios
+  (timeouts, conexión, 408/409/429/5xx) y limitados por un presupuesto compartido: cada
+  llamada aporta LLM_RETRY_BUDGET_RATIO reintentos, así que durante una caída los
+  reintentos no multiplican la carga sobre Azure OpenAI.
+- Circuit breaker por deployment: tras LLM_BREAKER_FAILURES errores transitorios
+  seguidos no se llama al deployment durante LLM_BREAKER_RESET segundos; después se deja
+  pasar una llamada de prueba. Si todos están abiertos se lanza LLMUnavailableError.
+- Hedging opcional: con AZURE_OPENAI_HEDGE_DEPLOYMENT_ID configurado, si la llamada
+  supera el percentil LLM_HEDGE_PERCENTILE de las latencias recientes se envía la misma
+  petición al segundo deployment y gana la primera respuesta. Con el breaker del
+  deployment principal abierto, el segundo se usa directamente. Las peticiones de
+  respaldo gastan el mismo presupuesto que los reintentos.
+
+En streaming, los reintentos y el hedging solo aplican hasta el primer fragmento;
+después el texto ya se está mostrando y un error se propaga tal cual.
+"""
+import asyncio
+import itertools
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import clients
+import metrics
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+# Reintentos por segundo permitidos aunque haya poco tráfico
+LLM_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("LLM_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Espera antes del hedging mientras no hay LLM_HEDGE_MIN_SAMPLES latencias observadas
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "5"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Hilos para las llamadas síncronas (Streamlit); cada llamada usa uno o dos
+LLM_THREADS = int(os.getenv("LLM_THREADS", "64"))
+
+RETRYABLE_STATUS = frozenset((408, 409, 429))
+RETRYABLE_ERROR_NAMES = frozenset(("APITimeoutError", "APIConnectionError", "ReadTimeout", "ConnectTimeout"))
+
+_EMPTY = object()
+
+
+class LLMUnavailableError(RuntimeError):
+    """Todos los deployments tienen el circuit breaker abierto."""
+
+    def __init__(self, retry_after):
+        super().__init__("El servicio de IA no está disponible temporalmente.")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """La llamada al LLM no terminó dentro de su plazo."""
+
+
+def is_retryable(error):
+    """Indica si el error es transitorio: timeout, error de conexión, 408/409/429 o 5xx."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
+
+
+class RetryBudget:
+    """
+    Presupuesto de reintentos compartido por todas las llamadas del proceso.
+
+    Cada llamada deposita `ratio` fichas y cada reintento o petición de respaldo gasta
+    una; además se reponen `min_per_second` fichas por segundo. Con ratio=0.2 los
+    reintentos suman como mucho un 20 % de carga extra, más el mínimo por segundo.
+    """
+
+    def __init__(self, ratio=LLM_RETRY_BUDGET_RATIO, min_per_second=LLM_RETRY_BUDGET_MIN_PER_SECOND, capacity=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_call(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def try_spend(self):
+        """Gasta una ficha si hay; devuelve False si el presupuesto está agotado."""
+        with self._lock:
+            self._refill()
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de un deployment: cerrado, abierto o semiabierto.
+
+    Se abre tras `failure_threshold` errores transitorios seguidos. Pasados
+    `reset_timeout` segundos deja pasar una única llamada de prueba: si funciona se
+    cierra y si falla vuelve a abrirse.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indica si se puede llamar al deployment (en semiabierto, solo a la llamada de prueba)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+            # Una prueba que nunca informó su resultado (p. ej. cancelada) no bloquea para siempre
+            if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return True
+            return False
+
+    def retry_after(self):
+        """Segundos hasta la próxima llamada de prueba."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    metrics.LLM_RESILIENCE_EVENTS.inc(event="breaker_open", deployment=self.name)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+
+class LatencyWindow:
+    """Latencias de las últimas `size` llamadas exitosas, para calcular percentiles."""
+
+    def __init__(self, size=200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, p, min_samples=1):
+        """Percentil por rango más cercano, o None si hay menos de `min_samples` muestras."""
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < max(1, min_samples):
+            return None
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def _configured_models():
+    return clients.get_chat_model(), clients.get_hedge_chat_model()
+
+
+class ResilientLLM:
+    """
+    Ejecuta llamadas al LLM con plazo, reintentos, circuit breaker y hedging.
+
+    Las llamadas se pasan como funciones que reciben el modelo a usar, p. ej.
+    `llm.invoke(lambda model: get_chain(model).invoke(inputs))`, para poder repetirlas
+    o enviarlas al deployment de respaldo.
+
+    Args:
+        models: Función que devuelve (modelo principal, modelo de respaldo o None).
+            Por defecto, los de clients.py.
+        deadline (float): Segundos máximos por llamada, reintentos incluidos.
+        max_retries (int): Reintentos máximos por llamada.
+        hedge_percentile (float): Percentil de latencia tras el cual se envía la petición de
+            respaldo; None desactiva el hedging.
+        budget (RetryBudget): Presupuesto de reintentos y peticiones de respaldo.
+    """
+
+    def __init__(self, models=None, deadline=LLM_DEADLINE, max_retries=LLM_MAX_RETRIES,
+                 base_delay=LLM_RETRY_BASE_DELAY, max_delay=LLM_RETRY_MAX_DELAY, budget=None,
+                 breaker_failures=LLM_BREAKER_FAILURES, breaker_reset=LLM_BREAKER_RESET,
+                 hedge_percentile=LLM_HEDGE_PERCENTILE, hedge_initial_delay=LLM_HEDGE_INITIAL_DELAY,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, threads=LLM_THREADS):
+        self.models = models or _configured_models
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.breakers = {name: CircuitBreaker(name, breaker_failures, breaker_reset) for name in ("primary", "hedge")}
+        self.hedge_percentile = hedge_percentile
+        self.hedge_initial_delay = hedge_initial_delay
+        self.hedge_min_samples = hedge_min_samples
+        # Latencias del deployment principal: respuesta completa y primer fragmento del streaming
+        self.latencies = {"complete": LatencyWindow(), "first_token": LatencyWindow()}
+        self.threads = threads
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="llm")
+        return self._executor
+
+    def hedge_delay(self, kind="complete"):
+        """Segundos de espera antes de enviar la petición de respaldo."""
+        observed = self.latencies[kind].percentile(self.hedge_percentile, self.hedge_min_samples)
+        return observed if observed is not None else self.hedge_initial_delay
+
+    def _plan(self):
+        """Elige el deployment de la llamada y, si corresponde, el de respaldo para el hedging."""
+        primary, hedge = self.models()
+        if self.breakers["primary"].allow():
+            backup = ("hedge", hedge) if hedge is not None and self.hedge_percentile is not None else None
+            return ("primary", primary), backup
+        if hedge is not None and self.breakers["hedge"].allow():
+            metrics.LLM_RESILIENCE_EVENTS.inc(event="fallback", deployment="hedge")
+            return ("hedge", hedge), None
+        retry_after = min(breaker.retry_after() for name, breaker in self.breakers.items()
+                          if name == "primary" or hedge is not None)
+        metrics.LLM_RESILIENCE_EVENTS.inc(event="breaker_rejected", deployment="primary")
+        raise LLMUnavailableError(retry_after)
+
+    def _can_hedge(self, deadline):
+        if _remaining(deadline) <= 0 or not self.breakers["hedge"].allow() or not self.budget.try_spend():
+            return False
+        metrics.LLM_RESILIENCE_EVENTS.inc(event="hedge", deployment="hedge")
+        return True
+
+    def _record(self, name, kind, start, error=None):
+        breaker = self.breakers[name]
+        if error is not None and is_retryable(error):
+            breaker.record_failure()
+            return
+        breaker.record_success()
+        if error is None and name == "primary":
+            self.latencies[kind].add(time.monotonic() - start)
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Espera antes del siguiente intento, o None si no hay que reintentar."""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if delay >= _remaining(deadline):
+            return None
+        if not self.budget.try_spend():
+            metrics.LLM_RESILIENCE_EVENTS.inc(event="budget_exhausted", deployment="primary")
+            return None
+        metrics.LLM_RESILIENCE_EVENTS.inc(event="retry", deployment="primary")
+        return delay
+
+    def _deadline_exceeded(self):
+        metrics.LLM_RESILIENCE_EVENTS.inc(event="deadline_exceeded", deployment="primary")
+        return DeadlineExceeded(f"El LLM no respondió en {self.deadline:g} s.")
+
+    # Llamadas síncronas: cada intento corre en el pool de hilos para poder cortarlo por
+    # plazo y lanzar el respaldo en paralelo (el hilo descartado termina por su timeout HTTP).
+
+    def _run(self, call, name, model, kind):
+        start = time.monotonic()
+        try:
+            result = call(model)
+        except Exception as error:
+            self._record(name, kind, start, error)
+            raise
+        self._record(name, kind, start)
+        return result
+
+    def _attempt(self, call, deadline, kind):
+        first, backup = self._plan()
+        futures = {self._pool().submit(self._run, call, *first, kind): first[0]}
+        if backup is not None:
+            done, _ = wait(futures, timeout=min(self.hedge_delay(kind), _remaining(deadline)))
+            if not done and self._can_hedge(deadline):
+                futures[self._pool().submit(self._run, call, *backup, kind)] = backup[0]
+        error = None
+        while futures:
+            done, _ = wait(futures, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise self._deadline_exceeded()
+            for future in done:
+                name = futures.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                if name == "hedge" and backup is not None:
+                    metrics.LLM_RESILIENCE_EVENTS.inc(event="hedge_won", deployment="hedge")
+                return future.result()
+        raise error
+
+    def invoke(self, call, kind="complete"):
+        """Ejecuta `call(model)` con plazo, reintentos, circuit breaker y hedging."""
+        deadline = time.monotonic() + self.deadline
+        self.budget.record_call()
+        for attempt in itertools.count():
+            try:
+                return self._attempt(call, deadline, kind)
+            except (DeadlineExceeded, LLMUnavailableError):
+                raise
+            except Exception as error:
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    def stream(self, open_stream):
+        """
+        Itera `open_stream(model)`; los reintentos y el hedging aplican hasta el primer fragmento.
+        """
+        def first_chunk(model):
+            iterator = iter(open_stream(model))
+            return next(iterator, _EMPTY), iterator
+
+        first, iterator = self.invoke(first_chunk, kind="first_token")
+        if first is not _EMPTY:
+            yield first
+        yield from iterator
+
+    # Llamadas asíncronas: el intento perdedor del hedging y los que vencen se cancelan.
+
+    async def _arun(self, acall, name, model, kind):
+        start = time.monotonic()
+        try:
+            result = await acall(model)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self._record(name, kind, start, error)
+            raise
+        self._record(name, kind, start)
+        return result
+
+    async def _aattempt(self, acall, deadline, kind):
+        first, backup = self._plan()
+        tasks = {asyncio.ensure_future(self._arun(acall, *first, kind)): first[0]}
+        try:
+            if backup is not None:
+                done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay(kind), _remaining(deadline)))
+                if not done and self._can_hedge(deadline):
+                    tasks[asyncio.ensure_future(self._arun(acall, *backup, kind))] = backup[0]
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise self._deadline_exceeded()
+                for task in done:
+                    name = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if name == "hedge" and backup is not None:
+                        metrics.LLM_RESILIENCE_EVENTS.inc(event="hedge_won", deployment="hedge")
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, acall, kind="complete"):
+        """Versión asíncrona de invoke: `acall(model)` devuelve un awaitable."""
+        deadline = time.monotonic() + self.deadline
+        self.budget.record_call()
+        for attempt in itertools.count():
+            try:
+                return await self._aattempt(acall, deadline, kind)
+            except (DeadlineExceeded, LLMUnavailableError):
+                raise
+            except Exception as error:
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    async def astream(self, open_stream):
+        """Versión asíncrona de stream: `open_stream(model)` devuelve un iterador asíncrono."""
+        async def first_chunk(model):
+            iterator = open_stream(model).__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = _EMPTY
+            return first, iterator
+
+        first, iterator = await self.ainvoke(first_chunk, kind="first_token")
+        if first is not _EMPTY:
+            yield first
+        async for chunk in iterator:
+            yield chunk
+
+
+# Instancia del proceso que usa functions.py
+llm = ResilientLLM()
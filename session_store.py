@@ -0,0 +1,129 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from ttl_cache import TTLCache
+
+
+class SessionStore(ABC):
+    """
+    Almacén del estado de conversación de cada paciente, indexado por un token de sesión.
+
+    Los backends guardan un diccionario por sesión y lo expiran `ttl` segundos después
+    de la última escritura.
+    """
+
+    def create(self, data):
+        """
+        Crea una sesión nueva con los datos indicados.
+
+        Returns:
+            str: Token de sesión que el cliente debe enviar en las siguientes llamadas.
+        """
+        token = secrets.token_urlsafe(24)
+        self.set(token, data)
+        return token
+
+    @abstractmethod
+    def get(self, token):
+        """Devuelve los datos de la sesión o None si no existe o expiró."""
+
+    @abstractmethod
+    def set(self, token, data):
+        """Guarda (o reemplaza) los datos de la sesión y renueva su expiración."""
+
+    @abstractmethod
+    def delete(self, token):
+        """Elimina la sesión."""
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Sesiones en memoria del proceso, con desalojo LRU y TTL.
+
+    Solo sirve para un único proceso: con varios workers cada uno tendría sus propias sesiones.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, token):
+        data = self.cache.get(token)
+        return dict(data) if data is not None else None
+
+    def set(self, token, data):
+        self.cache.set(token, dict(data))
+
+    def delete(self, token):
+        self.cache.invalidate(token)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones en un archivo SQLite local, compartido por todos los procesos de la máquina.
+
+    Usa modo WAL para que varios workers lean y escriban sin bloquearse entre sí.
+    Las sesiones expiradas se purgan al crear sesiones nuevas.
+    """
+
+    def __init__(self, path="sessions.db", ttl=3600.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "token TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, data):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+        return super().create(data)
+
+    def get(self, token):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE token = ? AND expires_at >= ?", (token, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, token, data):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (token, data, expires_at) VALUES (?, ?, ?)",
+                (token, json.dumps(data), time.time() + self.ttl),
+            )
+
+    def delete(self, token):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+
+def create_session_store():
+    """
+    Crea el almacén de sesiones configurado en las variables de entorno.
+
+    SESSION_BACKEND puede ser "memory" (por defecto) o "sqlite"; con varios workers
+    debe usarse "sqlite".
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    ttl = float(os.getenv("SESSION_TTL", "3600"))
+    if backend == "sqlite":
+        return SQLiteSessionStore(path=os.getenv("SESSION_DB_PATH", "sessions.db"), ttl=ttl)
+    if backend == "memory":
+        return InMemorySessionStore(maxsize=int(os.getenv("SESSION_MAX_ENTRIES", "10000")), ttl=ttl)
+    raise ValueError(f"SESSION_BACKEND desconocido: {backend}")
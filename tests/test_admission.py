@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionControl, ConcurrencyLimiter, KeyedRateLimiter, Rejected
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def scope(path="/symptoms/", client="10.0.0.1", session=None, forwarded=None):
+    headers = []
+    if session:
+        headers.append((b"x-session-id", session.encode()))
+    if forwarded:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    return {"type": "http", "path": path, "client": (client, 1234), "headers": headers}
+
+
+def test_desactivado_por_defecto():
+    control = AdmissionControl(clients=KeyedRateLimiter(1, 1))
+    for _ in range(10):
+        asyncio.run(control.admit(scope()))()
+
+
+def test_rechazo_por_sesion_no_gasta_la_tasa_del_cliente():
+    clock = Clock()
+    clients, sessions = KeyedRateLimiter(1, 5, clock=clock), KeyedRateLimiter(1, 1, clock=clock)
+    control = AdmissionControl(clients=clients, sessions=sessions, max_wait=0, enabled=True)
+    asyncio.run(control.admit(scope(session="s1")))()
+    for _ in range(3):
+        with pytest.raises(Rejected) as rejected:
+            asyncio.run(control.admit(scope(session="s1")))
+        assert rejected.value.status_code == 429 and rejected.value.reason == "session_rate"
+    assert clients.bucket("10.0.0.1").tokens == 4
+
+
+def test_rechazo_del_llm_devuelve_los_turnos():
+    clients = KeyedRateLimiter(1, 5, clock=Clock())
+    llm = ConcurrencyLimiter(1, max_queue=0)
+    control = AdmissionControl(clients=clients, llm=llm, enabled=True)
+
+    async def two_triages():
+        release = await control.admit(scope(path="/triage/"))
+        with pytest.raises(Rejected) as rejected:
+            await control.admit(scope(path="/triage/"))
+        release()
+        return rejected.value
+
+    rejected = asyncio.run(two_triages())
+    assert rejected.status_code == 503 and rejected.reason == "llm_queue_full"
+    assert clients.bucket("10.0.0.1").tokens == 4
+
+
+def test_cliente_detras_del_balanceador():
+    control = AdmissionControl(trust_forwarded=True)
+    # La última dirección es la que agregó el balanceador; la primera la envía el cliente
+    assert control.client_key(scope(client="10.0.0.254", forwarded="1.2.3.4, 200.1.1.7")) == "200.1.1.7"
+    # Sin ADMISSION_TRUST_FORWARDED la cabecera se ignora: sin balanceador el cliente podría falsearla
+    assert AdmissionControl().client_key(scope(forwarded="200.1.1.7")) == "10.0.0.1"
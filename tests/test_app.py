@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import repository
+import triage_jobs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    store = repository.InMemoryPatientRepository()
+    store.register_patient("123", "Ana", 30, "Femenino")
+    store.create_visit({"id": store.next_visit_id(), "identification": "123", "symptoms": "tos"})
+    monkeypatch.setattr(repository, "create_repository", lambda: store)
+    monkeypatch.setattr(triage_jobs, "TRIAGE_JOBS_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(triage_jobs, "TRIAGE_WORKERS", 0)
+    # app.py abre sus imágenes con rutas relativas a la raíz del repositorio
+    monkeypatch.chdir(ROOT)
+    st.cache_resource.clear()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=30)
+    at.run()
+    yield at
+    st.cache_resource.clear()
+
+
+def click(at, label, sidebar=False):
+    buttons = at.sidebar.button if sidebar else at.button
+    next(button for button in buttons if button.label == label).click().run()
+
+
+def identify(at, identification):
+    click(at, "Iniciar Registro")
+    at.text_input[0].input(identification).run()
+    click(at, "Verificar Identificación")
+
+
+def test_paciente_que_vuelve_ve_su_historial(app):
+    identify(app, "123")
+    assert app.session_state.step == 3
+    click(app, "Ver historial", sidebar=True)
+    history = app.session_state.history
+    assert history["identification"] == "123" and len(history["page"].items) == 2
+
+
+def test_reiniciar_no_deja_el_historial_del_paciente_anterior(app):
+    identify(app, "123")
+    click(app, "Ver historial", sidebar=True)
+    app.session_state.step = 6
+    app.run()
+    click(app, "🔄 Reiniciar")
+    assert app.session_state.step == 0
+    assert app.session_state.identification is None and app.session_state.history is None
+    assert next(button for button in app.sidebar.button if button.label == "Ver historial").disabled
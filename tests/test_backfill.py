@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from azure.cosmos import exceptions
+
+from backfill import Backfill
+from fakes import InMemoryContainer
+from functions import TriageResult
+from rate_limit import TokenBucket
+
+
+def cosmos_error(status_code, retry_after_ms=None):
+    error = exceptions.CosmosHttpResponseError(status_code=status_code, message=f"Error {status_code}")
+    error.headers = {"x-ms-retry-after-ms": retry_after_ms} if retry_after_ms else {}
+    return error
+
+
+class FlakyContainer:
+    """Contenedor que responde con los errores de `errors` antes de cada escritura real."""
+
+    def __init__(self, container, *errors):
+        self.container = container
+        self.errors = list(errors)
+
+    def _fail(self):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self._fail()
+        return self.container.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+    def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        self._fail()
+        return self.container.patch_item(item=item, partition_key=partition_key, patch_operations=patch_operations,
+                                         **kwargs)
+
+
+def visits(container, ids, identification="p1"):
+    documents = [{"id": visit_id, "identification": identification, "symptoms": "tos", "urgency_level": 3}
+                 for visit_id in ids]
+    for document in documents:
+        container.create_item(document)
+    return documents
+
+
+def write(container, documents, level=2):
+    backfill = Backfill(container, "prueba", limiter=TokenBucket(1e9, capacity=1e9), partition_key="identification",
+                        retry_delay=0.001)
+    results = [(document, TriageResult("Consulta prioritaria.", level, "Fiebre alta.")) for document in documents]
+    asyncio.run(backfill.write(results))
+    return backfill.stats
+
+
+def retriaged(container):
+    return sorted(document["id"] for document in container.query_items("SELECT * FROM c",
+                                                                         enable_cross_partition_query=True)
+                  if (document.get("retriage") or {}).get("run") == "prueba")
+
+
+def test_un_lote_con_una_visita_borrada_se_escribe_visita_por_visita():
+    container = InMemoryContainer(partition_key_path="identification")
+    documents = visits(container, ["1", "3"])
+    # La visita 2 se borró después de leer la página
+    documents.insert(1, {"id": "2", "identification": "p1", "symptoms": "tos", "urgency_level": 3})
+
+    stats = write(container, documents)
+    assert (stats["written"], stats["failed"], stats["batches"]) == (2, 1, 0)
+    assert retriaged(container) == ["1", "3"]
+    assert stats["more_urgent"] == 3
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_reintenta_throttling_y_errores_transitorios(status_code):
+    container = InMemoryContainer(partition_key_path="identification")
+    documents = visits(container, ["1", "2", "3"]) + visits(container, ["4"], identification="p2")
+    flaky = FlakyContainer(container, cosmos_error(status_code, "10"), cosmos_error(status_code, "10"))
+
+    stats = write(flaky, documents)
+    assert (stats["written"], stats["failed"], stats["write_retries"]) == (4, 0, 2)
+    assert retriaged(container) == ["1", "2", "3", "4"]
+
+
+def test_un_error_que_no_es_de_la_visita_detiene_la_ejecucion():
+    container = InMemoryContainer(partition_key_path="identification")
+    documents = visits(container, ["1", "2"])
+    flaky = FlakyContainer(container, cosmos_error(403))
+
+    with pytest.raises(exceptions.CosmosHttpResponseError):
+        write(flaky, documents)
+    assert retriaged(container) == []
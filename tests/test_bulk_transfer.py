@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from azure.cosmos import exceptions
+
+from bulk_transfer import BulkImporter, export, export_query, read_ndjson
+from fakes import InMemoryContainer
+
+
+def cosmos_error(status_code, retry_after_ms=None):
+    error = exceptions.CosmosHttpResponseError(status_code=status_code, message=f"Error {status_code}")
+    error.headers = {"x-ms-retry-after-ms": retry_after_ms} if retry_after_ms else {}
+    return error
+
+
+class FlakyContainer:
+    """Contenedor que responde con los errores de `errors` antes de cada escritura real."""
+
+    def __init__(self, *errors, reject=None):
+        self.container = InMemoryContainer(partition_key_path="identification")
+        self.errors = list(errors)
+        self.reject = reject or {}
+        self.calls = 0
+
+    def _fail(self, body=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        if body is not None and body["id"] in self.reject:
+            raise cosmos_error(self.reject[body["id"]])
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self._fail()
+        for index, (_, (body,)) in enumerate(batch_operations):
+            if body["id"] in self.reject:
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=index, headers={}, status_code=self.reject[body["id"]],
+                    message="Documento inválido.", operation_responses=[])
+        return self.container.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+    def upsert_item(self, body, **kwargs):
+        self._fail(body)
+        return self.container.upsert_item(body, **kwargs)
+
+
+def documents(count, identification="p1"):
+    return [{"id": str(n), "identification": identification, "name": f"Paciente {n}"} for n in range(count)]
+
+
+def run(importer, docs):
+    return asyncio.run(importer.run(docs))
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_reintenta_throttling_y_errores_transitorios(status_code):
+    container = FlakyContainer(cosmos_error(status_code, "10"), cosmos_error(status_code, "10"))
+    stats = run(BulkImporter(container, partition_key="identification", retry_delay=0.001), documents(3))
+    assert stats["written"] == 3 and stats["retries"] == 2 and not stats.get("failed")
+    assert len(list(container.container.query_items("SELECT * FROM c", enable_cross_partition_query=True))) == 3
+
+
+def test_agotar_los_reintentos_detiene_la_importacion():
+    container = FlakyContainer(*(cosmos_error(429, "1") for _ in range(3)))
+    with pytest.raises(exceptions.CosmosHttpResponseError):
+        run(BulkImporter(container, partition_key="identification", max_retries=2), documents(1))
+    assert container.calls == 3
+
+
+def test_cuenta_como_fallidos_solo_los_documentos_rechazados():
+    container = FlakyContainer(reject={"1": 400})
+    stats = run(BulkImporter(container, partition_key="identification"), documents(3))
+    assert (stats["written"], stats["failed"]) == (2, 1)
+
+
+def test_un_error_que_no_es_del_documento_detiene_la_importacion():
+    container = FlakyContainer(cosmos_error(403))
+    with pytest.raises(exceptions.CosmosHttpResponseError):
+        run(BulkImporter(container, partition_key="identification"), documents(1))
+
+
+def test_exportar_visitas_incluye_las_que_no_tienen_type(tmp_path):
+    container = InMemoryContainer()
+    container.create_item({"id": "1", "identification": "123", "created_at": "2024-03-01T10:00:00"})
+    container.create_item({"id": "2", "identification": "123", "type": "visit", "created_at": "2024-05-01T10:00:00"})
+    container.create_item({"id": "perfil-123", "identification": "123", "type": "patient_profile"})
+    container.create_item({"id": "visit-id-counter", "next": 3})
+    path = str(tmp_path / "visitas.ndjson")
+
+    export(container, path, document_type="visit")
+    assert sorted(document["id"] for document in read_ndjson(path)) == ["1", "2"]
+    export(container, path, document_type="patient_profile")
+    assert [document["id"] for document in read_ndjson(path)] == ["perfil-123"]
+    export(container, path, document_type="visit", since="2024-04-01")
+    assert [document["id"] for document in read_ndjson(path)] == ["2"]
+
+
+def test_exportar_rechaza_campos_que_no_son_identificadores():
+    assert export_query(fields=("id", "created_at"))[0] == "SELECT c.id, c.created_at FROM c"
+    with pytest.raises(ValueError):
+        export_query(fields=("id", "symptoms FROM c JOIN x IN c.retriage"))
@@ -0,0 +1,82 @@
+import pytest
+
+from change_feed import UNKNOWN_URGENCY, AggregateStore, ChangeFeedProcessor
+from fakes import InMemoryContainer
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AggregateStore(str(tmp_path / "aggregates.db"))
+
+
+def visit(visit_id, **fields):
+    return {"id": visit_id, "identification": "123", "created_at": "2024-05-01T10:15:00", **fields}
+
+
+def test_reaplicar_una_pagina_no_cuenta_dos_veces(store):
+    page = [visit("1", smoking="Sí"), visit("2", smoking="No"), {"id": "perfil-123", "type": "patient_profile"}]
+    assert store.apply(page, "prueba", "token-1") == 2
+    assert store.apply(page, "prueba", "token-1") == 0
+    assert store.metric("visits_by_hour") == {"2024-05-01T10": 2}
+    assert store.metric("smoking") == {"No": 1, "Sí": 1}
+    assert store.checkpoint("prueba") == "token-1"
+
+
+def test_una_visita_actualizada_reemplaza_su_aporte(store):
+    store.apply([visit("1", smoking="Sí")], "prueba", "token-1")
+    store.apply([visit("1", smoking="No", triage_result="texto", urgency_level=2)], "prueba", "token-2")
+    store.apply([visit("2", triage_result="texto")], "prueba", "token-3")
+    assert store.metric("smoking") == {"No": 1}
+    assert store.metric("urgency") == {"2": 1, UNKNOWN_URGENCY: 1}
+    assert store.metric("visits_by_hour") == {"2024-05-01T10": 2}
+
+
+def test_pagina_sin_token_se_aplica_y_conserva_el_checkpoint(store):
+    store.apply([visit("1")], "prueba", "token-1")
+    assert store.apply([visit("2")], "prueba", None) == 1
+    assert store.checkpoint("prueba") == "token-1"
+    assert store.metric("visits_by_hour") == {"2024-05-01T10": 2}
+
+
+def test_el_procesador_retoma_desde_el_checkpoint(store):
+    container = InMemoryContainer(partition_key_path="identification")
+    for visit_id in ("1", "2", "3"):
+        container.create_item(visit(visit_id))
+    assert ChangeFeedProcessor(container, store, name="prueba", page_size=2).run_once() == 3
+    assert ChangeFeedProcessor(container, store, name="prueba").run_once() == 0
+
+    container.upsert_item(visit("2", triage_result="texto", urgency_level=3))
+    container.create_item(visit("4"))
+    assert ChangeFeedProcessor(container, store, name="prueba").run_once() == 2
+    assert store.metric("visits_by_hour") == {"2024-05-01T10": 4}
+    assert store.metric("urgency") == {"3": 1}
+
+
+class _PagesWithoutToken:
+    def __init__(self, pages):
+        self.pages = pages
+        self.continuation_token = None
+
+    def __iter__(self):
+        return iter(self.pages)
+
+
+class ContainerWithoutToken:
+    """Change feed cuyas páginas llegan sin token de continuación."""
+
+    def __init__(self, *pages):
+        self.pages = pages
+
+    def query_items_change_feed(self, **kwargs):
+        return self
+
+    def by_page(self):
+        return _PagesWithoutToken(self.pages)
+
+
+def test_el_procesador_aplica_las_paginas_sin_token(store):
+    store.apply([], "prueba", "token-1")
+    processor = ChangeFeedProcessor(ContainerWithoutToken([visit("1")], [visit("2")]), store, name="prueba")
+    assert processor.run_once() == 2
+    assert store.metric("visits_by_hour") == {"2024-05-01T10": 2}
+    assert store.checkpoint("prueba") == "token-1"
@@ -0,0 +1,76 @@
+import pytest
+
+import clients
+import functions
+from fakes import FAKE_TRIAGE_RESPONSE, fake_chat_model
+from functions import DiskCompletionCache, MemoryCompletionCache, completion_cache_key, parse_triage
+
+SYSTEM_PROMPT = "Eres un sistema experto en triage médico."
+PREGUNTA = "Paciente Ana, edad 30, sexo Femenino. Síntomas: tos seca."
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = fake_chat_model()
+    monkeypatch.setattr(clients, "_chat_model", model)
+    monkeypatch.setattr(clients, "_hedge_chat_model", None)
+    return model
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return lambda ttl=60.0, maxsize=10: MemoryCompletionCache(maxsize=maxsize, ttl=ttl)
+    return lambda ttl=60.0, maxsize=10: DiskCompletionCache(str(tmp_path / "cache.db"), maxsize=maxsize, ttl=ttl)
+
+
+def test_cache_aciertos_y_fallos(cache):
+    completions = cache()
+    assert completions.get("a") is None
+    completions.set("a", "respuesta")
+    assert completions.get("a") == "respuesta"
+    assert (completions.hits, completions.misses) == (1, 1)
+
+
+def test_cache_expira_y_desaloja_la_menos_usada(cache):
+    expired = cache(ttl=-1.0)
+    expired.set("a", "respuesta")
+    assert expired.get("a") is None
+
+    completions = cache(maxsize=2)
+    completions.set("a", "1")
+    completions.set("b", "2")
+    completions.get("a")
+    completions.set("c", "3")
+    assert [completions.get(key) for key in ("a", "b", "c")] == ["1", None, "3"]
+
+
+def test_la_clave_no_depende_de_espacios_ni_de_la_forma_unicode(model):
+    key = completion_cache_key(SYSTEM_PROMPT, PREGUNTA)
+    assert key == completion_cache_key(f"  {SYSTEM_PROMPT}\n", PREGUNTA.replace(" ", "   "))
+    # "Sí" con la tilde como carácter combinado (NFD) es la misma pregunta
+    assert completion_cache_key(SYSTEM_PROMPT, "Fuma: S\u00ed") == completion_cache_key(SYSTEM_PROMPT, "Fuma: Si\u0301")
+    assert key != completion_cache_key(SYSTEM_PROMPT, PREGUNTA.replace("tos seca", "fiebre"))
+    assert key != completion_cache_key(SYSTEM_PROMPT + " Responde breve.", PREGUNTA)
+
+
+def test_el_triage_repetido_sale_de_la_cache(model, monkeypatch):
+    monkeypatch.setattr(functions, "completion_cache", MemoryCompletionCache())
+    first = functions.generate_triage(SYSTEM_PROMPT, PREGUNTA)
+    second = functions.generate_triage(SYSTEM_PROMPT, f" {PREGUNTA} ")
+    assert first == second and model.calls == 1
+    functions.generate_triage(SYSTEM_PROMPT, PREGUNTA, use_cache=False)
+    assert model.calls == 2, "use_cache=False vuelve a llamar al modelo"
+
+
+@pytest.mark.parametrize("text, level, rationale", [
+    (FAKE_TRIAGE_RESPONSE, 3, "Síntomas persistentes sin signos de alarma."),
+    ("Acuda a urgencias.\nNivel de urgencia: **1**\nJustificación: **Dolor torácico.**", 1, "Dolor torácico."),
+    ("**Nivel de urgencia:** **2**\n**Justificación:** Fiebre alta.", 2, "Fiebre alta."),
+    ("nivel de urgencia = 5\njustificacion - Resfriado común", 5, "Resfriado común"),
+    ("Se recomienda reposo e hidratación.", None, None),
+    ("NIVEL DE URGENCIA: 7\nJUSTIFICACIÓN: fuera de rango", None, "fuera de rango"),
+])
+def test_parse_triage(text, level, rationale):
+    result = parse_triage(text)
+    assert (result.text, result.urgency_level, result.urgency_rationale) == (text, level, rationale)
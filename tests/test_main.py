@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from fakes import AsyncInMemoryContainer
+from repository import AsyncCosmosPatientRepository, AsyncPartitionedCosmosPatientRepository
+
+REPOSITORIES = {
+    "cosmos": lambda: AsyncCosmosPatientRepository(AsyncInMemoryContainer()),
+    "cosmos-partitioned": lambda: AsyncPartitionedCosmosPatientRepository(
+        AsyncInMemoryContainer(partition_key_path="identification")),
+}
+
+
+@pytest.fixture(params=list(REPOSITORIES))
+def repository(request):
+    repository = REPOSITORIES[request.param]()
+    main.app.dependency_overrides[main.get_repository] = lambda: repository
+    yield repository
+    main.app.dependency_overrides.clear()
+
+
+def test_paciente_que_vuelve_abre_una_visita_nueva(repository):
+    patient = {"name": "Ana", "identification": "123", "age": 30, "sex": "Femenino"}
+
+    async def two_visits():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://kiosco") as client:
+            return [await client.post("/chatbot/", json=patient) for _ in range(2)]
+
+    responses = asyncio.run(two_visits())
+    assert [response.status_code for response in responses] == [200, 200]
+    visits = asyncio.run(repository.list_visits("123")).items
+    assert len(visits) == 2 and len({visit["id"] for visit in visits}) == 2
+    assert all(visit["id"] != "123" for visit in visits), "la identificación no es el ID de la visita"
+
+
+def test_historial_solo_del_paciente_de_la_sesion(repository):
+    async def requests():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://kiosco") as client:
+            for identification in ("123", "456"):
+                response = await client.post("/chatbot/", json={
+                    "name": "Ana", "identification": identification, "age": 30, "sex": "Femenino"})
+            headers = {"X-Session-Id": response.json()["session_id"]}
+            return (await client.get("/patients/456/visits", headers=headers),
+                    await client.get("/patients/123/visits", headers=headers),
+                    await client.get("/patients/456/visits"))
+
+    own, other, anonymous = asyncio.run(requests())
+    assert own.status_code == 200 and len(own.json()["visits"]) == 1
+    assert other.status_code == 403 and anonymous.status_code == 403
+
+
+def test_historial_en_modo_clinico(repository, monkeypatch):
+    monkeypatch.setattr(main, "CLINICIAN_MODE", True)
+
+    async def request():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://clinica") as client:
+            await client.post("/chatbot/", json={"name": "Ana", "identification": "123", "age": 30, "sex": "Femenino"})
+            return await client.get("/patients/123/visits")
+
+    assert asyncio.run(request()).status_code == 200
+
+
+def test_sala_de_espera_solo_en_modo_clinico(monkeypatch):
+    main.waiting_room.push("v1", 2, {"identification": "123", "name": "Ana"})
+
+    async def requests():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://kiosco") as client:
+            return [await client.get("/waiting-room/"), await client.post("/waiting-room/next"),
+                    await client.delete("/waiting-room/v1")]
+
+    try:
+        assert [response.status_code for response in asyncio.run(requests())] == [403, 403, 403]
+        assert "v1" in main.waiting_room
+        monkeypatch.setattr(main, "CLINICIAN_MODE", True)
+        listing, called, removed = asyncio.run(requests())
+        assert listing.json()["patients"][0]["name"] == "Ana"
+        assert called.json()["visit_id"] == "v1" and removed.status_code == 404
+    finally:
+        main.waiting_room.remove("v1")
@@ -0,0 +1,73 @@
+import pytest
+
+import metrics
+from fakes import InMemoryContainer
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_formato_de_texto_de_prometheus(registry):
+    requests = registry.counter("saracare_requests_total", "Peticiones atendidas.", ("route", "status"))
+    requests.inc(route="/triage/", status="200")
+    requests.inc(2, route="/triage/", status="200")
+    requests.inc(route='/ruta "rara"\n', status="500")
+    registry.histogram("saracare_empty_seconds", "Sin observaciones.")
+
+    assert registry.render() == (
+        "# HELP saracare_requests_total Peticiones atendidas.\n"
+        "# TYPE saracare_requests_total counter\n"
+        'saracare_requests_total{route="/ruta \\"rara\\"\\n",status="500"} 1\n'
+        'saracare_requests_total{route="/triage/",status="200"} 3\n'
+        "# HELP saracare_empty_seconds Sin observaciones.\n"
+        "# TYPE saracare_empty_seconds histogram\n"
+    )
+
+
+def test_buckets_acumulativos_del_histograma(registry):
+    latency = registry.histogram("saracare_latency_seconds", "Latencia.", ("route",), buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        latency.observe(value, route="/triage/")
+
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'saracare_latency_seconds_bucket{route="/triage/",le="0.1"} 2',
+        'saracare_latency_seconds_bucket{route="/triage/",le="0.5"} 3',
+        'saracare_latency_seconds_bucket{route="/triage/",le="1.0"} 4',
+        'saracare_latency_seconds_bucket{route="/triage/",le="+Inf"} 5',
+        'saracare_latency_seconds_count{route="/triage/"} 5',
+        'saracare_latency_seconds_sum{route="/triage/"} 3.15',
+    ]
+    assert registry.snapshot() == [{"metric": "saracare_latency_seconds", "route": "/triage/", "count": 5,
+                                    "value": pytest.approx(3.15)}]
+
+
+def test_el_endpoint_del_contexto_etiqueta_las_metricas(registry):
+    calls = registry.counter("saracare_calls_total", "Llamadas.", ("endpoint",))
+    with metrics.endpoint("/symptoms/"):
+        calls.inc()
+    calls.inc()
+    assert [labels for _, labels, _ in calls.samples()] == [(("endpoint", "-"),), (("endpoint", "/symptoms/"),)]
+
+
+def test_el_contenedor_instrumentado_registra_duracion_y_ru():
+    metrics.REGISTRY.clear()
+    hooked = []
+
+    def hook(headers, result):
+        hooked.append(headers)
+
+    container = metrics.InstrumentedContainer(InMemoryContainer())
+    with metrics.endpoint("/chatbot/"):
+        container.create_item({"id": "1", "identification": "123"}, response_hook=hook)
+        container.read_item("1", partition_key="1")
+
+    charges = {dict(labels)["operation"]: value for _, labels, value in metrics.STORAGE_REQUEST_CHARGE.samples()}
+    assert set(charges) == {"create_item", "read_item"} and all(value > 0 for value in charges.values())
+    assert hooked and float(hooked[0]["x-ms-request-charge"]) == charges["create_item"], "el hook original se llama"
+    durations = {dict(labels)["operation"]: count for name, labels, count in metrics.STORAGE_SECONDS.samples()
+                 if name.endswith("_count")}
+    assert durations == {"create_item": 1, "read_item": 1}
+    assert all(dict(labels)["endpoint"] == "/chatbot/" for _, labels, _ in metrics.STORAGE_REQUEST_CHARGE.samples())
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from fakes import AsyncInMemoryContainer, InMemoryContainer
+from patient_lookup import PatientDirectory
+from repository import AsyncCosmosPatientRepository, AsyncPartitionedCosmosPatientRepository
+
+
+def legacy_visits(container):
+    """
+    Dos visitas anteriores a los perfiles; la segunda, un año después, con la edad actual.
+    La más antigua es la primera que devuelve el contenedor sin ORDER BY.
+    """
+    for visit_id, age, ts in (("1", 30, 1_600_000_000), ("2", 31, 1_631_536_000)):
+        container.create_item({"id": visit_id, "identification": "123", "name": "Ana", "age": age, "sex": "Femenino"})
+        for document in container._items.values():
+            if document["id"] == visit_id:
+                document["_ts"] = ts
+
+
+@pytest.mark.parametrize("partition_key_path", ["id", "identification"])
+def test_perfil_desde_la_visita_mas_reciente(partition_key_path):
+    container = InMemoryContainer(partition_key_path=partition_key_path)
+    legacy_visits(container)
+    directory = PatientDirectory(container, partition_key_path=partition_key_path)
+    assert directory.find("123")["age"] == 31
+    assert container.read_item(PatientDirectory.profile_id("123"), directory._partition_key("123"))["age"] == 31
+
+
+@pytest.mark.parametrize("repository_class, partition_key_path", [
+    (AsyncCosmosPatientRepository, "id"),
+    (AsyncPartitionedCosmosPatientRepository, "identification"),
+])
+def test_perfil_asincrono_desde_la_visita_mas_reciente(repository_class, partition_key_path):
+    container = AsyncInMemoryContainer(partition_key_path=partition_key_path)
+    legacy_visits(container.store)
+    assert asyncio.run(repository_class(container).find_patient("123"))["age"] == 31
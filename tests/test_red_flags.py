@@ -0,0 +1,41 @@
+import pytest
+
+import red_flags
+
+
+def check(symptoms, **answers):
+    return red_flags.check({"symptoms": symptoms, **answers})
+
+
+@pytest.mark.parametrize("symptoms, rule", [
+    # Una negación de una cláusula anterior no anula el síntoma
+    ("No tengo fiebre, dolor en el pecho muy fuerte", "dolor_toracico"),
+    ("Sin fiebre. Me ahogo", "paro_respiratorio"),
+    ("ni idea, pero dolor en el pecho", "dolor_toracico"),
+    ("Nunca me pasó: no puedo respirar", "paro_respiratorio"),
+    ("No tengo tos y me duele el pecho", "dolor_toracico"),
+    ("sin fiebre pero me desmayé", "inconsciencia"),
+    # Formas verbales del dolor torácico
+    ("Me duele el pecho", "dolor_toracico"),
+    ("me duele mucho el pecho y el brazo izquierdo", "dolor_toracico"),
+    ("Me dolía el pecho al caminar", "dolor_toracico"),
+])
+def test_emergencias_detectadas(symptoms, rule):
+    flag = check(symptoms)
+    assert flag is not None and flag.rule == rule
+
+
+@pytest.mark.parametrize("symptoms", [
+    "No me duele el pecho",
+    "sin dolor en el pecho",
+    "no tengo fiebre ni dolor de pecho",
+    "Tos seca, no me ahogo",
+    "Dolor de cabeza leve desde ayer",
+])
+def test_sintomas_negados_o_leves(symptoms):
+    assert check(symptoms) is None
+
+
+def test_regla_con_requisito_del_formulario():
+    assert check("dolor de cabeza muy intenso", hypertension="No") is None
+    assert check("dolor de cabeza muy intenso", hypertension="Sí").rule == "crisis_hipertensiva"
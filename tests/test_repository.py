@@ -0,0 +1,160 @@
+"""
+Pruebas de conformidad comunes a todos los backends de PatientRepository y AsyncPatientRepository.
+
+Cada prueba se ejecuta contra los repositorios síncronos y asíncronos; los contenedores
+de Cosmos DB son los de fakes.py. Los repositorios asíncronos se usan a través de
+Blocking, que ejecuta cada llamada en el bucle de eventos de la prueba.
+"""
+import asyncio
+import inspect
+
+import pytest
+from azure.cosmos import exceptions
+
+from fakes import AsyncInMemoryContainer, InMemoryContainer
+from repository import (VISIT_SUMMARY_FIELDS, AsyncCosmosPatientRepository, AsyncPartitionedCosmosPatientRepository,
+                        AsyncRepositoryAdapter, CosmosPatientRepository, InMemoryPatientRepository,
+                        PartitionedCosmosPatientRepository, SQLitePatientRepository)
+
+
+class Blocking:
+    """Expone un repositorio asíncrono con llamadas bloqueantes."""
+
+    def __init__(self, repository, loop):
+        self.repository = repository
+        self.loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+        if not inspect.iscoroutinefunction(method):
+            return method
+        return lambda *args, **kwargs: self.loop.run_until_complete(method(*args, **kwargs))
+
+
+BACKENDS = {
+    "memory": lambda tmp_path: InMemoryPatientRepository(),
+    "sqlite": lambda tmp_path: SQLitePatientRepository(str(tmp_path / "saracare.db")),
+    "cosmos": lambda tmp_path: CosmosPatientRepository(InMemoryContainer()),
+    "cosmos-partitioned": lambda tmp_path: PartitionedCosmosPatientRepository(
+        InMemoryContainer(partition_key_path="identification")),
+}
+ASYNC_BACKENDS = {
+    "async-adapter-memory": lambda tmp_path: AsyncRepositoryAdapter(InMemoryPatientRepository()),
+    "async-adapter-sqlite": lambda tmp_path: AsyncRepositoryAdapter(
+        SQLitePatientRepository(str(tmp_path / "saracare.db"))),
+    "async-cosmos": lambda tmp_path: AsyncCosmosPatientRepository(AsyncInMemoryContainer()),
+    "async-cosmos-partitioned": lambda tmp_path: AsyncPartitionedCosmosPatientRepository(
+        AsyncInMemoryContainer(partition_key_path="identification")),
+}
+
+
+@pytest.fixture(params=[*BACKENDS, *ASYNC_BACKENDS])
+def repo(request, tmp_path):
+    if request.param in BACKENDS:
+        yield BACKENDS[request.param](tmp_path)
+        return
+    loop = asyncio.new_event_loop()
+    try:
+        yield Blocking(ASYNC_BACKENDS[request.param](tmp_path), loop)
+    finally:
+        loop.close()
+
+
+def new_visit(repo, identification, **fields):
+    return repo.create_visit({"id": repo.next_visit_id(), "identification": identification, **fields})
+
+
+def test_create_and_get(repo):
+    visit = new_visit(repo, "p1", name="Ana")
+    assert visit["_etag"], "create_visit debe devolver _etag"
+    assert visit["created_at"], "create_visit debe asignar created_at"
+    assert repo.get_visit(visit["id"])["name"] == "Ana"
+    assert repo.get_visit(visit["id"], "p1")["name"] == "Ana"
+
+
+def test_duplicate_create(repo):
+    visit = {"id": repo.next_visit_id(), "identification": "p1"}
+    repo.create_visit(visit)
+    with pytest.raises(exceptions.CosmosResourceExistsError):
+        repo.create_visit(visit)
+
+
+def test_missing_visit(repo):
+    with pytest.raises(exceptions.CosmosResourceNotFoundError):
+        repo.get_visit("no-existe")
+
+
+def test_patch_and_etag(repo):
+    visit = new_visit(repo, "p1", name="Ana")
+    patched = repo.patch_visit(visit, {"symptoms": "tos"})
+    assert patched["symptoms"] == "tos" and patched["name"] == "Ana"
+    assert patched["_etag"] != visit["_etag"], "patch_visit debe cambiar el _etag"
+    with pytest.raises(exceptions.CosmosAccessConditionFailedError):
+        repo.patch_visit(visit, {"symptoms": "fiebre"})
+    assert repo.get_visit(visit["id"])["symptoms"] == "tos"
+
+
+def test_unique_ids(repo):
+    ids = [repo.next_visit_id() for _ in range(100)]
+    assert len(set(ids)) == len(ids), "next_visit_id devolvió IDs repetidos"
+
+
+def test_find_patient(repo):
+    assert repo.find_patient("p1") is None
+    repo.register_patient("p1", "Ana", 30, "Femenino")
+    assert repo.find_patient("p1") == {"identification": "p1", "name": "Ana", "age": 30, "sex": "Femenino"}
+    repo.register_patient("p1", "Ana María", 31, "Femenino")
+    assert repo.find_patient("p1")["name"] == "Ana María", "register_patient debe invalidar la caché"
+
+
+def test_list_visits(repo):
+    created = [new_visit(repo, "p1")["id"] for _ in range(7)]
+    new_visit(repo, "p2")
+    repo.register_patient("p1", "Ana", 30, "Femenino")
+
+    seen, token, pages = [], None, 0
+    while True:
+        page = repo.list_visits("p1", page_size=3, continuation_token=token)
+        assert len(page.items) <= 3
+        seen.extend(item["id"] for item in page.items)
+        pages += 1
+        token = page.continuation_token
+        if not token:
+            break
+    assert sorted(seen) == sorted(created), "la paginación debe devolver cada visita una sola vez"
+    assert pages == 3
+    # El contenedor sin particionar ordena por _ts (segundos) porque las visitas antiguas no tienen created_at
+    visits = [repo.get_visit(visit_id) for visit_id in seen]
+    dates = [visit.get("_ts", visit["created_at"]) for visit in visits]
+    assert dates == sorted(dates, reverse=True), "las visitas deben ir de la más reciente a la más antigua"
+
+
+def test_list_projection(repo):
+    visits = [new_visit(repo, "p1", name="Ana", symptoms="tos", smoking="No"), new_visit(repo, "p1", symptoms="fiebre")]
+    first = repo.list_visits("p1", page_size=1, fields=VISIT_SUMMARY_FIELDS)
+    second = repo.list_visits("p1", page_size=1, continuation_token=first.continuation_token,
+                              fields=VISIT_SUMMARY_FIELDS)
+    expected = [{"id": visit["id"], "created_at": visit["created_at"], "symptoms": visit["symptoms"]}
+                for visit in visits]
+    assert sorted(first.items + second.items, key=lambda item: item["id"]) == sorted(
+        expected, key=lambda item: item["id"]), "la proyección debe traer solo los campos del resumen"
+
+
+def test_list_projection_sin_clave_de_orden(repo):
+    created = [new_visit(repo, "p1", symptoms=f"síntoma {i}")["id"] for i in range(5)]
+    seen, token = [], None
+    while True:
+        page = repo.list_visits("p1", page_size=2, continuation_token=token, fields=("symptoms",))
+        assert all(set(item) == {"symptoms"} for item in page.items), "la proyección debe traer solo symptoms"
+        seen.extend(item["symptoms"] for item in page.items)
+        token = page.continuation_token
+        if not token:
+            break
+    assert sorted(seen) == [f"síntoma {i}" for i in range(len(created))], \
+        "la paginación no debe depender de que la proyección incluya created_at e id"
+
+
+def test_invalid_continuation_token(repo):
+    new_visit(repo, "p1")
+    with pytest.raises(ValueError):
+        repo.list_visits("p1", continuation_token="no-es-un-token")
@@ -0,0 +1,124 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+from fakes import FakeRateLimited, FakeServiceUnavailable, fake_chat_model
+from functions import get_chain
+from resilience import DeadlineExceeded, LLMUnavailableError, ResilientLLM, RetryBudget, is_retryable
+
+INPUTS = {"system_prompt": "Eres un sistema experto en triage médico.", "input": "Paciente con tos."}
+
+
+def chain_call(model):
+    return get_chain(model).invoke(INPUTS)
+
+
+def achain_call(model):
+    return get_chain(model).ainvoke(INPUTS)
+
+
+def p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[math.ceil(0.99 * len(latencies)) - 1]
+
+
+async def latencies(call, calls=200, concurrency=20):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            return time.perf_counter() - start
+
+    return await asyncio.gather(*(one() for _ in range(calls)))
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (FakeServiceUnavailable(), True),
+    (FakeRateLimited(), True),
+    (TimeoutError(), True),
+    (ConnectionError(), True),
+    (type("BadRequestError", (Exception,), {"status_code": 400})(), False),
+    (ValueError("respuesta inválida"), False),
+])
+def test_errores_transitorios(error, retryable):
+    assert is_retryable(error) is retryable
+
+
+def test_hedging_recorta_el_p99():
+    slow = dict(latency=0.01, slow_rate=0.1, slow_latency=0.5)
+    primary = fake_chat_model(seed=1, **slow)
+    unhedged = asyncio.run(latencies(lambda: achain_call(primary)))
+
+    # La lentitud es del deployment principal; el de respaldo está en otra región
+    primary, hedge = fake_chat_model(seed=1, **slow), fake_chat_model(latency=0.01, seed=2)
+    resilient = ResilientLLM(models=lambda: (primary, hedge), hedge_percentile=80, hedge_min_samples=10,
+                             hedge_initial_delay=0.03, budget=RetryBudget(ratio=0.5))
+    hedged = asyncio.run(latencies(lambda: resilient.ainvoke(achain_call)))
+
+    assert hedge.calls > 0
+    assert p99(hedged) < p99(unhedged) / 2
+
+
+def test_breaker_abierto_rechaza_sin_llamar_al_deployment():
+    model = fake_chat_model(failure_rate=1.0, seed=3)
+    resilient = ResilientLLM(models=lambda: (model, None), max_retries=0, breaker_failures=3, breaker_reset=60)
+    for _ in range(3):
+        with pytest.raises(FakeServiceUnavailable):
+            resilient.invoke(chain_call)
+
+    with pytest.raises(LLMUnavailableError) as unavailable:
+        resilient.invoke(chain_call)
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(resilient.ainvoke(achain_call))
+    assert model.calls == 3
+    assert 0 < unavailable.value.retry_after <= 60
+
+
+def test_breaker_abierto_usa_el_deployment_de_respaldo():
+    primary, hedge = fake_chat_model(failure_rate=1.0, seed=4), fake_chat_model(seed=5)
+    resilient = ResilientLLM(models=lambda: (primary, hedge), max_retries=0, breaker_failures=2, breaker_reset=60)
+    for _ in range(2):
+        with pytest.raises(FakeServiceUnavailable):
+            resilient.invoke(chain_call)
+
+    assert resilient.invoke(chain_call)
+    assert (primary.calls, hedge.calls) == (2, 1)
+
+
+def test_reintenta_los_errores_transitorios():
+    model = fake_chat_model(failure_rate=0.5, seed=6)
+    resilient = ResilientLLM(models=lambda: (model, None), max_retries=5, base_delay=0.001, max_delay=0.01,
+                             breaker_failures=100, budget=RetryBudget(ratio=1.0))
+    for _ in range(10):
+        assert resilient.invoke(chain_call)
+    assert model.calls > 10
+
+
+def test_plazo_corta_la_llamada_sincrona():
+    resilient = ResilientLLM(models=lambda: (fake_chat_model(latency=2.0), None), deadline=0.1)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        resilient.invoke(chain_call)
+    assert time.perf_counter() - start < 0.5
+
+
+def test_plazo_corta_la_llamada_asincrona():
+    resilient = ResilientLLM(models=lambda: (fake_chat_model(latency=2.0), None), deadline=0.1)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(resilient.ainvoke(achain_call))
+    assert time.perf_counter() - start < 0.5
+
+
+def test_plazo_incluye_los_reintentos():
+    model = fake_chat_model(latency=0.05, failure_rate=1.0, seed=7)
+    resilient = ResilientLLM(models=lambda: (model, None), deadline=0.2, max_retries=100, base_delay=0.05,
+                             max_delay=0.05, breaker_failures=100, budget=RetryBudget(ratio=100, capacity=100))
+    start = time.perf_counter()
+    with pytest.raises((DeadlineExceeded, FakeServiceUnavailable)):
+        resilient.invoke(chain_call)
+    assert time.perf_counter() - start < 0.4
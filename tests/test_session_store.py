@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from session_store import InMemorySessionStore, SQLiteSessionStore, create_session_store
+
+BACKENDS = {
+    "memory": lambda tmp_path, ttl: InMemorySessionStore(ttl=ttl),
+    "sqlite": lambda tmp_path, ttl: SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=ttl),
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request, tmp_path):
+    return lambda ttl=3600.0: BACKENDS[request.param](tmp_path, ttl)
+
+
+def test_guardar_y_leer_la_sesion(backend):
+    store = backend()
+    token = store.create({"name": "Ana", "visit": {"id": "1"}})
+    assert store.get(token) == {"name": "Ana", "visit": {"id": "1"}}
+
+    data = store.get(token)
+    data["name"] = "Ana María"
+    assert store.get(token)["name"] == "Ana", "modificar lo leído no cambia la sesión guardada"
+    store.set(token, data)
+    assert store.get(token)["name"] == "Ana María"
+
+    store.delete(token)
+    assert store.get(token) is None
+    assert store.get("no-existe") is None
+
+
+def test_la_sesion_expira(backend):
+    store = backend(ttl=0.3)
+    token = store.create({"name": "Ana"})
+    time.sleep(0.2)
+    store.set(token, {"name": "Ana"})
+    time.sleep(0.2)
+    assert store.get(token) == {"name": "Ana"}, "cada escritura renueva la expiración"
+    time.sleep(0.35)
+    assert store.get(token) is None
+
+
+def test_sqlite_comparte_las_sesiones_entre_procesos(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    token = SQLiteSessionStore(path).create({"name": "Ana"})
+    # Otra instancia sobre el mismo archivo, como otro worker de la API o un reinicio
+    assert SQLiteSessionStore(path).get(token) == {"name": "Ana"}
+
+
+def test_sqlite_purga_las_sesiones_expiradas(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=0.05)
+    store.create({"name": "Ana"})
+    time.sleep(0.1)
+    store.create({"name": "Luis"})
+    assert store._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+
+
+def test_backend_segun_el_entorno(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_BACKEND", "sqlite")
+    monkeypatch.setenv("SESSION_DB_PATH", str(tmp_path / "sessions.db"))
+    assert isinstance(create_session_store(), SQLiteSessionStore)
+    monkeypatch.setenv("SESSION_BACKEND", "redis")
+    with pytest.raises(ValueError):
+        create_session_store()
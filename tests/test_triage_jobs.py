@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+from resilience import LLMUnavailableError
+from triage_jobs import (API_JOBS, DONE, FAILED, JOB_ABANDONED_MESSAGE, QUEUED, RUNNING, STREAMLIT_JOBS, JobQueue,
+                         TriageWorkerPool)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease=0.1, max_attempts=2)
+
+
+def test_un_trabajo_se_toma_una_sola_vez(queue):
+    job_id = queue.enqueue({"visit": 1}, session_id="s")
+    job = queue.claim()
+    assert (job.id, job.attempts, job.payload) == (job_id, 1, {"visit": 1})
+    assert queue.claim() is None
+    assert queue.get(job_id)["status"] == RUNNING
+
+
+def test_cada_aplicacion_toma_solo_sus_trabajos(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    api, streamlit = JobQueue(path, kind=API_JOBS), JobQueue(path, kind=STREAMLIT_JOBS)
+    api_job, streamlit_job = api.enqueue({"visit": 1}), streamlit.enqueue({"visit": 2})
+    assert streamlit.claim().id == streamlit_job and streamlit.claim() is None
+    assert api.claim().id == api_job and api.claim() is None
+    assert api.get(streamlit_job)["status"] == RUNNING
+
+
+def test_el_worker_sin_lease_no_pisa_el_resultado(queue):
+    job_id = queue.enqueue({"visit": 1})
+    slow = queue.claim()
+    time.sleep(0.15)
+    retaken = queue.claim()
+    assert retaken.id == job_id and retaken.lease != slow.lease
+
+    assert queue.complete(retaken, {"urgency_level": 2})
+    assert not queue.fail(slow, "error del worker lento")
+    assert not queue.complete(slow, {"urgency_level": 5})
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == (DONE, {"urgency_level": 2})
+
+
+def test_trabajo_abandonado_en_todos_sus_intentos_falla(queue):
+    job_id = queue.enqueue({"visit": 1})
+    for attempt in (1, 2):
+        assert queue.claim().attempts == attempt
+        time.sleep(0.15)
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert (job["status"], job["error"], job["attempts"]) == (FAILED, JOB_ABANDONED_MESSAGE, 2)
+
+
+def test_reintenta_errores_transitorios_hasta_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=3)
+    calls = []
+
+    async def handler(job):
+        calls.append(job.attempts)
+        raise LLMUnavailableError(0.0)
+
+    async def run():
+        pool = TriageWorkerPool(queue, handler, workers=2, retry_delay=0.01, poll_interval=0.01)
+        job_id = queue.enqueue({"visit": 1})
+        pool.start()
+        for _ in range(200):
+            if queue.get(job_id)["status"] not in (QUEUED, RUNNING):
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return queue.get(job_id)
+
+    job = asyncio.run(run())
+    assert job["status"] == FAILED and calls == [1, 2, 3]
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from azure.cosmos import exceptions
+
+from repository import AsyncRepositoryAdapter, InMemoryPatientRepository
+from visit_writes import acommit_visit, asave_fields, astart_visit, commit_visit, save_fields, start_visit
+
+
+class CountingRepository(InMemoryPatientRepository):
+    """Repositorio en memoria que cuenta las escrituras (round trips) de cada tipo."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def create_visit(self, visit):
+        self.writes.append("create")
+        return super().create_visit(visit)
+
+    def patch_visit(self, visit, fields):
+        self.writes.append("patch")
+        return super().patch_visit(visit, fields)
+
+
+def new_visit(repository):
+    return {"id": repository.next_visit_id(), "identification": "p1", "name": "Ana"}
+
+
+def test_modo_normal_escribe_cada_paso_como_patch():
+    repository = CountingRepository()
+    visit = start_visit(repository, new_visit(repository))
+    visit = save_fields(repository, visit, {"symptoms": "tos"})
+    visit = save_fields(repository, visit, {"diagnosis": "resfriado"})
+    assert commit_visit(repository, visit) is visit
+    assert repository.writes == ["create", "patch", "patch"]
+    stored = repository.get_visit(visit["id"])
+    assert stored == visit and stored["symptoms"] == "tos" and stored["diagnosis"] == "resfriado"
+
+
+def test_modo_borrador_escribe_la_visita_una_sola_vez():
+    repository = CountingRepository()
+    draft = new_visit(repository)
+    visit = start_visit(repository, draft, draft=True)
+    assert visit == draft and visit is not draft
+    visit = save_fields(repository, visit, {"symptoms": "tos"}, draft=True)
+    visit = save_fields(repository, visit, {"diagnosis": "resfriado"}, draft=True)
+    assert repository.writes == []
+    with pytest.raises(exceptions.CosmosResourceNotFoundError):
+        repository.get_visit(visit["id"])
+
+    visit = commit_visit(repository, visit, draft=True)
+    assert repository.writes == ["create"] and visit["_etag"]
+    assert repository.get_visit(visit["id"])["diagnosis"] == "resfriado"
+
+
+def test_modo_borrador_vuelve_a_patch_despues_de_escribir():
+    repository = CountingRepository()
+    visit = commit_visit(repository, start_visit(repository, new_visit(repository), draft=True), draft=True)
+    visit = save_fields(repository, visit, {"symptoms": "fiebre"}, draft=True)
+    assert commit_visit(repository, visit, draft=True) is visit
+    assert repository.writes == ["create", "patch"]
+    assert repository.get_visit(visit["id"])["symptoms"] == "fiebre"
+
+
+def test_version_desactualizada_no_pisa_los_cambios_de_otra_sesion():
+    repository = CountingRepository()
+    visit = start_visit(repository, new_visit(repository))
+    save_fields(repository, visit, {"symptoms": "tos"})
+    with pytest.raises(exceptions.CosmosAccessConditionFailedError):
+        save_fields(repository, visit, {"symptoms": "fiebre"}, draft=True)
+    assert repository.get_visit(visit["id"])["symptoms"] == "tos"
+
+
+def test_versiones_asincronas():
+    repository = CountingRepository()
+    adapter = AsyncRepositoryAdapter(repository)
+
+    async def steps(draft):
+        visit = await astart_visit(adapter, new_visit(repository), draft=draft)
+        visit = await asave_fields(adapter, visit, {"symptoms": "tos"}, draft=draft)
+        visit = await asave_fields(adapter, visit, {"diagnosis": "resfriado"}, draft=draft)
+        return await acommit_visit(adapter, visit, draft=draft)
+
+    visit = asyncio.run(steps(draft=False))
+    assert repository.writes == ["create", "patch", "patch"]
+    assert repository.get_visit(visit["id"]) == visit
+
+    repository.writes.clear()
+    visit = asyncio.run(steps(draft=True))
+    assert repository.writes == ["create"]
+    assert repository.get_visit(visit["id"])["diagnosis"] == "resfriado"
@@ -0,0 +1,49 @@
+from waiting_room import WaitingRoom
+
+
+def visit_ids(room):
+    return [entry["visit_id"] for entry in room.snapshot()]
+
+
+def test_sale_primero_el_mas_urgente_y_a_igual_nivel_el_que_llego_antes():
+    room = WaitingRoom()
+    for visit_id, urgency_level in (("a", 3), ("b", 1), ("c", 3), ("d", 2)):
+        room.push(visit_id, urgency_level, {"name": visit_id.upper()})
+    assert visit_ids(room) == ["b", "d", "a", "c"]
+    assert room.peek()["visit_id"] == "b"
+    assert [room.pop()["visit_id"] for _ in range(4)] == ["b", "d", "a", "c"]
+    assert room.pop() is None and len(room) == 0
+
+
+def test_sin_nivel_de_urgencia_entra_con_el_nivel_por_defecto():
+    room = WaitingRoom(unknown_urgency=2)
+    room.push("a", 3)
+    room.push("b", None)
+    patient = room.pop()
+    assert patient["visit_id"] == "b" and patient["urgency_level"] is None
+
+
+def test_quitar_marca_la_entrada_y_se_descarta_al_llegar_a_la_cima():
+    room = WaitingRoom()
+    for visit_id, urgency_level in (("a", 1), ("b", 2), ("c", 3)):
+        room.push(visit_id, urgency_level)
+    assert room.remove("a") and not room.remove("a")
+    assert "a" not in room and len(room) == 2
+    # La entrada sigue en el heap hasta que llega a la cima
+    assert len(room._heap) == 3
+    assert room.peek()["visit_id"] == "b" and len(room._heap) == 2
+    assert [room.pop()["visit_id"], room.pop()["visit_id"], room.pop()] == ["b", "c", None]
+
+
+def test_reencolar_cambia_la_prioridad_y_conserva_la_llegada():
+    room = WaitingRoom()
+    room.push("a", 3, {"name": "Ana"})
+    first = room.snapshot()[0]
+    room.push("b", 2)
+    room.push("c", 2)
+    room.push("a", 2, {"name": "Ana", "symptoms": "fiebre"})
+    assert visit_ids(room) == ["a", "b", "c"], "a igual nivel, la visita re-priorizada conserva su llegada"
+    assert len(room) == 3
+    patient = room.pop()
+    assert patient["symptoms"] == "fiebre" and patient["queued_at"] == first["queued_at"]
+    assert [room.pop()["visit_id"], room.pop()["visit_id"], room.pop()] == ["b", "c", None]
@@ -0,0 +1,377 @@
+"""
+Cola de trabajos de triage en SQLite y pool de workers asíncronos.
+
+En modo trabajo el triage no mantiene abierta la conexión HTTP mientras el LLM
+responde: POST /triage/jobs encola la visita y devuelve el ID del trabajo, un worker
+llama al LLM, guarda el resultado en la visita y lo deja en la cola, y el cliente
+consulta GET /triage/jobs/{id} (o el paso 5 de app.py) hasta que termina.
+
+La cola es un archivo SQLite local en modo WAL, compartido por los procesos de la
+máquina, así que los trabajos sobreviven a un reinicio. La API (main.py) y app.py
+pueden compartir el archivo: cada trabajo lleva el tipo de la aplicación que lo
+encoló y cada worker solo toma los de su tipo, porque al terminar un trabajo de la API
+hay que actualizar la sesión y la sala de espera de ese proceso. Cada worker toma un trabajo
+por un plazo (lease); si el proceso se cae, el trabajo vuelve a estar disponible
+cuando el plazo vence. Un worker solo registra el resultado mientras conserva su
+lease, así que un worker lento no pisa el de otro que retomó el trabajo. Los errores
+transitorios del LLM (servicio no disponible o plazo vencido) se reintentan con
+espera creciente hasta TRIAGE_JOB_MAX_ATTEMPTS; un trabajo que agotó sus intentos
+con el lease vencido (el worker se cayó en cada uno) y cualquier otro error lo marcan
+como fallido.
+
+Las operaciones de la cola son llamadas bloqueantes a SQLite; el pool las ejecuta
+en hilos para no detener el bucle de eventos.
+
+Uso:
+    python triage_jobs.py --workers 8    # workers de app.py en un proceso aparte
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from azure.cosmos import exceptions
+
+import metrics
+import red_flags
+from functions import agenerate_triage, triage_fields
+from repository import AsyncRepositoryAdapter
+from resilience import DeadlineExceeded, LLMUnavailableError
+from visit_writes import acommit_visit, asave_fields
+
+TRIAGE_JOBS_DB_PATH = os.getenv("TRIAGE_JOBS_DB_PATH", "triage_jobs.db")
+TRIAGE_WORKERS = int(os.getenv("TRIAGE_WORKERS", "4"))
+# Debe superar el plazo total de una llamada al LLM (LLM_DEADLINE)
+TRIAGE_JOB_LEASE = float(os.getenv("TRIAGE_JOB_LEASE", "120"))
+TRIAGE_JOB_MAX_ATTEMPTS = int(os.getenv("TRIAGE_JOB_MAX_ATTEMPTS", "3"))
+TRIAGE_JOB_RETRY_DELAY = float(os.getenv("TRIAGE_JOB_RETRY_DELAY", "2"))
+TRIAGE_JOB_POLL_INTERVAL = float(os.getenv("TRIAGE_JOB_POLL_INTERVAL", "1"))
+# Los trabajos terminados se conservan este tiempo para que el cliente lea el resultado
+TRIAGE_JOB_TTL = float(os.getenv("TRIAGE_JOB_TTL", "86400"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+# Aplicación que encoló el trabajo: solo la procesan workers del mismo tipo
+API_JOBS, STREAMLIT_JOBS = "api", "streamlit"
+
+# `lease` identifica la toma del trabajo; completarlo, reintentarlo o marcarlo como fallido la exige
+Job = namedtuple("Job", ["id", "payload", "attempts", "session_id", "wait", "lease"])
+
+JOB_CONFLICT_MESSAGE = "La visita fue modificada desde otra sesión mientras se generaba el triage."
+JOB_UNAVAILABLE_MESSAGE = "El servicio de triage no respondió tras varios intentos."
+JOB_ABANDONED_MESSAGE = "El triage se interrumpió en cada uno de sus intentos."
+
+
+class JobQueue:
+    """
+    Cola durable de trabajos de triage en un archivo SQLite.
+
+    Usa una conexión por hilo y modo WAL, igual que SQLiteSessionStore. Tomar un
+    trabajo es una sola sentencia UPDATE ... RETURNING, así que dos workers (del mismo
+    proceso o de procesos distintos) nunca toman el mismo trabajo a la vez.
+
+    Args:
+        kind (str): Tipo de los trabajos que encola y toma esta cola (API_JOBS o STREAMLIT_JOBS).
+    """
+
+    _AVAILABLE = ("SELECT {columns} FROM jobs WHERE kind = ? AND ((status = ? AND available_at <= ?) "
+                  "OR (status = ? AND lease_until < ?))")
+
+    def __init__(self, path=TRIAGE_JOBS_DB_PATH, kind=API_JOBS, lease=TRIAGE_JOB_LEASE, ttl=TRIAGE_JOB_TTL,
+                 max_attempts=TRIAGE_JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.kind = kind
+        self.lease = lease
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, session_id TEXT, "
+                "payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "available_at REAL NOT NULL, lease_until REAL, lease_token TEXT, created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (kind, status, available_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload, session_id=None):
+        """
+        Encola un trabajo.
+
+        Args:
+            payload (dict): Datos del trabajo (ver triage_payload).
+            session_id (str): Sesión dueña del trabajo; solo ella puede consultarlo en la API.
+
+        Returns:
+            str: ID del trabajo.
+        """
+        job_id = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, now - self.ttl))
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, session_id, payload, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, self.kind, QUEUED, session_id, json.dumps(payload), now, now, now),
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Toma el trabajo disponible más antiguo de su tipo (o uno cuyo lease venció) y
+        devuelve un Job, o None.
+        """
+        now = time.time()
+        conn = self._connection()
+        # Lectura sin bloqueo de escritura: con la cola vacía los workers en espera no compiten por el archivo
+        available = conn.execute(self._AVAILABLE.format(columns="1") + " LIMIT 1",
+                                 (self.kind, QUEUED, now, RUNNING, now))
+        if available.fetchone() is None:
+            return None
+        lease = secrets.token_urlsafe(8)
+        with conn:
+            # Con el lease vencido tras el último intento, el worker se cayó en todos: no se reintenta más
+            abandoned = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, lease_token = NULL, updated_at = ? "
+                "WHERE kind = ? AND status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, JOB_ABANDONED_MESSAGE, now, self.kind, RUNNING, now, self.max_attempts),
+            ).rowcount
+            row = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, lease_token = ?, "
+                "updated_at = ? WHERE id = (" + self._AVAILABLE.format(columns="id") + " ORDER BY available_at "
+                "LIMIT 1) RETURNING id, payload, attempts, session_id, available_at",
+                (RUNNING, now + self.lease, lease, now, self.kind, QUEUED, now, RUNNING, now),
+            ).fetchone()
+        if abandoned:
+            metrics.TRIAGE_JOBS.inc(abandoned, status=FAILED)
+        if row is None:
+            return None
+        job_id, payload, attempts, session_id, available_at = row
+        return Job(job_id, json.loads(payload), attempts, session_id, max(0.0, now - available_at), lease)
+
+    def _finish(self, job, status, result=None, error=None, available_at=None):
+        now = time.time()
+        with self._connection() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, available_at = COALESCE(?, available_at), "
+                "lease_until = NULL, lease_token = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (status, json.dumps(result) if result is not None else None, error, available_at, now,
+                 job.id, RUNNING, job.lease),
+            ).rowcount
+        return updated == 1
+
+    def complete(self, job, result):
+        """
+        Marca el trabajo como terminado con su resultado (un dict serializable a JSON).
+
+        Como retry y fail, devuelve False sin cambiar nada si el worker ya no tiene el
+        lease del trabajo (venció y otro worker lo tomó).
+        """
+        return self._finish(job, DONE, result=result)
+
+    def retry(self, job, delay, error):
+        """Devuelve el trabajo a la cola para reintentarlo dentro de `delay` segundos."""
+        return self._finish(job, QUEUED, error=error, available_at=time.time() + delay)
+
+    def fail(self, job, error):
+        """Marca el trabajo como fallido."""
+        return self._finish(job, FAILED, error=error)
+
+    def get(self, job_id):
+        """Devuelve el estado del trabajo como dict, o None si no existe o ya se purgó."""
+        row = self._connection().execute(
+            "SELECT id, status, session_id, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, status, session_id, result, error, attempts, created_at, updated_at = row
+        return {"id": job_id, "status": status, "session_id": session_id,
+                "result": json.loads(result) if result else None, "error": error, "attempts": attempts,
+                "created_at": created_at, "updated_at": updated_at}
+
+    def pending(self):
+        """Cantidad de trabajos de su tipo en cola o en curso."""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE kind = ? AND status IN (?, ?)", (self.kind, QUEUED, RUNNING)).fetchone()[0]
+
+
+def triage_payload(system_prompt, pregunta, visit, use_cache=True, flag=None, draft=False):
+    """Datos que necesita un worker para completar el triage de una visita."""
+    return {
+        "system_prompt": system_prompt,
+        "pregunta": pregunta,
+        "visit": visit,
+        "use_cache": use_cache,
+        "red_flag": flag._asdict() if flag else None,
+        "draft": draft,
+    }
+
+
+async def run_triage_job(repository, payload):
+    """
+    Llama al LLM, aplica la señal de alarma y guarda el resultado en la visita.
+
+    Args:
+        repository (AsyncPatientRepository): Repositorio de pacientes.
+        payload (dict): Datos del trabajo creados con triage_payload.
+
+    Returns:
+        tuple: (TriageResult, visita guardada).
+
+    Raises:
+        CosmosAccessConditionFailedError: Si la visita cambió desde que se encoló el trabajo.
+    """
+    flag = red_flags.RedFlag(**payload["red_flag"]) if payload.get("red_flag") else None
+    result = red_flags.combine(await agenerate_triage(payload["system_prompt"], payload["pregunta"],
+                                                      use_cache=payload.get("use_cache", True)), flag)
+    draft = payload.get("draft", False)
+    visit = await asave_fields(repository, payload["visit"], triage_fields(result), draft=draft)
+    visit = await acommit_visit(repository, visit, draft=draft)
+    return result, visit
+
+
+def job_result(result, visit, flag=None):
+    """Resultado que se guarda en la cola al terminar un trabajo."""
+    return {**triage_fields(result), "red_flag": flag["rule"] if flag else None, "visit": visit}
+
+
+class TriageWorkerPool:
+    """
+    Pool de workers asíncronos que procesan la cola en el bucle de eventos actual.
+
+    Args:
+        queue (JobQueue): Cola de trabajos; su `max_attempts` limita los intentos por
+            trabajo ante errores transitorios del LLM.
+        handler: Corrutina handler(job) que procesa un Job y devuelve su resultado.
+        workers (int): Trabajos que se procesan a la vez.
+        retry_delay (float): Espera base entre intentos; se duplica en cada intento.
+        poll_interval (float): Espera máxima sin trabajos antes de volver a consultar la
+            cola (para trabajos encolados por otros procesos).
+    """
+
+    def __init__(self, queue, handler, workers=TRIAGE_WORKERS, retry_delay=TRIAGE_JOB_RETRY_DELAY,
+                 poll_interval=TRIAGE_JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work(), name=f"triage-worker-{n}") for n in range(self.workers)]
+
+    def notify(self):
+        """Despierta a los workers en espera; se llama al encolar un trabajo en este proceso."""
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run(job)
+
+    async def run(self, job):
+        """Procesa un trabajo y registra su resultado, su reintento o su fallo en la cola."""
+        with metrics.endpoint("triage-jobs"):
+            metrics.TRIAGE_JOB_WAIT_SECONDS.observe(job.wait)
+            try:
+                result = await self.handler(job)
+            except (LLMUnavailableError, DeadlineExceeded) as e:
+                if job.attempts < self.queue.max_attempts:
+                    delay = max(getattr(e, "retry_after", 0.0), self.retry_delay * 2 ** (job.attempts - 1))
+                    await self._record(self.queue.retry, job, "retry", delay, JOB_UNAVAILABLE_MESSAGE)
+                else:
+                    await self._record(self.queue.fail, job, FAILED, JOB_UNAVAILABLE_MESSAGE)
+            except exceptions.CosmosAccessConditionFailedError:
+                await self._record(self.queue.fail, job, FAILED, JOB_CONFLICT_MESSAGE)
+            except Exception as e:
+                await self._record(self.queue.fail, job, FAILED, f"Error al generar el triage: {e}")
+            else:
+                await self._record(self.queue.complete, job, DONE, result)
+
+    @staticmethod
+    async def _record(operation, job, status, *args):
+        if await asyncio.to_thread(operation, job, *args):
+            metrics.TRIAGE_JOBS.inc(status=status)
+        else:
+            # El lease venció mientras se procesaba y otro worker retomó el trabajo
+            metrics.TRIAGE_JOBS.inc(status="lease_lost")
+
+
+async def serve(queue, repository, workers=TRIAGE_WORKERS, stop=None):
+    """Procesa la cola con `workers` workers que solo escriben la visita, hasta que se active `stop`."""
+    async def handler(job):
+        result, visit = await run_triage_job(repository, job.payload)
+        return job_result(result, visit, job.payload.get("red_flag"))
+
+    pool = TriageWorkerPool(queue, handler, workers=workers)
+    pool.start()
+    try:
+        await (stop.wait() if stop else asyncio.Event().wait())
+    finally:
+        await pool.stop()
+
+
+def start_worker_thread(queue, repository, workers=TRIAGE_WORKERS):
+    """
+    Arranca el pool en un hilo con su propio bucle de eventos, para procesos que no son
+    asíncronos (Streamlit). `repository` es un repositorio síncrono y se usa con
+    AsyncRepositoryAdapter, así que el pool ve las mismas visitas que el resto del proceso.
+    """
+    thread = threading.Thread(target=asyncio.run, args=(serve(queue, AsyncRepositoryAdapter(repository), workers),),
+                              name="triage-workers", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=TRIAGE_WORKERS, help="Trabajos que se procesan a la vez")
+    parser.add_argument("--db", default=TRIAGE_JOBS_DB_PATH, help="Archivo SQLite de la cola")
+    parser.add_argument("--kind", choices=(STREAMLIT_JOBS, API_JOBS), default=STREAMLIT_JOBS,
+                        help="Trabajos que se procesan. Los de la API no actualizan su sesión ni su sala de espera")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from repository import async_repository
+
+    async def run():
+        async with async_repository() as repository:
+            await serve(JobQueue(args.db, kind=args.kind), repository, workers=args.workers)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
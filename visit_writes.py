@@ -0,0 +1,71 @@
+"""
+Escritura de una visita paso a paso con el mínimo de round trips.
+
+Cada paso envía solo los campos que cambiaron como actualización parcial (patch),
+protegida con el ETag de la última versión conocida de la visita. La versión devuelta
+por el repositorio se guarda en la sesión, así que no hace falta volver a leer el documento.
+
+En modo borrador (draft=True) los pasos intermedios solo se acumulan en la copia
+local y la visita completa se escribe una única vez en commit_visit. Una vez escrita
+(la copia local ya tiene `_etag`), los cambios posteriores vuelven a ser patches.
+"""
+
+
+def _pending(visit, draft):
+    return draft and "_etag" not in visit
+
+
+def start_visit(repository, visit, draft=False):
+    """Crea la visita; en modo borrador solo devuelve la copia local."""
+    if draft:
+        return dict(visit)
+    return repository.create_visit(visit)
+
+
+def save_fields(repository, visit, fields, draft=False):
+    """
+    Guarda los campos indicados en la visita.
+
+    Args:
+        repository (PatientRepository): Repositorio de pacientes.
+        visit (dict): Última versión conocida de la visita.
+        fields (dict): Campos a actualizar.
+        draft (bool): Si es True y la visita aún no se escribió, solo se actualiza la copia local.
+
+    Returns:
+        dict: Nueva versión de la visita.
+
+    Raises:
+        CosmosAccessConditionFailedError: Si otra sesión modificó la visita.
+    """
+    if _pending(visit, draft):
+        return {**visit, **fields}
+    return repository.patch_visit(visit, fields)
+
+
+def commit_visit(repository, visit, draft=False):
+    """Escribe la visita completa en modo borrador; en modo normal ya está guardada."""
+    if _pending(visit, draft):
+        return repository.create_visit(visit)
+    return visit
+
+
+async def astart_visit(repository, visit, draft=False):
+    """Versión asíncrona de start_visit."""
+    if draft:
+        return dict(visit)
+    return await repository.create_visit(visit)
+
+
+async def asave_fields(repository, visit, fields, draft=False):
+    """Versión asíncrona de save_fields."""
+    if _pending(visit, draft):
+        return {**visit, **fields}
+    return await repository.patch_visit(visit, fields)
+
+
+async def acommit_visit(repository, visit, draft=False):
+    """Versión asíncrona de commit_visit."""
+    if _pending(visit, draft):
+        return await repository.create_visit(visit)
+    return visit
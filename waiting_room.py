@@ -0,0 +1,109 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Nivel con el que entra a la cola un paciente cuyo triage no trajo nivel de urgencia
+WAITING_ROOM_UNKNOWN_URGENCY = int(os.getenv("WAITING_ROOM_UNKNOWN_URGENCY", "3"))
+
+
+class WaitingRoom:
+    """
+    Cola de prioridad de pacientes en sala de espera, respaldada por un heap.
+
+    Sale primero el paciente más urgente (nivel 1) y, a igual nivel, el que llegó antes.
+    Insertar y sacar cuestan O(log n). Volver a encolar una visita reemplaza su
+    prioridad anterior y quitar una visita es O(1): las entradas viejas se marcan como
+    eliminadas y se descartan al llegar a la cima del heap.
+
+    Una visita re-priorizada conserva su orden de llegada. Es segura para hilos.
+
+    La cola vive en la memoria del proceso, así que cada proceso de la API tiene la
+    suya. Con varios workers de uvicorn (--workers), un paciente entra en la cola del
+    worker que atendió su triage, y /waiting-room/ y /waiting-room/next solo ven la
+    cola del worker que recibe la petición: dos llamadas seguidas pueden listar
+    pacientes distintos o no sacar al más urgente de la sala. Para una sala de espera
+    común hay que ejecutar la API con un solo worker.
+
+    Args:
+        unknown_urgency (int): Nivel asignado a los pacientes sin nivel de urgencia.
+    """
+
+    def __init__(self, unknown_urgency=WAITING_ROOM_UNKNOWN_URGENCY):
+        self.unknown_urgency = unknown_urgency
+        self._heap = []
+        self._entries = {}
+        self._arrivals = itertools.count()
+        # Desempata una entrada re-priorizada con la entrada eliminada que reemplaza
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+
+    def push(self, visit_id, urgency_level, patient=None):
+        """
+        Encola una visita o, si ya está en la cola, cambia su prioridad y sus datos.
+
+        Args:
+            visit_id (str): ID de la visita.
+            urgency_level (int): Nivel de urgencia de 1 (inmediato) a 5 (no urgente), o None.
+            patient (dict): Datos a devolver junto con la visita (nombre, motivo, etc.).
+
+        Returns:
+            dict: Entrada encolada.
+        """
+        priority = urgency_level if urgency_level is not None else self.unknown_urgency
+        with self._lock:
+            previous = self._entries.pop(visit_id, None)
+            if previous is not None:
+                arrival, queued_at = previous[1], previous[-1]["queued_at"]
+                previous[-1] = None
+            else:
+                arrival, queued_at = next(self._arrivals), time.time()
+            entry_data = {
+                **(patient or {}), "visit_id": visit_id, "urgency_level": urgency_level, "queued_at": queued_at,
+            }
+            entry = [priority, arrival, next(self._versions), entry_data]
+            self._entries[visit_id] = entry
+            heapq.heappush(self._heap, entry)
+            return dict(entry_data)
+
+    def _discard_removed(self):
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+
+    def pop(self):
+        """Saca y devuelve al paciente más urgente, o None si la sala está vacía."""
+        with self._lock:
+            self._discard_removed()
+            if not self._heap:
+                return None
+            entry = heapq.heappop(self._heap)
+            del self._entries[entry[-1]["visit_id"]]
+            return entry[-1]
+
+    def peek(self):
+        """Devuelve al paciente más urgente sin sacarlo de la cola."""
+        with self._lock:
+            self._discard_removed()
+            return dict(self._heap[0][-1]) if self._heap else None
+
+    def remove(self, visit_id):
+        """Quita una visita de la cola (p. ej. si el paciente se retiró). Devuelve False si no estaba."""
+        with self._lock:
+            entry = self._entries.pop(visit_id, None)
+            if entry is None:
+                return False
+            entry[-1] = None
+            return True
+
+    def snapshot(self):
+        """Devuelve la cola completa en orden de atención, sin modificarla."""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry[:2])
+            return [dict(entry[-1]) for entry in entries]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, visit_id):
+        return visit_id in self._entries